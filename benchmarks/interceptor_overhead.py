@@ -0,0 +1,122 @@
+"""Per-call overhead of an intercepted service method compared to a plain method call.
+
+Run from the repository root: ``python -m benchmarks.interceptor_overhead``
+
+Target: a pass-through layer costs as much as a hand written forwarding wrapper,
+``def wrapper(*args, **kwargs): return fn(*args, **kwargs)``, which is the floor for any Python
+decorator. On CPython 3.11 that is about 0.2 us per sync layer and 0.3 us per coroutine layer, against
+0.1 us for a plain call: interception isn't free, it is as cheap as decorating the method by hand.
+``tests/test_interceptor.py`` fails when a chain gets more than twice as slow as the hand written one.
+"""
+import asyncio
+import functools
+import timeit
+from typing import Callable, List
+
+from injector import Injector, Module, inject, multiprovider, singleton
+
+from common.interceptor import Interceptor, pointcut
+from common.utils import InjectorUtils
+
+__NOOP__ = object()
+
+LAYERS = 3
+
+
+class NoopInterceptor(Interceptor):
+    @property
+    def pointcut(self):
+        return __NOOP__
+
+    def handle(self, fn: Callable, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    async def handle_async(self, fn: Callable, *args, **kwargs):
+        return await fn(*args, **kwargs)
+
+
+class NoopModule(Module):
+    @multiprovider
+    def provide_interceptors(self) -> List[Interceptor]:
+        return [NoopInterceptor() for _ in range(LAYERS)]
+
+
+@inject
+@singleton
+class Service:
+    def __init__(self) -> None:
+        super().__init__()
+
+    def plain(self, x: int):
+        return x
+
+    @pointcut(__NOOP__)
+    def intercepted(self, x: int):
+        return x
+
+    async def plain_async(self, x: int):
+        return x
+
+    @pointcut(__NOOP__)
+    async def intercepted_async(self, x: int):
+        return x
+
+
+def by_hand(fn: Callable, layers: int = LAYERS) -> Callable:
+    """``fn`` wrapped in ``layers`` hand written forwarding decorators, the baseline of a chain."""
+    for _ in range(layers):
+        if asyncio.iscoroutinefunction(fn):
+            def wrap(inner):
+                @functools.wraps(inner)
+                async def wrapper(*args, **kwargs):
+                    return await inner(*args, **kwargs)
+
+                return wrapper
+        else:
+            def wrap(inner):
+                @functools.wraps(inner)
+                def wrapper(*args, **kwargs):
+                    return inner(*args, **kwargs)
+
+                return wrapper
+        fn = wrap(fn)
+    return fn
+
+
+def measure(fn: Callable, number: int) -> float:
+    return min(timeit.repeat(lambda: fn(1), number=number, repeat=5)) / number * 1e9
+
+
+def measure_async(fn: Callable, number: int) -> float:
+    async def run():
+        for _ in range(number):
+            await fn(1)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return min(timeit.repeat(lambda: loop.run_until_complete(run()), number=1, repeat=5)) / number * 1e9
+    finally:
+        loop.close()
+
+
+def timings(number: int = 200000) -> dict:
+    """Nanoseconds per call of the plain, hand wrapped and intercepted methods, sync and async."""
+    InjectorUtils.patch_injector()
+    service = Injector([NoopModule()]).get(Service)
+    return dict(sync=dict(plain=measure(service.plain, number),
+                          by_hand=measure(by_hand(service.plain), number),
+                          intercepted=measure(service.intercepted, number)),
+                async_=dict(plain=measure_async(service.plain_async, number),
+                            by_hand=measure_async(by_hand(service.plain_async), number),
+                            intercepted=measure_async(service.intercepted_async, number)))
+
+
+def main(number: int = 200000):
+    for name, timing in timings(number).items():
+        print('{:6} {} layers  plain {:8.1f} ns  by hand {:8.1f} ns  intercepted {:8.1f} ns  ratio {:4.2f}'
+              .format(name.rstrip('_'), LAYERS, timing['plain'], timing['by_hand'], timing['intercepted'],
+                      timing['intercepted'] / timing['by_hand']))
+
+
+if __name__ == '__main__':
+    main()
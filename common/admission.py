@@ -0,0 +1,169 @@
+import hashlib
+import logging
+import math
+import threading
+from typing import Optional
+
+from injector import singleton, inject
+from redis import RedisError
+from redis.asyncio import Redis as AsyncRedis
+from starlette.config import Config
+from starlette.responses import JSONResponse
+
+LOGGER = logging.getLogger(__name__)
+
+ADMISSION_KEY = '__admission__'
+
+# Token buckets of the route and of the user, a request takes one token from both or none.
+# ARGV: route rate, route burst, user rate, user burst (rates in tokens per second, 0 disables the bucket)
+# Returns {allowed, milliseconds until a token is available}
+__TOKEN_BUCKET__ = """
+local time = redis.call('time')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local tokens = {}
+local wait = 0
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    if rate > 0 then
+        local bucket = redis.call('hmget', KEYS[i], 'tokens', 'ts')
+        local available = tonumber(bucket[1]) or burst
+        local ts = tonumber(bucket[2]) or now
+        available = math.min(burst, available + math.max(0, now - ts) * rate / 1000)
+        tokens[i] = available
+        if available < 1 then
+            wait = math.max(wait, math.ceil((1 - available) * 1000 / rate))
+        end
+    end
+end
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    if rate > 0 then
+        local burst = tonumber(ARGV[i * 2])
+        local left = tokens[i]
+        if wait == 0 then
+            left = left - 1
+        end
+        redis.call('hset', KEYS[i], 'tokens', tostring(left), 'ts', now)
+        redis.call('pexpire', KEYS[i], math.ceil(burst * 1000 / rate) + 1000)
+    end
+end
+if wait == 0 then
+    return {1, 0}
+end
+return {0, wait}
+"""
+
+
+def admission(rate: float = 0, burst: int = None, user_rate: float = 0, user_burst: int = None,
+              concurrency: int = None):
+    """Admission control of a controller route.
+
+    ``rate`` requests per second are admitted on the route across all workers, ``user_rate`` per
+    ``ac_token``, with bursts up to ``burst``/``user_burst``. At most ``concurrency`` requests of
+    the route run at once in each worker. Rejected requests get a 429 or 503 with ``Retry-After``.
+    """
+
+    def decorator(fn):
+        setattr(fn, ADMISSION_KEY, dict(rate=rate, burst=burst or max(1, int(math.ceil(rate))),
+                                        user_rate=user_rate, user_burst=user_burst or max(1, int(math.ceil(user_rate))),
+                                        concurrency=concurrency))
+        return fn
+
+    return decorator
+
+
+class RouteLimiter:
+    """Token buckets and concurrency limit of one route template, see :func:`admission`."""
+
+    def __init__(self, controller: 'AdmissionController', route: str, rate: float, burst: int,
+                 user_rate: float, user_burst: int, concurrency: Optional[int]) -> None:
+        super().__init__()
+        self.controller = controller
+        self.route = route
+        self.args = [rate, burst, user_rate, user_burst]
+        self.limited = rate > 0 or user_rate > 0
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def keys(self, ac_token: Optional[str]):
+        keys = ['admission:' + self.route]
+        if ac_token:
+            keys.append('admission:' + self.route + ':' + hashlib.sha1(ac_token.encode()).hexdigest()[:16])
+        return keys
+
+    async def enter_async(self, ac_token: Optional[str] = None) -> Optional[JSONResponse]:
+        """Admit a request, or return the response rejecting it. Admitted requests must call :meth:`exit`.
+
+        Runs on the event loop, before a sync controller is handed to the threadpool.
+        """
+        rejected = self.acquire()
+        if rejected is not None or not self.limited:
+            return rejected
+        keys = self.keys(ac_token)
+        try:
+            allowed, wait = await self.controller.take_async(keys=keys, args=self.args[:len(keys) * 2])
+        except RedisError as ex:
+            LOGGER.warning('Admission of %s skipped: %s', self.route, ex)
+            return None
+        except BaseException:
+            # Any other error or a cancelled request never reaches the caller's exit()
+            self.exit()
+            raise
+        return self.reject_rate(allowed, wait)
+
+    def acquire(self) -> Optional[JSONResponse]:
+        if self.concurrency is None:
+            return None
+        with self._lock:
+            if self.in_flight >= self.concurrency:
+                self.controller.count('overloaded')
+                return JSONResponse(status_code=503, headers={'Retry-After': '1'},
+                                    content={'message': 'Máy chủ đang bận, vui lòng thử lại sau'})
+            self.in_flight += 1
+        return None
+
+    def reject_rate(self, allowed: int, wait: int) -> Optional[JSONResponse]:
+        if allowed:
+            return None
+        self.exit()
+        self.controller.count('throttled')
+        return JSONResponse(status_code=429, headers={'Retry-After': str(max(1, int(math.ceil(wait / 1000))))},
+                            content={'message': 'Quá nhiều yêu cầu, vui lòng thử lại sau'})
+
+    def exit(self):
+        if self.concurrency is None:
+            return
+        with self._lock:
+            self.in_flight -= 1
+
+
+@inject
+@singleton
+class AdmissionController:
+    """Creates the :class:`RouteLimiter` of routes decorated with :func:`admission`.
+
+    ``ADMISSION_ENABLED=false`` turns admission control off, Redis errors let requests through.
+    """
+
+    def __init__(self, async_redis: AsyncRedis, config: Config) -> None:
+        super().__init__()
+        self.enabled = config('ADMISSION_ENABLED', cast=bool, default=True)
+        self.take_async = async_redis.register_script(__TOKEN_BUCKET__)
+        self._metrics = dict(throttled=0, overloaded=0)
+        self._lock = threading.Lock()
+
+    def limiter(self, route: str, fn) -> Optional[RouteLimiter]:
+        rule = getattr(fn, ADMISSION_KEY, None)
+        if rule is None or not self.enabled:
+            return None
+        return RouteLimiter(self, route, **rule)
+
+    def count(self, counter: str):
+        with self._lock:
+            self._metrics[counter] += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return dict(self._metrics)
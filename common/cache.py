@@ -1,56 +1,663 @@
+import asyncio
+import dataclasses
+import hashlib
+import inspect
 import logging
-import pickle
-from typing import Callable, Optional
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Callable, Iterable, List, Optional
 
+import orjson
 from injector import singleton, inject
-from redis import Redis
+from pydantic import BaseModel
+from redis import Redis, RedisError
+from redis.asyncio import Redis as AsyncRedis
+from starlette.config import Config
+from starlette.responses import Response
 
+from common.codec import Codec, CodecError, PICKLE, encode, decode
 from common.interceptor import Interceptor, pointcut
+from common.tiered_cache import InvalidationBus, LocalCache
 
 LOGGER = logging.getLogger(__name__)
 
 
+def canonical(value: Any) -> Any:
+    """JSON-ready form of an argument that is equal for equal values across processes.
+
+    Raises ``TypeError`` for values without a stable representation.
+    """
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, BaseModel):
+        return canonical(value.dict())
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return canonical({f.name: getattr(value, f.name) for f in dataclasses.fields(value)})
+    if isinstance(value, dict):
+        return [[canonical(key), canonical(item)] for key, item in sorted(value.items(), key=lambda i: repr(i[0]))]
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((canonical(item) for item in value), key=repr)
+    raise TypeError('Can\'t build a cache key from ' + type(value).__name__)
+
+
 def default_key_generator(fn: Callable, args, kwargs):
-    return str(fn.__qualname__) + str(args) + str(kwargs)
+    """``<namespace>:<module>.<qualname>:v<version>:<digest of the arguments>``, the bound instance is skipped."""
+    if getattr(fn, '__self__', None) is None and args and fn.__code__.co_varnames[:1] == ('self',):
+        args = args[1:]
+    arguments = orjson.dumps([canonical(args), canonical(kwargs)])
+    return '{}:{}.{}:v{}:{}'.format(getattr(fn, '__cache_namespace__', 'cache'), fn.__module__, fn.__qualname__,
+                                    getattr(fn, '__cache_version__', 0),
+                                    hashlib.blake2b(arguments, digest_size=16).hexdigest())
+
+
+def arguments(fn: Callable, args, kwargs) -> dict:
+    bound = inspect.signature(fn).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return bound.arguments
+
+
+def template_key_generator(template: str) -> Callable:
+    """Key generator formatting ``template`` with the arguments of the call, e.g. ``course:{class_id}``.
+
+    Unlike :func:`default_key_generator` the key is predictable, so :func:`cache_evict` and
+    :func:`cache_put` can target it.
+    """
+
+    def generator(fn: Callable, args, kwargs):
+        return getattr(fn, '__cache_namespace__', 'cache') + ':' + template.format(**arguments(fn, args, kwargs))
+
+    return generator
+
+
+def format_all(templates: Iterable[str], fn: Callable, args, kwargs) -> List[str]:
+    if not templates:
+        return []
+    values = arguments(fn, args, kwargs)
+    return [template.format(**values) for template in templates]
 
 
 __CACHE__ = object()
+__CACHE_EVICT__ = object()
+__CACHE_PUT__ = object()
+
+# Delete the lock only if it is still owned by the caller
+__RELEASE_LOCK__ = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Store an entry computed by a cache miss unless it was evicted meanwhile
+# KEYS: entry, tag sets..., generations...
+# ARGV: value, expire, nx, tag count, tag expire, generations read before computing the entry...
+__WRITE_IF_CURRENT__ = """
+local tags = tonumber(ARGV[4])
+for i = 2 + tags, #KEYS do
+    if (redis.call('get', KEYS[i]) or '') ~= ARGV[4 + i - tags] then
+        return 0
+    end
+end
+local set = {'set', KEYS[1], ARGV[1]}
+if tonumber(ARGV[2]) > 0 then
+    table.insert(set, 'ex')
+    table.insert(set, ARGV[2])
+end
+if ARGV[3] == '1' then
+    table.insert(set, 'nx')
+end
+redis.call(unpack(set))
+for i = 2, 1 + tags do
+    redis.call('sadd', KEYS[i], KEYS[1])
+    redis.call('expire', KEYS[i], ARGV[5])
+end
+return 1
+"""
 
 
 @inject
 @singleton
 class CacheInterceptor(Interceptor):
+    """Read-through Redis cache for functions decorated with :func:`cache`.
+
+    Entries are stored as ``(fresh_until, value)``: a hit costs one ``GET`` and a miss
+    is filled with ``SET NX EX``. Only the holder of a short lived lock recomputes a key,
+    the other callers wait for its result, or keep serving the stale value for
+    ``stale_ttl`` seconds while it is revalidated.
+
+    Functions cached with ``local_ttl`` are also kept in a bounded in-process tier
+    (``CACHE_LOCAL_MAX_BYTES``), every write is broadcast on the :class:`InvalidationBus`
+    so the other workers drop their local copy.
+
+    Values are written by the ``codec`` of :func:`cache` in a versioned envelope, entries
+    written by another codec or ``CACHE_SCHEMA_VERSION``, or referencing a dataclass
+    whose fields changed since, are recomputed instead of failing the call.
 
-    def __init__(self, redis: Redis) -> None:
+    Entries are indexed by the ``tags`` of :func:`cache` in Redis sets, :meth:`evict` drops
+    every entry of a tag at once. Evictions and :func:`cache_put` also bump a generation
+    counter of the key and tags, a miss computed from data read before is not stored.
+
+    Coroutine functions go through :meth:`handle_async`, backed by the asyncio Redis client.
+    """
+    channel = 'cache:invalidate'
+
+    def __init__(self, redis: Redis, async_redis: AsyncRedis, bus: InvalidationBus, config: Config) -> None:
         super().__init__()
         self.redis = redis
+        self.async_redis = async_redis
+        self.bus = bus
+        self.release_lock = redis.register_script(__RELEASE_LOCK__)
+        self.release_lock_async = async_redis.register_script(__RELEASE_LOCK__)
+        self.write_if_current = redis.register_script(__WRITE_IF_CURRENT__)
+        self.write_if_current_async = async_redis.register_script(__WRITE_IF_CURRENT__)
+        self.lock_timeout = 10
+        self.origin = uuid.uuid4().hex
+        self.version = config('CACHE_SCHEMA_VERSION', cast=int, default=0)
+        self.tag_ttl = config('CACHE_TAG_TTL', cast=int, default=24 * 60 * 60)
+        self.local = LocalCache(maxsize=config('CACHE_LOCAL_MAX_BYTES', cast=int, default=32 * 1024 * 1024),
+                                ttl=config('CACHE_LOCAL_TTL', cast=int, default=300),
+                                sized=True, on_evict=self.on_local_evict)
+        self._stats = defaultdict(lambda: dict(localHits=0, hits=0, staleHits=0, misses=0, evictions=0))
+        self._stats_lock = threading.Lock()
+        bus.subscribe(self.channel, self.on_invalidate)
         LOGGER.debug('CacheInterceptor Initialized')
 
-    def handle(self, fn: Callable, *args, **kwargs) -> Callable:
+    def key(self, fn: Callable, args, kwargs) -> Optional[str]:
         key_generator = getattr(fn, '__cache_key_generator__', None)
         if key_generator is None:
             raise ValueError('key_generator can\'t be None')
-        ttl = getattr(fn, '__cache_ttl__', None)
-        key = key_generator(fn, args, kwargs)
-        if self.redis.exists(key) == 0:
-            ret = super().handle(fn, *args, *kwargs)
-            self.redis.append(key, pickle.dumps(ret))
-            if ttl is not None:
-                self.redis.expire(key, ttl)
+        try:
+            return key_generator(fn, args, kwargs)
+        except TypeError as ex:
+            LOGGER.debug('%s is not cached: %s', fn.__qualname__, ex)
+            return None
+
+    def get_local(self, fn: Callable, key: str):
+        local = self.local.get(key)
+        if local is not None:
+            _, expires_at, value = local
+            if expires_at > time.time():
+                self.count(fn.__qualname__, 'localHits')
+                return True, value
+            self.local.pop(key)
+        return False, None
+
+    def handle(self, fn: Callable, *args, **kwargs) -> Callable:
+        key = self.key(fn, args, kwargs)
+        if key is None:
+            return fn(*args, **kwargs)
+        hit, value = self.get_local(fn, key)
+        if hit:
+            return value
+        name = fn.__qualname__
+        try:
+            raw = self.redis.get(key)
+        except RedisError as ex:
+            LOGGER.warning('Cache unavailable for %s: %s', key, ex)
+            return fn(*args, **kwargs)
+        entry = None if raw is None else self.decode(fn, key, raw)
+        if entry is not None:
+            fresh_until, value = entry
+            if fresh_until is None or fresh_until > time.time():
+                self.count(name, 'hits')
+                self.store_local(fn, key, fresh_until, value, len(raw))
+                return value
+            self.count(name, 'staleHits')
+            lock = self.acquire(key)
+            if lock is None:
+                return value
+            return self.fill(key, lock, fn, args, kwargs, overwrite=True)
+        self.count(name, 'misses')
+        lock = self.acquire(key)
+        if lock is None:
+            raw = self.wait(key, fn)
+            entry = None if raw is None else self.decode(fn, key, raw)
+            if entry is not None:
+                return entry[1]
+            return fn(*args, **kwargs)
+        # An unreadable entry is replaced
+        return self.fill(key, lock, fn, args, kwargs, overwrite=raw is not None)
+
+    async def handle_async(self, fn: Callable, *args, **kwargs):
+        key = self.key(fn, args, kwargs)
+        if key is None:
+            return await fn(*args, **kwargs)
+        hit, value = self.get_local(fn, key)
+        if hit:
+            return value
+        name = fn.__qualname__
+        try:
+            raw = await self.async_redis.get(key)
+        except RedisError as ex:
+            LOGGER.warning('Cache unavailable for %s: %s', key, ex)
+            return await fn(*args, **kwargs)
+        entry = None if raw is None else self.decode(fn, key, raw)
+        if entry is not None:
+            fresh_until, value = entry
+            if fresh_until is None or fresh_until > time.time():
+                self.count(name, 'hits')
+                self.store_local(fn, key, fresh_until, value, len(raw))
+                return value
+            self.count(name, 'staleHits')
+            lock = await self.acquire_async(key)
+            if lock is None:
+                return value
+            return await self.fill_async(key, lock, fn, args, kwargs, overwrite=True)
+        self.count(name, 'misses')
+        lock = await self.acquire_async(key)
+        if lock is None:
+            raw = await self.wait_async(key, fn)
+            entry = None if raw is None else self.decode(fn, key, raw)
+            if entry is not None:
+                return entry[1]
+            return await fn(*args, **kwargs)
+        return await self.fill_async(key, lock, fn, args, kwargs, overwrite=raw is not None)
+
+    def fill(self, key: str, lock: str, fn: Callable, args, kwargs, overwrite: bool = False):
+        try:
+            tags = format_all(getattr(fn, '__cache_tags__', ()), fn, args, kwargs)
+            generations = self.generations(fn, key, tags)
+            ret = fn(*args, **kwargs)
+            # Error responses are returned as is, never cached
+            if isinstance(ret, Response):
+                return ret
+            self.write(fn, key, ret, tags, overwrite, generations)
             return ret
-        return pickle.loads(self.redis.get(key))
+        finally:
+            try:
+                self.release_lock(keys=[self.lock_key(key)], args=[lock])
+            except RedisError:
+                pass
+
+    async def fill_async(self, key: str, lock: str, fn: Callable, args, kwargs, overwrite: bool = False):
+        try:
+            tags = format_all(getattr(fn, '__cache_tags__', ()), fn, args, kwargs)
+            generations = await self.generations_async(fn, key, tags)
+            ret = await fn(*args, **kwargs)
+            if isinstance(ret, Response):
+                return ret
+            await self.write_async(fn, key, ret, tags, overwrite, generations)
+            return ret
+        finally:
+            try:
+                await self.release_lock_async(keys=[self.lock_key(key)], args=[lock])
+            except RedisError:
+                pass
+
+    def encode(self, fn: Callable, key: str, value: Any):
+        """``(raw, fresh_until, expire)`` of ``value`` with the cache settings of ``fn``."""
+        ttl = getattr(fn, '__cache_ttl__', None)
+        stale_ttl = getattr(fn, '__cache_stale_ttl__', 0)
+        fresh_until = None if ttl is None else time.time() + ttl
+        expire = None if ttl is None else ttl + stale_ttl
+        try:
+            raw = encode(value, getattr(fn, '__cache_codec__', PICKLE), fresh_until, self.version,
+                         getattr(fn, '__cache_compress_threshold__', None))
+        except (TypeError, ValueError) as ex:
+            LOGGER.warning('Can\'t encode %s: %s', key, ex)
+            return None
+        return raw, fresh_until, expire
+
+    def generation_keys(self, fn: Callable, key: str, tags: List[str]) -> List[str]:
+        namespace = getattr(fn, '__cache_namespace__', 'cache')
+        return [self.generation_key(key)] + [self.generation_key(self.tag_key(namespace, tag)) for tag in tags]
+
+    def generations(self, fn: Callable, key: str, tags: List[str]) -> Optional[List[bytes]]:
+        """Generations of ``key`` and ``tags`` to check when storing the entry, ``None`` when Redis is unavailable."""
+        try:
+            return [generation or b'' for generation in self.redis.mget(self.generation_keys(fn, key, tags))]
+        except RedisError as ex:
+            LOGGER.warning('Cache unavailable for %s: %s', key, ex)
+            return None
+
+    async def generations_async(self, fn: Callable, key: str, tags: List[str]) -> Optional[List[bytes]]:
+        try:
+            return [generation or b'' for generation in
+                    await self.async_redis.mget(self.generation_keys(fn, key, tags))]
+        except RedisError as ex:
+            LOGGER.warning('Cache unavailable for %s: %s', key, ex)
+            return None
+
+    def queue_bump(self, pipe, generation_keys: Iterable[str]):
+        for generation_key in generation_keys:
+            pipe.incr(generation_key)
+            pipe.expire(generation_key, self.tag_ttl)
+
+    def queue_write(self, pipe, fn: Callable, key: str, raw: bytes, expire: Optional[int], tags: List[str],
+                    overwrite: bool):
+        namespace = getattr(fn, '__cache_namespace__', 'cache')
+        pipe.set(key, raw, ex=expire, nx=not overwrite)
+        for tag in tags:
+            pipe.sadd(self.tag_key(namespace, tag), key)
+            pipe.expire(self.tag_key(namespace, tag), max(expire or 0, self.tag_ttl))
+        # Misses of this key computed before are outdated
+        self.queue_bump(pipe, [self.generation_key(key)])
+
+    def write_arguments(self, fn: Callable, key: str, raw: bytes, expire: Optional[int], tags: List[str],
+                        overwrite: bool, generations: List[bytes]):
+        namespace = getattr(fn, '__cache_namespace__', 'cache')
+        keys = [key] + [self.tag_key(namespace, tag) for tag in tags] + self.generation_keys(fn, key, tags)
+        args = [raw, expire or 0, 0 if overwrite else 1, len(tags), max(expire or 0, self.tag_ttl)] + generations
+        return dict(keys=keys, args=args)
+
+    def write(self, fn: Callable, key: str, value: Any, tags: List[str] = (), overwrite: bool = True,
+              generations: Optional[List[bytes]] = None):
+        """Store ``value`` under ``key`` with the cache settings of ``fn``.
+
+        With ``generations`` the entry is only stored if ``key`` and ``tags`` weren't evicted since they were read.
+        """
+        encoded = self.encode(fn, key, value)
+        if encoded is None:
+            return
+        raw, fresh_until, expire = encoded
+        try:
+            if generations is None:
+                pipe = self.redis.pipeline(transaction=False)
+                self.queue_write(pipe, fn, key, raw, expire, tags, overwrite)
+                pipe.execute()
+            elif not self.write_if_current(**self.write_arguments(fn, key, raw, expire, tags, overwrite,
+                                                                  generations)):
+                LOGGER.debug('Not caching %s, evicted while it was computed', key)
+                return
+        except RedisError as ex:
+            LOGGER.warning('Can\'t cache %s: %s', key, ex)
+        self.local.pop(key)
+        self.store_local(fn, key, fresh_until, value, len(raw))
+        self.bus.publish(self.channel, {'keys': [key], 'origin': self.origin})
+
+    async def write_async(self, fn: Callable, key: str, value: Any, tags: List[str] = (), overwrite: bool = True,
+                          generations: Optional[List[bytes]] = None):
+        encoded = self.encode(fn, key, value)
+        if encoded is None:
+            return
+        raw, fresh_until, expire = encoded
+        try:
+            if generations is None:
+                pipe = self.async_redis.pipeline(transaction=False)
+                self.queue_write(pipe, fn, key, raw, expire, tags, overwrite)
+                await pipe.execute()
+            elif not await self.write_if_current_async(**self.write_arguments(fn, key, raw, expire, tags, overwrite,
+                                                                              generations)):
+                LOGGER.debug('Not caching %s, evicted while it was computed', key)
+                return
+        except RedisError as ex:
+            LOGGER.warning('Can\'t cache %s: %s', key, ex)
+        self.local.pop(key)
+        self.store_local(fn, key, fresh_until, value, len(raw))
+        await self.bus.apublish(self.channel, {'keys': [key], 'origin': self.origin})
+
+    def evict(self, keys: Iterable[str] = (), tags: Iterable[str] = (), namespace: str = 'cache'):
+        """Drop the entries ``<namespace>:<key>`` and every entry tagged with one of ``tags``, in every worker."""
+        keys = [namespace + ':' + key for key in keys]
+        tag_keys = [self.tag_key(namespace, tag) for tag in tags]
+        try:
+            if tag_keys:
+                pipe = self.redis.pipeline(transaction=False)
+                for tag_key in tag_keys:
+                    pipe.smembers(tag_key)
+                for members in pipe.execute():
+                    keys.extend(member.decode() for member in members)
+            if keys or tag_keys:
+                pipe = self.redis.pipeline(transaction=False)
+                self.queue_bump(pipe, [self.generation_key(key) for key in keys + tag_keys])
+                pipe.delete(*keys, *tag_keys)
+                pipe.execute()
+        except RedisError as ex:
+            LOGGER.warning('Can\'t evict %s %s: %s', keys, tags, ex)
+        self.local.pop(*keys)
+        self.bus.publish(self.channel, {'keys': keys, 'origin': self.origin})
+
+    async def evict_async(self, keys: Iterable[str] = (), tags: Iterable[str] = (), namespace: str = 'cache'):
+        keys = [namespace + ':' + key for key in keys]
+        tag_keys = [self.tag_key(namespace, tag) for tag in tags]
+        try:
+            if tag_keys:
+                pipe = self.async_redis.pipeline(transaction=False)
+                for tag_key in tag_keys:
+                    pipe.smembers(tag_key)
+                for members in await pipe.execute():
+                    keys.extend(member.decode() for member in members)
+            if keys or tag_keys:
+                pipe = self.async_redis.pipeline(transaction=False)
+                self.queue_bump(pipe, [self.generation_key(key) for key in keys + tag_keys])
+                pipe.delete(*keys, *tag_keys)
+                await pipe.execute()
+        except RedisError as ex:
+            LOGGER.warning('Can\'t evict %s %s: %s', keys, tags, ex)
+        self.local.pop(*keys)
+        await self.bus.apublish(self.channel, {'keys': keys, 'origin': self.origin})
+
+    def decode(self, fn: Callable, key: str, raw: bytes):
+        try:
+            return decode(raw, getattr(fn, '__cache_codec__', PICKLE), self.version)
+        except CodecError as ex:
+            LOGGER.info('Discarding cache entry %s: %s', key, ex)
+            return None
+
+    def store_local(self, fn: Callable, key: str, fresh_until: Optional[float], value: Any, size: int):
+        local_ttl = getattr(fn, '__cache_local_ttl__', None)
+        if local_ttl is None:
+            return
+        expires_at = time.time() + local_ttl
+        if fresh_until is not None:
+            expires_at = min(expires_at, fresh_until)
+        self.local.set(key, (fn.__qualname__, expires_at, value), size=size)
+
+    def on_local_evict(self, _: str, value):
+        self.count(value[0], 'evictions')
+
+    def on_invalidate(self, message: dict):
+        if message.get('origin') == self.origin:
+            return
+        if message.get('all'):
+            self.local.clear()
+            return
+        self.local.pop(*message.get('keys', []))
+
+    def count(self, name: str, counter: str):
+        with self._stats_lock:
+            self._stats[name][counter] += 1
+
+    def stats(self) -> dict:
+        """Hit, miss and local eviction counts per cached function."""
+        with self._stats_lock:
+            return {name: dict(counters) for name, counters in self._stats.items()}
+
+    @staticmethod
+    def tag_key(namespace: str, tag: str) -> str:
+        return namespace + ':tag:' + tag
+
+    @staticmethod
+    def lock_key(key: str) -> str:
+        return 'lock:' + key
+
+    @staticmethod
+    def generation_key(key: str) -> str:
+        return 'gen:' + key
+
+    def acquire(self, key: str) -> Optional[str]:
+        lock = uuid.uuid4().hex
+        try:
+            if self.redis.set(self.lock_key(key), lock, nx=True, ex=self.lock_timeout):
+                return lock
+        except RedisError:
+            pass
+        return None
+
+    async def acquire_async(self, key: str) -> Optional[str]:
+        lock = uuid.uuid4().hex
+        try:
+            if await self.async_redis.set(self.lock_key(key), lock, nx=True, ex=self.lock_timeout):
+                return lock
+        except RedisError:
+            pass
+        return None
+
+    def wait(self, key: str, fn: Callable) -> Optional[bytes]:
+        deadline = time.time() + getattr(fn, '__cache_wait__', 1.0)
+        while time.time() < deadline:
+            time.sleep(0.05)
+            try:
+                raw = self.redis.get(key)
+            except RedisError:
+                return None
+            if raw is not None:
+                return raw
+        return None
+
+    async def wait_async(self, key: str, fn: Callable) -> Optional[bytes]:
+        deadline = time.time() + getattr(fn, '__cache_wait__', 1.0)
+        while time.time() < deadline:
+            await asyncio.sleep(0.05)
+            try:
+                raw = await self.async_redis.get(key)
+            except RedisError:
+                return None
+            if raw is not None:
+                return raw
+        return None
 
     @property
     def pointcut(self):
         return __CACHE__
 
 
-def cache(ttl: Optional[int] = None, key_generator: Callable = default_key_generator):
+@inject
+@singleton
+class CacheEvictInterceptor(Interceptor):
+    """Evicts the entries named by :func:`cache_evict` once the call succeeded."""
+
+    def __init__(self, cache_interceptor: CacheInterceptor) -> None:
+        super().__init__()
+        self.cache = cache_interceptor
+
+    def intercepts(self, fn: Callable) -> bool:
+        return bool(fn.__cache_evict_keys__ or fn.__cache_evict_tags__)
+
+    def handle(self, fn: Callable, *args, **kwargs) -> Callable:
+        ret = fn(*args, **kwargs)
+        if not isinstance(ret, Response) or ret.status_code < 400:
+            self.cache.evict(format_all(fn.__cache_evict_keys__, fn, args, kwargs),
+                             format_all(fn.__cache_evict_tags__, fn, args, kwargs),
+                             fn.__cache_evict_namespace__)
+        return ret
+
+    async def handle_async(self, fn: Callable, *args, **kwargs):
+        ret = await fn(*args, **kwargs)
+        if not isinstance(ret, Response) or ret.status_code < 400:
+            await self.cache.evict_async(format_all(fn.__cache_evict_keys__, fn, args, kwargs),
+                                         format_all(fn.__cache_evict_tags__, fn, args, kwargs),
+                                         fn.__cache_evict_namespace__)
+        return ret
+
+    @property
+    def pointcut(self):
+        return __CACHE_EVICT__
+
+
+@inject
+@singleton
+class CachePutInterceptor(Interceptor):
+    """Stores the result of functions decorated with :func:`cache_put`."""
+
+    def __init__(self, cache_interceptor: CacheInterceptor) -> None:
+        super().__init__()
+        self.cache = cache_interceptor
+
+    def handle(self, fn: Callable, *args, **kwargs) -> Callable:
+        ret = fn(*args, **kwargs)
+        if not isinstance(ret, Response):
+            key = fn.__cache_key_generator__(fn, args, kwargs)
+            self.cache.write(fn, key, ret, format_all(getattr(fn, '__cache_tags__', ()), fn, args, kwargs))
+        return ret
+
+    async def handle_async(self, fn: Callable, *args, **kwargs):
+        ret = await fn(*args, **kwargs)
+        if not isinstance(ret, Response):
+            key = fn.__cache_key_generator__(fn, args, kwargs)
+            await self.cache.write_async(fn, key, ret, format_all(getattr(fn, '__cache_tags__', ()), fn, args, kwargs))
+        return ret
+
+    @property
+    def pointcut(self):
+        return __CACHE_PUT__
+
+
+def _configure(fn, ttl, stale_ttl, local_ttl, codec, compress_threshold, namespace, tags):
+    fn.__cache_namespace__ = namespace
+    if ttl is not None:
+        fn.__cache_ttl__ = ttl
+    fn.__cache_stale_ttl__ = stale_ttl
+    if local_ttl is not None:
+        fn.__cache_local_ttl__ = local_ttl
+    fn.__cache_codec__ = codec
+    fn.__cache_compress_threshold__ = compress_threshold
+    fn.__cache_tags__ = tuple(tags)
+
+
+def cache(ttl: Optional[int] = None, key_generator: Callable = default_key_generator,
+          stale_ttl: int = 0, wait: float = 1.0, local_ttl: Optional[int] = None,
+          codec: Codec = PICKLE, compress_threshold: Optional[int] = 1024,
+          namespace: str = 'cache', version: int = 0, key: Optional[str] = None, tags: Iterable[str] = ()):
+    """Cache the result of ``fn`` for ``ttl`` seconds.
+
+    ``stale_ttl`` keeps expired entries around that much longer so they can be served
+    while one caller revalidates, ``wait`` bounds how long concurrent misses wait for
+    the caller filling the entry before computing it themselves. ``local_ttl`` also
+    keeps entries in process memory for up to that many seconds.
+
+    ``codec`` serializes the value, :data:`common.codec.ORJSON` is faster than pickle for
+    the ``response`` dataclasses. Payloads above ``compress_threshold`` bytes are compressed.
+    Bump ``version`` when the result of ``fn`` changes meaning for the same arguments.
+
+    ``key`` replaces the hashed key by a template of the arguments, e.g. ``course:{class_id}``,
+    ``tags`` are templates as well and let :func:`cache_evict` drop groups of entries.
+    """
+
     def decorator(fn):
-        fn.__cache_key_generator__ = key_generator
-        if ttl is not None:
-            fn.__cache_ttl__ = ttl
+        fn.__cache_key_generator__ = key_generator if key is None else template_key_generator(key)
+        fn.__cache_version__ = version
+        fn.__cache_wait__ = wait
+        _configure(fn, ttl, stale_ttl, local_ttl, codec, compress_threshold, namespace, tags)
         fn = pointcut(__CACHE__)(fn)
         return fn
 
     return decorator
+
+
+def cache_evict(keys: Iterable[str] = (), tags: Iterable[str] = (), namespace: str = 'cache'):
+    """Evict cache entries after ``fn`` succeeded.
+
+    ``keys`` are the ``key`` templates and ``tags`` the tag templates used by :func:`cache`,
+    formatted with the arguments of ``fn``.
+    """
+
+    def decorator(fn):
+        fn.__cache_evict_keys__ = tuple(keys)
+        fn.__cache_evict_tags__ = tuple(tags)
+        fn.__cache_evict_namespace__ = namespace
+        fn = pointcut(__CACHE_EVICT__)(fn)
+        return fn
+
+    return decorator
+
+
+def cache_put(key: str, ttl: Optional[int] = None, stale_ttl: int = 0, local_ttl: Optional[int] = None,
+              codec: Codec = PICKLE, compress_threshold: Optional[int] = 1024,
+              namespace: str = 'cache', tags: Iterable[str] = ()):
+    """Always run ``fn`` and overwrite the entry ``key`` with its result.
+
+    Settings must match the :func:`cache` reading the entry.
+    """
+
+    def decorator(fn):
+        fn.__cache_key_generator__ = template_key_generator(key)
+        _configure(fn, ttl, stale_ttl, local_ttl, codec, compress_threshold, namespace, tags)
+        fn = pointcut(__CACHE_PUT__)(fn)
+        return fn
+
+    return decorator
@@ -0,0 +1,176 @@
+import dataclasses
+import functools
+import hashlib
+import importlib
+import math
+import pickle
+import struct
+import zlib
+from typing import Any, Optional, Tuple
+
+import orjson
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Key of the class name in an encoded dataclass
+__DATACLASS__ = '__dc__'
+
+# magic, codec id, flags, schema version, fresh_until
+__HEADER__ = struct.Struct('!2sBBHd')
+__MAGIC__ = b'CC'
+__COMPRESSED__ = 0x01
+
+
+class CodecError(ValueError):
+    """Raised when a cached payload can't be decoded by the running code, the entry is treated as a miss."""
+
+
+class Codec:
+    id = 0
+
+    def dumps(self, value: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, raw: bytes) -> Any:
+        raise NotImplementedError
+
+
+class PickleCodec(Codec):
+    id = 1
+
+    def dumps(self, value: Any) -> bytes:
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, raw: bytes) -> Any:
+        try:
+            return pickle.loads(raw)
+        except Exception as ex:
+            raise CodecError(str(ex)) from ex
+
+
+def fingerprint(cls) -> str:
+    """Short hash of the fields of a dataclass, changes whenever the model does."""
+    fields = ','.join(f.name + ':' + getattr(f.type, '__name__', str(f.type)) for f in dataclasses.fields(cls))
+    return hashlib.blake2b(fields.encode(), digest_size=4).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _class_name(cls) -> str:
+    return cls.__module__ + ':' + cls.__qualname__ + '@' + fingerprint(cls)
+
+
+@functools.lru_cache(maxsize=None)
+def _field_names(cls) -> Tuple[str, ...]:
+    return tuple(f.name for f in dataclasses.fields(cls))
+
+
+def _tag(value) -> dict:
+    # Shallow, nested values are handled by the caller
+    data = {name: getattr(value, name) for name in _field_names(type(value))}
+    data[__DATACLASS__] = _class_name(type(value))
+    return data
+
+
+@functools.lru_cache(maxsize=None)
+def _resolve(name: str):
+    path, version = name.rsplit('@', 1)
+    module, qualname = path.split(':', 1)
+    try:
+        cls = importlib.import_module(module)
+        for attr in qualname.split('.'):
+            cls = getattr(cls, attr)
+    except (ImportError, AttributeError) as ex:
+        raise CodecError('Unknown class ' + path) from ex
+    if not dataclasses.is_dataclass(cls) or fingerprint(cls) != version:
+        raise CodecError('Class ' + path + ' has changed')
+    return cls
+
+
+def _default(value):
+    # Dataclasses are written as tagged dicts so from_primitive can rebuild them
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return _tag(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError('Can\'t encode ' + type(value).__name__)
+
+
+def from_primitive(value: Any) -> Any:
+    if type(value) is dict:
+        data = {key: from_primitive(item) if type(item) in (dict, list) else item for key, item in value.items()}
+        name = data.pop(__DATACLASS__, None)
+        if name is None:
+            return data
+        return _resolve(name)(**data)
+    if type(value) is list:
+        return [from_primitive(item) if type(item) in (dict, list) else item for item in value]
+    return value
+
+
+class OrjsonCodec(Codec):
+    """JSON codec for primitives and dataclasses, tuples and sets come back as lists."""
+    id = 2
+
+    def dumps(self, value: Any) -> bytes:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_PASSTHROUGH_DATACLASS)
+
+    def loads(self, raw: bytes) -> Any:
+        try:
+            return from_primitive(orjson.loads(raw))
+        except orjson.JSONDecodeError as ex:
+            raise CodecError(str(ex)) from ex
+
+
+class MsgpackCodec(Codec):
+    """Same contract as :class:`OrjsonCodec` with a more compact binary encoding, requires ``msgpack``."""
+    id = 3
+
+    def __init__(self) -> None:
+        super().__init__()
+        if msgpack is None:
+            raise RuntimeError('msgpack is not installed')
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value, default=_default, use_bin_type=True)
+
+    def loads(self, raw: bytes) -> Any:
+        try:
+            return from_primitive(msgpack.unpackb(raw, raw=False, strict_map_key=False))
+        except (ValueError, msgpack.UnpackException) as ex:
+            raise CodecError(str(ex)) from ex
+
+
+PICKLE = PickleCodec()
+ORJSON = OrjsonCodec()
+
+
+def encode(value: Any, codec: Codec, fresh_until: Optional[float] = None,
+           version: int = 0, compress_threshold: Optional[int] = 1024) -> bytes:
+    """Serialize ``value`` in a versioned envelope, compressed with zlib above ``compress_threshold`` bytes."""
+    payload = codec.dumps(value)
+    flags = 0
+    if compress_threshold is not None and len(payload) > compress_threshold:
+        payload = zlib.compress(payload, 1)
+        flags |= __COMPRESSED__
+    header = __HEADER__.pack(__MAGIC__, codec.id, flags, version, math.nan if fresh_until is None else fresh_until)
+    return header + payload
+
+
+def decode(raw: bytes, codec: Codec, version: int = 0) -> Tuple[Optional[float], Any]:
+    """Return ``(fresh_until, value)`` of an envelope, raise :class:`CodecError` when it is not readable by
+    ``codec`` at this ``version``."""
+    if len(raw) < __HEADER__.size:
+        raise CodecError('Truncated entry')
+    magic, codec_id, flags, entry_version, fresh_until = __HEADER__.unpack_from(raw)
+    if magic != __MAGIC__ or codec_id != codec.id or entry_version != version:
+        raise CodecError('Entry written by another codec or version')
+    payload = raw[__HEADER__.size:]
+    if flags & __COMPRESSED__:
+        try:
+            payload = zlib.decompress(payload)
+        except zlib.error as ex:
+            raise CodecError(str(ex)) from ex
+    return None if math.isnan(fresh_until) else fresh_until, codec.loads(payload)
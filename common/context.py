@@ -0,0 +1,75 @@
+import functools
+import inspect
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+
+class RequestContext:
+    def __init__(self) -> None:
+        super().__init__()
+        self.memo = dict()
+
+
+__REQUEST_CONTEXT__: ContextVar[Optional[RequestContext]] = ContextVar('request_context', default=None)
+
+
+def current_context() -> Optional[RequestContext]:
+    return __REQUEST_CONTEXT__.get()
+
+
+@contextmanager
+def request_context():
+    """Open a request scope, memoized lookups live until the scope is closed."""
+    token = __REQUEST_CONTEXT__.set(RequestContext())
+    try:
+        yield __REQUEST_CONTEXT__.get()
+    finally:
+        __REQUEST_CONTEXT__.reset(token)
+
+
+def request_scoped(fn: Callable):
+    """Memoize a service method for the lifetime of the current request.
+
+    Outside of a request scope the method is called as usual. Coroutine methods
+    memoize the awaited result. Memoized values are never evicted: they may only be
+    read before the request writes what they were loaded from, a write path that
+    reads them back afterwards must call the undecorated lookup.
+    """
+
+    def memo_key(args, kwargs):
+        context = current_context()
+        if context is None:
+            return None, None
+        key = (fn.__qualname__, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return None, None
+        return context, key
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(self, *args, **kwargs):
+            context, key = memo_key(args, kwargs)
+            if context is None:
+                return await fn(self, *args, **kwargs)
+            if key not in context.memo:
+                context.memo[key] = await fn(self, *args, **kwargs)
+            return context.memo[key]
+
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        context, key = memo_key(args, kwargs)
+        if context is None:
+            return fn(self, *args, **kwargs)
+        if key not in context.memo:
+            context.memo[key] = fn(self, *args, **kwargs)
+        return context.memo[key]
+
+    return wrapper
@@ -0,0 +1,77 @@
+import functools
+import math
+from typing import Sequence
+
+from geopy import distance
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Mean earth radius (IUGG), in meters
+EARTH_RADIUS = 6371008.8
+
+# Worst relative error of the spherical approximation against the WGS-84 geodesic is about 0.5%
+__RELATIVE_ERROR__ = 0.01
+__ABSOLUTE_ERROR__ = 0.5
+
+
+class Geofence:
+    """Circle of ``radius`` meters around a roll call, a checkin is inside when its truncated distance in meters
+    is at most ``radius``.
+
+    Distances are estimated with an equirectangular projection around the center, only points close to the
+    boundary are checked again with the ellipsoidal geodesic.
+    """
+
+    def __init__(self, lat: float, long: float, radius: float) -> None:
+        super().__init__()
+        self.center = (lat, long)
+        self.lat = math.radians(lat)
+        self.long = math.radians(long)
+        self.cos_lat = math.cos(self.lat)
+        self.radius = radius
+        # Distances below limit are inside
+        self.limit = math.floor(radius) + 1
+        margin = self.limit * __RELATIVE_ERROR__ + __ABSOLUTE_ERROR__
+        self.inner = self.limit - margin
+        self.outer = self.limit + margin
+
+    def estimate(self, lat: float, long: float) -> float:
+        """Approximate distance in meters, accurate for the few hundred meters of a geofence."""
+        x = (math.radians(long) - self.long) * self.cos_lat
+        y = math.radians(lat) - self.lat
+        return EARTH_RADIUS * math.hypot(x, y)
+
+    def geodesic(self, lat: float, long: float) -> float:
+        return distance.distance(self.center, (lat, long)).m
+
+    def contains(self, lat: float, long: float) -> bool:
+        estimate = self.estimate(lat, long)
+        if estimate < self.inner:
+            return True
+        if estimate > self.outer:
+            return False
+        return self.geodesic(lat, long) < self.limit
+
+    def contains_many(self, lats: Sequence[float], longs: Sequence[float]):
+        """Vectorized :meth:`contains`, returns a boolean ``numpy`` array, or a list when ``numpy`` is not
+        installed."""
+        if numpy is None:
+            return [self.contains(lat, long) for lat, long in zip(lats, longs)]
+        lats = numpy.asarray(lats, dtype=numpy.float64)
+        longs = numpy.asarray(longs, dtype=numpy.float64)
+        x = (numpy.radians(longs) - self.long) * self.cos_lat
+        y = numpy.radians(lats) - self.lat
+        estimates = EARTH_RADIUS * numpy.hypot(x, y)
+        inside = estimates < self.inner
+        for index in numpy.flatnonzero((estimates >= self.inner) & (estimates <= self.outer)):
+            inside[index] = self.geodesic(float(lats[index]), float(longs[index])) < self.limit
+        return inside
+
+
+@functools.lru_cache(maxsize=1024)
+def geofence(lat: float, long: float, radius: float) -> Geofence:
+    """Shared :class:`Geofence` of a roll call, built once per center and radius."""
+    return Geofence(lat, long, radius)
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import threading
+from typing import Dict, Tuple
+
+from injector import singleton, inject
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import MongoClient, ReturnDocument
+from starlette.config import Config
+
+LOGGER = logging.getLogger(__name__)
+
+
+class BaseIdAllocator:
+    """Hi/lo allocator of sequential ``id`` values backed by a counters collection.
+
+    Each worker reserves ``ID_BLOCK_SIZE`` ids with one ``$inc`` and hands them out
+    locally, ids stay unique across workers but are not gap free.
+    """
+
+    def __init__(self, config: Config) -> None:
+        super().__init__()
+        self.counters = config('COL_COUNTERS', cast=str, default='counters')
+        self.block_size = config('ID_BLOCK_SIZE', cast=int, default=20)
+        # collection -> (next id, last reserved id)
+        self._blocks: Dict[str, Tuple[int, int]] = dict()
+        self._seeded = set()
+
+    def _take(self, collection: str):
+        next_id, last = self._blocks.get(collection, (1, 0))
+        if next_id > last:
+            return None
+        self._blocks[collection] = (next_id + 1, last)
+        return next_id
+
+    def _store_block(self, collection: str, last: int) -> int:
+        self._blocks[collection] = (last - self.block_size + 1, last)
+        return self._take(collection)
+
+    def _increment(self):
+        return {'$inc': {'seq': self.block_size}}
+
+
+@inject
+@singleton
+class IdAllocator(BaseIdAllocator):
+
+    def __init__(self, mongo: MongoClient, config: Config) -> None:
+        super().__init__(config)
+        self.mongo: MongoClient = mongo
+        self._lock = threading.Lock()
+
+    def next_id(self, collection: str) -> int:
+        with self._lock:
+            next_id = self._take(collection)
+            if next_id is None:
+                next_id = self._store_block(collection, self._reserve(collection))
+            return next_id
+
+    def _reserve(self, collection: str) -> int:
+        if collection not in self._seeded:
+            self._seed(collection)
+        counter = self.mongo[self.counters].find_one_and_update({'_id': collection}, self._increment(),
+                                                                upsert=True, return_document=ReturnDocument.AFTER)
+        return counter['seq']
+
+    def _seed(self, collection: str):
+        # Counters created for an existing collection start after its highest id
+        if self.mongo[self.counters].find_one({'_id': collection}) is None:
+            last = list(self.mongo[collection].find({}, {'_id': 0, 'id': 1}).sort('id', -1).limit(1))
+            self.mongo[self.counters].update_one({'_id': collection},
+                                                 {'$max': {'seq': last[0]['id'] if last else 0}}, upsert=True)
+        self._seeded.add(collection)
+
+
+@inject
+@singleton
+class AsyncIdAllocator(BaseIdAllocator):
+
+    def __init__(self, mongo: AsyncIOMotorDatabase, config: Config) -> None:
+        super().__init__(config)
+        self.mongo: AsyncIOMotorDatabase = mongo
+        self._lock = asyncio.Lock()
+
+    async def next_id(self, collection: str) -> int:
+        async with self._lock:
+            next_id = self._take(collection)
+            if next_id is None:
+                next_id = self._store_block(collection, await self._reserve(collection))
+            return next_id
+
+    async def _reserve(self, collection: str) -> int:
+        if collection not in self._seeded:
+            await self._seed(collection)
+        counter = await self.mongo[self.counters].find_one_and_update({'_id': collection}, self._increment(),
+                                                                      upsert=True,
+                                                                      return_document=ReturnDocument.AFTER)
+        return counter['seq']
+
+    async def _seed(self, collection: str):
+        if await self.mongo[self.counters].find_one({'_id': collection}) is None:
+            last = await self.mongo[collection].find({}, {'_id': 0, 'id': 1}).sort('id', -1).limit(1).to_list(1)
+            await self.mongo[self.counters].update_one({'_id': collection},
+                                                       {'$max': {'seq': last[0]['id'] if last else 0}}, upsert=True)
+        self._seeded.add(collection)
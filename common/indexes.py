@@ -0,0 +1,96 @@
+import logging
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from pymongo import IndexModel
+from pymongo.database import Database
+from pymongo.errors import PyMongoError, ConnectionFailure
+from starlette.config import Config
+
+LOGGER = logging.getLogger(__name__)
+
+# (config key, default name) of a collection, resolved the same way services do
+Collection = Tuple[str, str]
+
+
+class IndexRegistry:
+    """Indexes and hot queries declared by services, bootstrapped at startup.
+
+    ``MONGO_INDEXES`` selects the mode: ``ensure`` creates missing indexes, ``dry-run``
+    only logs the missing ones with the ``explain()`` plan of every declared query, ``off`` skips.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.indexes: Dict[Collection, List[IndexModel]] = defaultdict(list)
+        self.queries: Dict[Collection, List[Tuple[dict, list]]] = defaultdict(list)
+
+    def declare(self, collection: Collection, *indexes: IndexModel):
+        self.indexes[collection].extend(indexes)
+
+    def declare_query(self, collection: Collection, query: dict, sort: list = None):
+        self.queries[collection].append((query, sort))
+
+    @staticmethod
+    def resolve(config: Config, collection: Collection) -> str:
+        key, default = collection
+        return config(key, cast=str, default=default)
+
+    def bootstrap(self, db: Database, config: Config):
+        mode = config('MONGO_INDEXES', cast=str, default='ensure')
+        try:
+            if mode == 'ensure':
+                self.ensure(db, config)
+            elif mode == 'dry-run':
+                self.dry_run(db, config)
+        except ConnectionFailure as ex:
+            LOGGER.error('Index bootstrap skipped, mongo is unreachable: %s', ex)
+
+    def ensure(self, db: Database, config: Config):
+        for collection, indexes in self.indexes.items():
+            name = self.resolve(config, collection)
+            for index in indexes:
+                try:
+                    db[name].create_indexes([index])
+                except ConnectionFailure:
+                    raise
+                except PyMongoError as ex:
+                    LOGGER.error('Can\'t create index %s on %s: %s', index.document['name'], name, ex)
+            LOGGER.debug('Indexes of %s ensured', name)
+
+    def missing(self, db: Database, config: Config, collection: Collection) -> List[IndexModel]:
+        name = self.resolve(config, collection)
+        existing = [dict(key=list(info['key']),
+                         unique=info.get('unique', False),
+                         expireAfterSeconds=info.get('expireAfterSeconds'))
+                    for info in db[name].index_information().values()]
+        return [index for index in self.indexes[collection]
+                if dict(key=list(index.document['key'].items()),
+                        unique=index.document.get('unique', False),
+                        expireAfterSeconds=index.document.get('expireAfterSeconds')) not in existing]
+
+    def dry_run(self, db: Database, config: Config):
+        for collection in set(self.indexes.keys()) | set(self.queries.keys()):
+            name = self.resolve(config, collection)
+            for index in self.missing(db, config, collection):
+                LOGGER.info('[dry-run] missing index on %s: %s', name, index.document)
+            for query, sort in self.queries[collection]:
+                cursor = db[name].find(query)
+                if sort is not None:
+                    cursor = cursor.sort(sort)
+                plan = cursor.explain().get('queryPlanner', {}).get('winningPlan', {})
+                LOGGER.info('[dry-run] %s %s sort=%s -> %s', name, query, sort, self.describe_plan(plan))
+
+    @staticmethod
+    def describe_plan(plan: dict) -> str:
+        stages = []
+        while plan:
+            stage = plan.get('stage', '?')
+            if 'indexName' in plan:
+                stage += '(' + plan['indexName'] + ')'
+            stages.append(stage)
+            plan = plan.get('inputStage') or (plan.get('inputStages') or [None])[0]
+        return ' <- '.join(stages)
+
+
+INDEXES = IndexRegistry()
@@ -1,23 +1,41 @@
+import functools
+import inspect
 from abc import ABC, abstractmethod
 from typing import Callable
 
 
 class Interceptor(ABC):
+    """Wraps the methods carrying its :attr:`pointcut`, the first interceptor provided being the innermost.
+
+    Each layer costs one call of :meth:`handle`, about as much as a hand written
+    ``def wrapper(*args, **kwargs): return fn(*args, **kwargs)``. Implementations call ``fn``
+    directly rather than ``super().handle``, which would add a frame and a ``super()`` lookup per call.
+    """
+
     @property
     @abstractmethod
     def pointcut(self) -> object:
         raise NotImplementedError()
 
     def wraps(self, fn: Callable) -> Callable:
-        def wrapper(*args, **kwargs):
-            return self.handle(fn, *args, **kwargs)
+        # A partial of the unbound handler is called from C, a closure would add a Python frame per layer.
+        # inspect.iscoroutinefunction sees through partials of functions, so chains of coroutines stay awaitable
+        if inspect.iscoroutinefunction(fn):
+            return functools.partial(type(self).handle_async, self, fn)
+        return functools.partial(type(self).handle, self, fn)
 
-        return wrapper
+    def intercepts(self, fn: Callable) -> bool:
+        """Whether :meth:`handle` has anything to do for ``fn``, the proxy leaves the interceptor out otherwise."""
+        return True
 
     @abstractmethod
     def handle(self, fn: Callable, *args, **kwarg) -> Callable:
         return fn(*args, **kwarg)
 
+    # Called instead of handle for coroutine functions, override it to intercept them
+    async def handle_async(self, fn: Callable, *args, **kwargs):
+        return await fn(*args, **kwargs)
+
 
 def pointcut(key: object):
     def decorator(fn):
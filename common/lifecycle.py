@@ -0,0 +1,35 @@
+import inspect
+import logging
+from typing import Callable
+
+LOGGER = logging.getLogger(__name__)
+
+__STARTUP_HOOKS__ = []
+__SHUTDOWN_HOOKS__ = []
+
+
+def on_startup(fn: Callable[[], None]) -> Callable[[], None]:
+    __STARTUP_HOOKS__.append(fn)
+    return fn
+
+
+def on_shutdown(fn: Callable[[], None]) -> Callable[[], None]:
+    __SHUTDOWN_HOOKS__.append(fn)
+    return fn
+
+
+def startup():
+    for hook in __STARTUP_HOOKS__:
+        hook()
+
+
+async def shutdown():
+    # Run in reverse registration order, dependents are created after their dependencies
+    for hook in reversed(__SHUTDOWN_HOOKS__):
+        try:
+            ret = hook()
+            # Hooks of the async services hand back a coroutine to drain on the event loop
+            if inspect.isawaitable(ret):
+                await ret
+        except Exception:
+            LOGGER.exception('Shutdown hook %s failed', getattr(hook, '__qualname__', hook))
@@ -0,0 +1,153 @@
+import inspect
+import threading
+import time
+from typing import Callable, Dict, List
+
+from injector import singleton, inject
+
+from common.interceptor import Interceptor, pointcut
+
+__TIMED__ = object()
+
+# Buckets per power of two, latencies are recorded with a relative error below 1/16
+SUB_BUCKETS = 16
+
+
+def bucket_of(micros: int) -> int:
+    exponent = max(0, micros.bit_length() - 5)
+    return exponent * SUB_BUCKETS + (micros >> exponent)
+
+
+def bucket_value(index: int) -> float:
+    exponent = max(0, index // SUB_BUCKETS - 1)
+    lower = (index - exponent * SUB_BUCKETS) << exponent
+    return lower + ((1 << exponent) - 1) / 2
+
+
+class MetricsRegistry:
+    """Per-method call counts, error counts and HDR-style latency histograms.
+
+    Every thread records into its own buffer without locking, buffers are merged by
+    :meth:`snapshot` when metrics are scraped.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._local = threading.local()
+        self._buffers: List[Dict[str, list]] = []
+        self._lock = threading.Lock()
+
+    def _buffer(self) -> Dict[str, list]:
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = self._local.buffer = dict()
+            with self._lock:
+                self._buffers.append(buffer)
+        return buffer
+
+    def record(self, name: str, micros: int, error: bool = False):
+        buffer = self._buffer()
+        # [calls, errors, total, max, buckets]
+        series = buffer.get(name)
+        if series is None:
+            series = buffer[name] = [0, 0, 0, 0, dict()]
+        series[0] += 1
+        if error:
+            series[1] += 1
+        series[2] += micros
+        if micros > series[3]:
+            series[3] = micros
+        buckets = series[4]
+        index = bucket_of(micros)
+        buckets[index] = buckets.get(index, 0) + 1
+
+    def merged(self) -> Dict[str, list]:
+        with self._lock:
+            buffers = list(self._buffers)
+        merged: Dict[str, list] = dict()
+        for buffer in buffers:
+            for name, (calls, errors, total, maximum, buckets) in list(buffer.items()):
+                series = merged.setdefault(name, [0, 0, 0, 0, dict()])
+                series[0] += calls
+                series[1] += errors
+                series[2] += total
+                series[3] = max(series[3], maximum)
+                for index, count in dict(buckets).items():
+                    series[4][index] = series[4].get(index, 0) + count
+        return merged
+
+    @staticmethod
+    def percentiles(buckets: Dict[int, int], calls: int, quantiles=(0.5, 0.9, 0.99, 0.999)) -> List[float]:
+        values = []
+        seen = 0
+        ordered = sorted(buckets.items())
+        position = 0
+        for quantile in quantiles:
+            rank = quantile * calls
+            while position < len(ordered) and seen + ordered[position][1] < rank:
+                seen += ordered[position][1]
+                position += 1
+            values.append(bucket_value(ordered[min(position, len(ordered) - 1)][0]) if ordered else 0)
+        return values
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Latencies in milliseconds per method, sorted by total time spent."""
+        result = dict()
+        for name, (calls, errors, total, maximum, buckets) in sorted(self.merged().items(),
+                                                                    key=lambda item: -item[1][2]):
+            p50, p90, p99, p999 = [min(value, maximum) for value in self.percentiles(buckets, calls)]
+            result[name] = dict(calls=calls, errors=errors, totalMs=total / 1000,
+                                meanMs=total / calls / 1000 if calls else 0, maxMs=maximum / 1000,
+                                p50Ms=p50 / 1000, p90Ms=p90 / 1000, p99Ms=p99 / 1000, p999Ms=p999 / 1000)
+        return result
+
+
+METRICS = MetricsRegistry()
+
+
+@inject
+@singleton
+class TimingInterceptor(Interceptor):
+    """Records the latency of methods decorated with :func:`timed` in :data:`METRICS`, raised exceptions count as
+    errors."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.metrics = METRICS
+
+    def handle(self, fn: Callable, *args, **kwargs):
+        start = time.perf_counter_ns()
+        error = True
+        try:
+            ret = fn(*args, **kwargs)
+            error = False
+            return ret
+        finally:
+            self.metrics.record(fn.__qualname__, (time.perf_counter_ns() - start) // 1000, error)
+
+    async def handle_async(self, fn: Callable, *args, **kwargs):
+        start = time.perf_counter_ns()
+        error = True
+        try:
+            ret = await fn(*args, **kwargs)
+            error = False
+            return ret
+        finally:
+            self.metrics.record(fn.__qualname__, (time.perf_counter_ns() - start) // 1000, error)
+
+    @property
+    def pointcut(self):
+        return __TIMED__
+
+
+def timed(fn):
+    """Record call count, errors and latency histogram of ``fn``."""
+    return pointcut(__TIMED__)(fn)
+
+
+def timed_methods(cls):
+    """Apply :func:`timed` to every public method defined by ``cls``."""
+    for name, member in list(vars(cls).items()):
+        if not name.startswith('_') and inspect.isfunction(member):
+            timed(member)
+    return cls
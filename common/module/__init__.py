@@ -7,6 +7,7 @@ from common.module.fast_api_provider import FastAPIProvider
 from common.module.interceptor_provider import InterceptorProvider
 from common.module.mongo_client_provider import MongoClientProvider
 from common.module.redis_provider import RedisProvider
+from common.module.service_provider import ServiceProvider
 
 modules = [ConfigProvider,
            MongoClientProvider,
@@ -15,5 +16,6 @@ modules = [ConfigProvider,
            FastAPIProvider,
            AMQPPublisherProvider,
            RedisProvider,
+           ServiceProvider,
            ControllerProvider,
            ElasticSearchProvider]
@@ -1,11 +1,15 @@
+import functools
 import inspect
 import logging
 from typing import List, TypeVar
 
-from boltons.funcutils import wraps
 from fastapi.routing import APIRouter
 from injector import Module, singleton, multiprovider, Injector, inject
+from starlette.concurrency import run_in_threadpool
+from starlette.config import Config
 
+from common.admission import AdmissionController, RouteLimiter
+from common.context import request_context
 from common.controller import ROUTE_KEY, ROUTER_KEY, is_router
 
 LOGGER = logging.getLogger(__name__)
@@ -16,9 +20,11 @@ Controller = TypeVar('Controller')
 @inject
 @singleton
 class ControllerToRouterConverter:
-    def __init__(self, injector: Injector) -> None:
+    def __init__(self, injector: Injector, config: Config, admission: AdmissionController) -> None:
         super().__init__()
         self.injector = injector
+        self.admission = admission
+        self.asynchronous = config('ASYNC_BACKEND', cast=bool, default=False)
 
     def __call__(self, cls: TypeVar) -> APIRouter:
         if not hasattr(cls, ROUTER_KEY):
@@ -30,17 +36,38 @@ class ControllerToRouterConverter:
         for (fn_name, fn) in members:
             for route_meta in fn.__route__:
                 route_inst = self.injector.get(cls)
-                _add_route(router, route_inst, route_meta, fn_name)
+                limiter = self.admission.limiter(getattr(cls, ROUTER_KEY)['prefix'] + route_meta['kwargs']['path'], fn)
+                _add_route(router, route_inst, route_meta, fn_name, self.asynchronous, limiter)
         return router
 
 
-def _add_route(router: APIRouter, obj, route: dict, fn_name: str):
+def _add_route(router: APIRouter, obj, route: dict, fn_name: str, asynchronous: bool = False,
+               limiter: RouteLimiter = None):
     fn = getattr(obj, fn_name)
-
-    @wraps(fn, injected=['self'])
-    def wrapper(*args, **kwargs):
-        ret = fn(*args, **kwargs)
-        return ret
+    threaded = not asynchronous and not inspect.iscoroutinefunction(fn)
+
+    def scoped(*args, **kwargs):
+        with request_context():
+            return fn(*args, **kwargs)
+
+    # Always served on the event loop: a request is admitted before a sync controller takes a worker thread
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if limiter is not None:
+            rejected = await limiter.enter_async(kwargs.get('ac_token'))
+            if rejected is not None:
+                return rejected
+        try:
+            if threaded:
+                return await run_in_threadpool(scoped, *args, **kwargs)
+            with request_context():
+                ret = fn(*args, **kwargs)
+                if inspect.isawaitable(ret):
+                    ret = await ret
+            return ret
+        finally:
+            if limiter is not None:
+                limiter.exit()
 
     router.api_route(*route['args'], **route['kwargs'])(wrapper)
 
@@ -6,6 +6,7 @@ from starlette.config import Config
 
 from common.controller import ROUTER_KEY
 from common.exception import *
+from common.lifecycle import startup, shutdown
 from common.utils import fullname
 
 LOGGER = logging.getLogger(__name__)
@@ -33,6 +34,8 @@ class FastAPIProvider(Module):
                            version=app_version)
         fast_api.__injector__ = injector
         self.__register_exception_handler(fast_api)
+        fast_api.add_event_handler('startup', startup)
+        fast_api.add_event_handler('shutdown', shutdown)
         for route in routers:
             self.__register_router(fast_api, route)
 
@@ -1,9 +1,11 @@
 from typing import List
 
 from injector import Module, multiprovider
+from starlette.config import Config
 
-from common.cache import CacheInterceptor
+from common.cache import CacheInterceptor, CacheEvictInterceptor, CachePutInterceptor
 from common.interceptor import Interceptor
+from common.metrics import TimingInterceptor
 
 
 # Provide default interceptors
@@ -13,6 +15,10 @@ class InterceptorProvider(Module):
         super().__init__()
 
     @multiprovider
-    def provide_controllers(self, cache: CacheInterceptor) -> List[Interceptor]:
-        interceptors = [cache]
+    def provide_controllers(self, config: Config, cache: CacheInterceptor, cache_evict: CacheEvictInterceptor,
+                            cache_put: CachePutInterceptor, timing: TimingInterceptor) -> List[Interceptor]:
+        interceptors = [cache, cache_evict, cache_put]
+        # Outermost, timings include cache hits
+        if config('METRICS_ENABLED', cast=bool, default=True):
+            interceptors.append(timing)
         return interceptors
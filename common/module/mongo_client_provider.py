@@ -1,7 +1,10 @@
 import logging
 
+from common.indexes import INDEXES
+from common.lifecycle import on_startup
 from common.utils import fullname
 from injector import singleton, provider, Module
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from pymongo import MongoClient
 from starlette.config import Config
 
@@ -10,15 +13,12 @@ LOGGER = logging.getLogger(__name__)
 
 # Provide Mongo Client from configuration
 class MongoClientProvider(Module):
-    @provider
-    @singleton
-    def provide(self, config: Config) -> MongoClient:
+    @staticmethod
+    def get_url(config: Config):
         host = config('MONGO_URL', cast=str, default='localhost')
 
         port = config('MONGO_PORT', cast=int, default=6379)
 
-        max_pool_size = config('MONGO_MAX_POOL_SIZE', cast=int, default=100)
-
         username = config('MONGO_USER', cast=str, default='')
 
         password = config('MONGO_PASSWORD', cast=str, default='')
@@ -27,10 +27,34 @@ class MongoClientProvider(Module):
 
         authMechanism = config('MONGO_AuthMechanism', cast=str, default='SCRAM-SHA-256')
 
-        client = MongoClient("mongodb+srv://{}:{}@{}/{}?retryWrites=true&w=majority".format(username,
-                                                                                            password,
-                                                                                            host,
-                                                                                            db))[db]
+        return "mongodb+srv://{}:{}@{}/{}?retryWrites=true&w=majority".format(username,
+                                                                             password,
+                                                                             host,
+                                                                             db)
+
+    @provider
+    @singleton
+    def provide(self, config: Config) -> MongoClient:
+        max_pool_size = config('MONGO_MAX_POOL_SIZE', cast=int, default=100)
+
+        db = config('MONGO_DB', cast=str, default='local')
+
+        client = MongoClient(self.get_url(config), maxPoolSize=max_pool_size)[db]
         LOGGER.debug(fullname(MongoClient) + ' configurated')
+        # Services declare their indexes at import time, ensure them once the app starts
+        on_startup(lambda: INDEXES.bootstrap(client, config))
+
+        return client
+
+    # Motor counterpart used when ASYNC_BACKEND is enabled
+    @provider
+    @singleton
+    def provide_async(self, config: Config) -> AsyncIOMotorDatabase:
+        max_pool_size = config('MONGO_MAX_POOL_SIZE', cast=int, default=100)
+
+        db = config('MONGO_DB', cast=str, default='local')
+
+        client = AsyncIOMotorClient(self.get_url(config), maxPoolSize=max_pool_size)[db]
+        LOGGER.debug(fullname(AsyncIOMotorClient) + ' configurated')
 
         return client
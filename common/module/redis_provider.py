@@ -3,6 +3,7 @@ import logging
 import redis
 from injector import singleton, provider, Module
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
 from starlette.config import Config
 
 LOGGER = logging.getLogger(__name__)
@@ -24,3 +25,12 @@ class RedisProvider(Module):
                                 decode_responses=False)
         LOGGER.debug('Redis Client Initialized')
         return client
+
+    @provider
+    @singleton
+    def provide_async(self, config: Config) -> AsyncRedis:
+        client = AsyncRedis(host=config('REDIS_URL', cast=str, default='localhost'),
+                            port=config('REDIS_PORT', cast=int, default=6379),
+                            decode_responses=False)
+        LOGGER.debug('Async Redis Client Initialized')
+        return client
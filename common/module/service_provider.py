@@ -0,0 +1,35 @@
+import logging
+
+from injector import singleton, provider, Module, Injector
+from starlette.config import Config
+
+from service.async_course import AsyncClassService
+from service.async_user import AsyncUserService
+from service.course import BaseClassService, ClassService
+from service.user import BaseUserService, UserService
+
+LOGGER = logging.getLogger(__name__)
+
+
+# Provide sync (pymongo) or async (motor) services, switched by ASYNC_BACKEND
+class ServiceProvider(Module):
+
+    @staticmethod
+    def is_async(config: Config) -> bool:
+        return config('ASYNC_BACKEND', cast=bool, default=False)
+
+    @provider
+    @singleton
+    def provide_user_service(self, config: Config, injector: Injector) -> BaseUserService:
+        if self.is_async(config):
+            LOGGER.debug('Async UserService selected')
+            return injector.get(AsyncUserService)
+        return injector.get(UserService)
+
+    @provider
+    @singleton
+    def provide_class_service(self, config: Config, injector: Injector) -> BaseClassService:
+        if self.is_async(config):
+            LOGGER.debug('Async ClassService selected')
+            return injector.get(AsyncClassService)
+        return injector.get(ClassService)
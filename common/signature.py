@@ -0,0 +1,19 @@
+import hashlib
+import hmac
+
+
+def derive_key(secret: str, user_uuid: str) -> str:
+    """Per-user key signing offline checkins, handed to the student's device while it is online."""
+    return hmac.new(secret.encode(), ('checkin:' + user_uuid).encode(), hashlib.sha256).hexdigest()
+
+
+def checkin_message(roll_call_id: int, user_id: int, mac: str, lat: float, long: float, check_at: int) -> bytes:
+    return '{}:{}:{}:{:.6f}:{:.6f}:{}'.format(roll_call_id, user_id, mac, lat, long, int(check_at)).encode()
+
+
+def sign(key: str, message: bytes) -> str:
+    return hmac.new(key.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify(key: str, message: bytes, signature: str) -> bool:
+    return hmac.compare_digest(sign(key, message), signature or '')
@@ -0,0 +1,391 @@
+import hashlib
+import json
+import logging
+import pickle
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from cachetools import TTLCache
+from injector import singleton, inject
+from redis import Redis, RedisError
+from redis.asyncio import Redis as AsyncRedis
+
+LOGGER = logging.getLogger(__name__)
+
+# Leave a tombstone holding the redis time (ms) on every key, ARGV: tombstone ttl (ms)
+__STAMP__ = """
+local time = redis.call('time')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+for i = 1, #KEYS do
+    redis.call('set', KEYS[i], now, 'px', ARGV[1])
+end
+return now
+"""
+
+# Store an entry unless its key or a tag got a tombstone since the fill started
+# KEYS: entry, tag sets..., tombstones of the entry and of the tag sets
+# ARGV: value, expire, tag count, fill start (ms)
+__WRITE_IF_VALID__ = """
+local tags = tonumber(ARGV[3])
+for i = 2 + tags, #KEYS do
+    if tonumber(redis.call('get', KEYS[i]) or -1) >= tonumber(ARGV[4]) then
+        return 0
+    end
+end
+redis.call('set', KEYS[1], ARGV[1], 'ex', ARGV[2])
+for i = 2, 1 + tags do
+    redis.call('sadd', KEYS[i], KEYS[1])
+    redis.call('expire', KEYS[i], ARGV[2])
+end
+return 1
+"""
+
+
+class _EvictingTTLCache(TTLCache):
+    def __init__(self, maxsize, ttl, getsizeof=None, on_evict: Callable = None):
+        super().__init__(maxsize=maxsize, ttl=ttl, getsizeof=getsizeof)
+        self.on_evict = on_evict
+
+    # Only called when an entry has to make room for another one
+    def popitem(self):
+        key, entry = super().popitem()
+        if self.on_evict is not None:
+            self.on_evict(key, entry[0])
+        return key, entry
+
+
+class LocalCache:
+    """Thread-safe bounded LRU/TTL cache, entries can carry tags for bulk invalidation.
+
+    ``maxsize`` counts entries, or bytes when entries are set with their ``size``.
+    ``on_evict(key, value)`` is called for entries evicted to respect ``maxsize``.
+    """
+
+    def __init__(self, maxsize: int, ttl: int, sized: bool = False, on_evict: Callable = None) -> None:
+        super().__init__()
+        getsizeof = (lambda entry: entry[2]) if sized else None
+        self._cache = _EvictingTTLCache(maxsize=maxsize, ttl=ttl, getsizeof=getsizeof, on_evict=on_evict)
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def set(self, key, value, tags: Iterable[str] = (), size: int = 1):
+        with self._lock:
+            try:
+                self._cache[key] = (value, frozenset(tags), size)
+            except ValueError:
+                # Larger than the whole cache
+                self._cache.pop(key, None)
+
+    def pop(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._cache.pop(key, None)
+
+    def pop_tags(self, *tags):
+        tags = set(tags)
+        with self._lock:
+            for key in [key for key, entry in self._cache.items() if entry[1] & tags]:
+                self._cache.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+@inject
+@singleton
+class InvalidationBus:
+    """Redis pub/sub fan-out of invalidation messages between workers.
+
+    Every subscription shares one listener thread. When the connection is lost the
+    handlers receive ``{'all': True}`` after reconnecting, since messages may have been missed.
+    """
+
+    def __init__(self, redis: Redis, async_redis: AsyncRedis) -> None:
+        super().__init__()
+        self.redis = redis
+        self.async_redis = async_redis
+        self._handlers: Dict[str, List[Callable[[dict], None]]] = defaultdict(list)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        LOGGER.debug('InvalidationBus Initialized')
+
+    def subscribe(self, channel: str, handler: Callable[[dict], None]):
+        with self._lock:
+            self._handlers[channel].append(handler)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='invalidation-bus', daemon=True)
+                self._thread.start()
+
+    def publish(self, channel: str, message: dict):
+        try:
+            self.redis.publish(channel, json.dumps(message))
+        except RedisError as ex:
+            LOGGER.warning('Can\'t publish invalidation on %s: %s', channel, ex)
+
+    async def apublish(self, channel: str, message: dict):
+        try:
+            await self.async_redis.publish(channel, json.dumps(message))
+        except RedisError as ex:
+            LOGGER.warning('Can\'t publish invalidation on %s: %s', channel, ex)
+
+    def _dispatch(self, channel: str, message: dict):
+        for handler in list(self._handlers.get(channel, [])):
+            try:
+                handler(message)
+            except Exception:
+                LOGGER.exception('Invalidation handler failed on %s', channel)
+
+    def _run(self):
+        pubsub = None
+        subscribed = set()
+        disconnected = False
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                    subscribed = set()
+                pending = set(self._handlers.keys()) - subscribed
+                if pending:
+                    pubsub.subscribe(*pending)
+                    subscribed |= pending
+                if disconnected:
+                    LOGGER.info('InvalidationBus reconnected')
+                    disconnected = False
+                    for channel in subscribed:
+                        self._dispatch(channel, {'all': True})
+                message = pubsub.get_message(timeout=1.0)
+                if message is not None and message['type'] == 'message':
+                    channel = message['channel']
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    self._dispatch(channel, json.loads(message['data']))
+            except RedisError as ex:
+                if not disconnected:
+                    LOGGER.warning('InvalidationBus disconnected: %s', ex)
+                    disconnected = True
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except RedisError:
+                        pass
+                pubsub = None
+                time.sleep(1.0)
+
+
+class TieredCache:
+    """In-process :class:`LocalCache` in front of a shared Redis tier.
+
+    Invalidations are applied locally, removed from Redis and broadcast over the
+    :class:`InvalidationBus` so the other workers drop their local copies too.
+    Redis failures degrade to the local tier only. The coroutine variants go through ``async_redis``.
+
+    Invalidations also leave a tombstone with their Redis time on the key and tags for ``tombstone_ttl``
+    seconds. A value loaded after :meth:`begin_fill` is only stored by :meth:`set` if neither its key nor
+    its tags were invalidated since, so a fill racing a logout can't bring the identity back.
+    Keys are hashed before reaching Redis or the bus, they may be secrets such as access tokens.
+    """
+
+    def __init__(self, redis: Redis, async_redis: AsyncRedis, bus: InvalidationBus, namespace: str,
+                 maxsize: int = 1024, ttl: int = 60, redis_ttl: int = 600, enabled: bool = True,
+                 tombstone_ttl: int = 30) -> None:
+        super().__init__()
+        self.redis = redis
+        self.async_redis = async_redis
+        self.bus = bus
+        self.namespace = namespace
+        self.redis_ttl = redis_ttl
+        self.tombstone_ttl = tombstone_ttl
+        self.enabled = enabled
+        self.local = LocalCache(maxsize, ttl)
+        self.channel = namespace + ':invalidate'
+        # Bumped by every invalidation applied to the local tier
+        self._epoch = 0
+        self._epoch_lock = threading.Lock()
+        self.write_if_valid = redis.register_script(__WRITE_IF_VALID__)
+        self.write_if_valid_async = async_redis.register_script(__WRITE_IF_VALID__)
+        self.stamp = redis.register_script(__STAMP__)
+        self.stamp_async = async_redis.register_script(__STAMP__)
+        if enabled:
+            bus.subscribe(self.channel, self._on_invalidate)
+
+    @staticmethod
+    def _digest(key: str) -> str:
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def _key(self, digest: str) -> str:
+        return '{}:{}'.format(self.namespace, digest)
+
+    def _tag_key(self, tag: str) -> str:
+        return '{}:tag:{}'.format(self.namespace, tag)
+
+    @staticmethod
+    def _tombstone_key(redis_key: str) -> str:
+        return 'tombstone:' + redis_key
+
+    def _pop_local(self, digests: List[str], tags: List[str]):
+        with self._epoch_lock:
+            self._epoch += 1
+        self.local.pop(*digests)
+        self.local.pop_tags(*tags)
+
+    @staticmethod
+    def _now(time_: Tuple[int, int]) -> int:
+        return time_[0] * 1000 + time_[1] // 1000
+
+    def begin_fill(self) -> Optional[Tuple[int, Optional[int]]]:
+        """Mark the start of a load whose result is handed to :meth:`set`, before reading the source of truth."""
+        if not self.enabled:
+            return None
+        epoch = self._epoch
+        try:
+            return epoch, self._now(self.redis.time())
+        except RedisError as ex:
+            LOGGER.warning('Can\'t read the time of redis: %s', ex)
+            return epoch, None
+
+    async def abegin_fill(self) -> Optional[Tuple[int, Optional[int]]]:
+        if not self.enabled:
+            return None
+        epoch = self._epoch
+        try:
+            return epoch, self._now(await self.async_redis.time())
+        except RedisError as ex:
+            LOGGER.warning('Can\'t read the time of redis: %s', ex)
+            return epoch, None
+
+    def _loaded(self, digest: str, raw: Optional[bytes]) -> Optional[Any]:
+        if raw is None:
+            return None
+        value, tags = pickle.loads(raw)
+        self.local.set(digest, value, tags)
+        return value
+
+    def get(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        digest = self._digest(key)
+        value = self.local.get(digest)
+        if value is not None:
+            return value
+        try:
+            raw = self.redis.get(self._key(digest))
+        except RedisError as ex:
+            LOGGER.warning('Can\'t read %s from redis: %s', self._key(digest), ex)
+            return None
+        return self._loaded(digest, raw)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        digest = self._digest(key)
+        value = self.local.get(digest)
+        if value is not None:
+            return value
+        try:
+            raw = await self.async_redis.get(self._key(digest))
+        except RedisError as ex:
+            LOGGER.warning('Can\'t read %s from redis: %s', self._key(digest), ex)
+            return None
+        return self._loaded(digest, raw)
+
+    def _write_arguments(self, digest: str, value: Any, tags: List[str], started: int) -> dict:
+        redis_keys = [self._key(digest)] + [self._tag_key(tag) for tag in tags]
+        return dict(keys=redis_keys + [self._tombstone_key(redis_key) for redis_key in redis_keys],
+                    args=[pickle.dumps((value, tags)), self.redis_ttl, len(tags), started])
+
+    def _set_local(self, digest: str, value: Any, tags: List[str], fill) -> bool:
+        # An invalidation applied locally since begin_fill, the value may be outdated
+        if self._epoch != fill[0]:
+            return False
+        self.local.set(digest, value, tags)
+        return True
+
+    def set(self, key: str, value: Any, fill: Optional[Tuple[int, Optional[int]]],
+            tags: Iterable[str] = ()):
+        """Store ``value`` loaded after ``fill = begin_fill()``, unless ``key`` or ``tags`` were invalidated since."""
+        if not self.enabled or fill is None:
+            return
+        digest, tags = self._digest(key), list(tags)
+        if fill[1] is None:
+            self._set_local(digest, value, tags, fill)
+            return
+        try:
+            written = self.write_if_valid(**self._write_arguments(digest, value, tags, fill[1]))
+        except RedisError as ex:
+            LOGGER.warning('Can\'t write %s to redis: %s', self._key(digest), ex)
+            written = True
+        if written:
+            self._set_local(digest, value, tags, fill)
+
+    async def aset(self, key: str, value: Any, fill: Optional[Tuple[int, Optional[int]]],
+                   tags: Iterable[str] = ()):
+        if not self.enabled or fill is None:
+            return
+        digest, tags = self._digest(key), list(tags)
+        if fill[1] is None:
+            self._set_local(digest, value, tags, fill)
+            return
+        try:
+            written = await self.write_if_valid_async(**self._write_arguments(digest, value, tags, fill[1]))
+        except RedisError as ex:
+            LOGGER.warning('Can\'t write %s to redis: %s', self._key(digest), ex)
+            written = True
+        if written:
+            self._set_local(digest, value, tags, fill)
+
+    def _stamped(self, digests: List[str], tags: List[str]) -> List[str]:
+        return [self._tombstone_key(self._key(digest)) for digest in digests] + \
+               [self._tombstone_key(self._tag_key(tag)) for tag in tags]
+
+    def invalidate(self, keys: Iterable[str] = (), tags: Iterable[str] = ()):
+        if not self.enabled:
+            return
+        digests, tags = [self._digest(key) for key in keys], list(tags)
+        self._pop_local(digests, tags)
+        try:
+            if digests or tags:
+                self.stamp(keys=self._stamped(digests, tags), args=[self.tombstone_ttl * 1000])
+            redis_keys = [self._key(digest) for digest in digests]
+            for tag in tags:
+                redis_keys.extend(member.decode() for member in self.redis.smembers(self._tag_key(tag)))
+                redis_keys.append(self._tag_key(tag))
+            if redis_keys:
+                self.redis.delete(*redis_keys)
+        except RedisError as ex:
+            LOGGER.warning('Can\'t invalidate %s in redis: %s', self.namespace, ex)
+        self.bus.publish(self.channel, {'keys': digests, 'tags': tags})
+
+    async def ainvalidate(self, keys: Iterable[str] = (), tags: Iterable[str] = ()):
+        if not self.enabled:
+            return
+        digests, tags = [self._digest(key) for key in keys], list(tags)
+        self._pop_local(digests, tags)
+        try:
+            if digests or tags:
+                await self.stamp_async(keys=self._stamped(digests, tags), args=[self.tombstone_ttl * 1000])
+            redis_keys = [self._key(digest) for digest in digests]
+            for tag in tags:
+                redis_keys.extend(member.decode() for member in await self.async_redis.smembers(self._tag_key(tag)))
+                redis_keys.append(self._tag_key(tag))
+            if redis_keys:
+                await self.async_redis.delete(*redis_keys)
+        except RedisError as ex:
+            LOGGER.warning('Can\'t invalidate %s in redis: %s', self.namespace, ex)
+        await self.bus.apublish(self.channel, {'keys': digests, 'tags': tags})
+
+    def _on_invalidate(self, message: dict):
+        if message.get('all'):
+            with self._epoch_lock:
+                self._epoch += 1
+            self.local.clear()
+            return
+        self._pop_local(message.get('keys', []), message.get('tags', []))
@@ -1,9 +1,12 @@
+import functools
 import inspect
-from typing import List, Union
+import weakref
+from typing import List, Union, Iterable, Optional, Tuple
 
 from boltons.funcutils import wraps
 from fastapi import FastAPI
 from injector import Injector
+from pymongo import ReturnDocument
 from starlette.requests import Request
 
 from common.interceptor import Interceptor
@@ -24,22 +27,117 @@ class ValidationUtils:
         return phone.isnumeric() and (len(phone) == 10 or len(phone) == 11)
 
 
+class MongoUtils:
+    @staticmethod
+    def __lookup_projection(field: str, projection: Optional[dict]):
+        # The lookup field is needed to restore the order, fetch it even when the caller leaves it out
+        if projection is None:
+            return None, False
+        projection = dict(projection)
+        if field in projection and not projection[field]:
+            del projection[field]
+            return projection, True
+        inclusion = any(value for key, value in projection.items() if key != '_id')
+        if inclusion and not projection.get(field):
+            projection[field] = 1
+            return projection, True
+        return projection, False
+
+    @staticmethod
+    def __ordered(docs: Iterable[dict], field: str, values: list, strip: bool) -> List[dict]:
+        by_value = {doc[field]: doc for doc in docs}
+        ordered = [dict(by_value[value]) for value in values if value in by_value]
+        if strip:
+            for doc in ordered:
+                doc.pop(field, None)
+        return ordered
+
+    @staticmethod
+    def find_ordered(collection, field: str, values: Iterable, projection: dict = None) -> List[dict]:
+        """Load the documents whose ``field`` is in ``values`` with one ``$in`` query.
+
+        Documents come back in the order of ``values``, missing ones are skipped.
+        """
+        values = list(values)
+        if not values:
+            return []
+        lookup_projection, strip = MongoUtils.__lookup_projection(field, projection)
+        docs = collection.find({field: {'$in': values}}, lookup_projection)
+        return MongoUtils.__ordered(docs, field, values, strip)
+
+    @staticmethod
+    async def find_ordered_async(collection, field: str, values: Iterable, projection: dict = None) -> List[dict]:
+        values = list(values)
+        if not values:
+            return []
+        lookup_projection, strip = MongoUtils.__lookup_projection(field, projection)
+        docs = await collection.find({field: {'$in': values}}, lookup_projection).to_list(None)
+        return MongoUtils.__ordered(docs, field, values, strip)
+
+    @staticmethod
+    def __push_unique(query: dict, field: str, value, key: Optional[str], counter: Optional[str]):
+        # The filter only matches while the value is missing, so the push and the counter move together
+        if key is None:
+            query = dict(query, **{field: {'$ne': value}})
+        else:
+            query = dict(query, **{field + '.' + key: {'$ne': value[key]}})
+        update = {'$push': {field: value}}
+        if counter is not None:
+            update['$inc'] = {counter: 1}
+        return query, update
+
+    @staticmethod
+    def push_unique(collection, query: dict, field: str, value, key: str = None, counter: str = None,
+                    projection: dict = None) -> Optional[dict]:
+        """Append ``value`` to the array ``field`` of the document matching ``query`` and ``$inc`` its ``counter``,
+        unless an element equal to ``value`` (or with the same ``key``) is already there.
+
+        Only ``value`` goes over the wire whatever the size of the array. Returns the updated document restricted
+        to ``projection``, ``None`` when the value was already there or no document matches.
+        """
+        query, update = MongoUtils.__push_unique(query, field, value, key, counter)
+        return collection.find_one_and_update(query, update, projection or {'_id': 1},
+                                              return_document=ReturnDocument.AFTER)
+
+    @staticmethod
+    async def push_unique_async(collection, query: dict, field: str, value, key: str = None, counter: str = None,
+                                projection: dict = None) -> Optional[dict]:
+        query, update = MongoUtils.__push_unique(query, field, value, key, counter)
+        return await collection.find_one_and_update(query, update, projection or {'_id': 1},
+                                                    return_document=ReturnDocument.AFTER)
+
+
 class InjectorUtils:
+    # Injector -> class -> [(method name, interceptors)], resolved once per class
+    __chains = weakref.WeakKeyDictionary()
+
     @staticmethod
-    def create_method_proxy(injector, fn, pointcut):
-        @wraps(fn, injected=['self'])
-        def proxy(*_args, **_kwargs):
-            nonlocal fn
-            if hasattr(fn, '__is_intercepted__'):
-                return fn(*_args, **_kwargs)
-            # List all interceptor belongs to this function
-            interceptors: List[Interceptor] = [interceptor for interceptor in injector.get(List[Interceptor]) if
-                                               interceptor.pointcut is pointcut]
-            for interceptor in interceptors:
-                fn = interceptor.wraps(fn)
-            setattr(fn, '__is_intercepted__', True)
-            return fn(*_args, **_kwargs)
+    def resolve_chains(injector: Injector, cls) -> List[Tuple[str, List[Interceptor]]]:
+        chains = InjectorUtils.__chains.setdefault(injector, dict())
+        if cls not in chains:
+            members = inspect.getmembers(cls, lambda member: hasattr(member, '__pointcuts__'))
+            resolved = []
+            if members:
+                interceptors: List[Interceptor] = injector.get(List[Interceptor])
+                for (name, fn) in members:
+                    # Every pointcut of the method with work to do, in the order interceptors are provided
+                    matched = [interceptor for interceptor in interceptors
+                               if interceptor.pointcut in fn.__pointcuts__ and interceptor.intercepts(fn)]
+                    if matched:
+                        resolved.append((name, matched))
+            chains[cls] = resolved
+        return chains[cls]
 
+    @staticmethod
+    def create_method_proxy(fn, interceptors: List[Interceptor]):
+        """Compose ``interceptors`` around the bound method ``fn``, the first one being the innermost.
+
+        Coroutine methods get an awaitable chain, the proxy keeps the signature of ``fn``.
+        """
+        proxy = fn
+        # Every layer looks like fn to the next interceptor
+        for interceptor in interceptors:
+            proxy = functools.update_wrapper(interceptor.wraps(proxy), fn)
         return proxy
 
     # Patch Injector to support Interceptor
@@ -48,14 +146,11 @@ class InjectorUtils:
         def patch(call_with_injection):
             @wraps(call_with_injection)
             def wrapper(*args, **kwargs):
-                if isinstance(args[0], Injector) and len(args) >= 3 and args[2] is not None:
-                    _self = args[2]
-                    injector = args[0]
-                    members = inspect.getmembers(_self, lambda member: hasattr(member, '__pointcuts__'))
-                    for (pointcut_fn_name, pointcut_fn) in members:
-                        for pointcut in pointcut_fn.__pointcuts__:
-                            proxy = InjectorUtils.create_method_proxy(injector, pointcut_fn, pointcut)
-                            setattr(_self, pointcut_fn_name, proxy)
+                # self_ is passed by keyword when injector creates an object
+                _self = args[2] if len(args) >= 3 else kwargs.get('self_')
+                if isinstance(args[0], Injector) and _self is not None:
+                    for (name, interceptors) in InjectorUtils.resolve_chains(args[0], type(_self)):
+                        setattr(_self, name, InjectorUtils.create_method_proxy(getattr(_self, name), interceptors))
                 return call_with_injection(*args, **kwargs)
 
             return wrapper
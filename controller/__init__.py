@@ -1,2 +1,3 @@
 import controller.user
 import controller.course
+import controller.metrics
@@ -1,10 +1,12 @@
 import logging
 
 from fastapi import Header
+from starlette.requests import Request
 
-from request.course import Class, UpdateClass, RollCall, UpdateRollCall, Checkin, Notification
+from request.course import Class, UpdateClass, RollCall, UpdateRollCall, Checkin, Notification, BulkCheckin
+from common.admission import admission
 from common.controller import router, get, post, put, delete
-from service.course import ClassService
+from service.course import BaseClassService
 
 LOGGER = logging.getLogger(__name__)
 
@@ -12,7 +14,7 @@ LOGGER = logging.getLogger(__name__)
 @router('/courses', tags=['courses'])
 class CourseController:
 
-    def __init__(self, course_service: ClassService) -> None:
+    def __init__(self, course_service: BaseClassService) -> None:
         super().__init__()
         self.course_service = course_service
         LOGGER.debug('CourseController Created')
@@ -60,11 +62,20 @@ class CourseController:
         return self.course_service.update_roll_call(course_id, roll_call_id, roll_call, ac_token)
 
     @post('/{course_id}/roll-call/{roll_call_id}/checkin')
+    @admission(rate=200, burst=400, user_rate=1, user_burst=3, concurrency=16)
     def checkin(self, course_id: int, roll_call_id: int, checkin: Checkin,
                 ac_token: str = Header(None, min_length=50, max_length=50, convert_underscores=False)):
         return self.course_service.checkin(course_id, roll_call_id, checkin, ac_token)
 
+    # Offline checkins signed with the key of each student (GET /users/checkin-key), uploaded by one device
+    @post('/{course_id}/roll-call/{roll_call_id}/checkin/bulk')
+    @admission(rate=20, burst=40, user_rate=1, user_burst=5, concurrency=4)
+    def bulk_checkin(self, course_id: int, roll_call_id: int, bulk: BulkCheckin,
+                     ac_token: str = Header(None, min_length=50, max_length=50, convert_underscores=False)):
+        return self.course_service.bulk_checkin(course_id, roll_call_id, bulk, ac_token)
+
     @get('/{course_id}/roll-call/{roll_call_id}/checkin')
+    @admission(user_rate=2, user_burst=5, concurrency=16)
     def check_checkin(self, course_id: int, roll_call_id: int,
                       ac_token: str = Header(None, min_length=50, max_length=50, convert_underscores=False)):
         return self.course_service.check_checkin(course_id, roll_call_id, ac_token)
@@ -73,6 +84,12 @@ class CourseController:
     def list_checkin(self, course_id: int, roll_call_id: int):
         return self.course_service.list_checkin(course_id, roll_call_id)
 
+    # Server-Sent Events for the lecturer: a snapshot of the members, then every new checkin until the roll call ends
+    @get('/{course_id}/roll-call/{roll_call_id}/list-check/stream')
+    def stream_checkin(self, course_id: int, roll_call_id: int, request: Request,
+                       ac_token: str = Header(None, min_length=50, max_length=50, convert_underscores=False)):
+        return self.course_service.stream_checkin(course_id, roll_call_id, request, ac_token)
+
     @get('/{id}/notifications')
     def list_notification(self, id: int,
                           ac_token: str = Header(None, min_length=50, max_length=50, convert_underscores=False)):
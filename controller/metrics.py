@@ -0,0 +1,47 @@
+import hmac
+import logging
+
+from fastapi import Header
+from starlette.config import Config
+from starlette.responses import JSONResponse
+
+from common.admission import AdmissionController, admission
+from common.cache import CacheInterceptor
+from common.controller import router, get
+from common.metrics import METRICS
+from service.token_refresher import TokenRefresher
+
+LOGGER = logging.getLogger(__name__)
+
+
+@router('/metrics', tags=['metrics'])
+class MetricsController:
+    """Metrics of this worker, served only to callers sending the ``METRICS_TOKEN`` in the ``metrics_token``
+    header. Without a ``METRICS_TOKEN`` configured the route answers 404."""
+
+    def __init__(self, cache: CacheInterceptor, token_refresher: TokenRefresher,
+                 admission_controller: AdmissionController, config: Config) -> None:
+        super().__init__()
+        self.cache = cache
+        self.admission = admission_controller
+        self.token_refresher = token_refresher
+        self.token = config('METRICS_TOKEN', default='')
+        LOGGER.debug('MetricsController Created')
+
+    def denied(self, metrics_token: str):
+        if not self.token:
+            return JSONResponse(status_code=404, content={'message': 'Không tìm thấy'})
+        if not metrics_token or not hmac.compare_digest(metrics_token.encode(), self.token.encode()):
+            return JSONResponse(status_code=403, content={'message': 'Không có quyền truy cập'})
+        return None
+
+    @get('/?')
+    @admission(rate=2, burst=10, concurrency=2)
+    def get_metrics(self, metrics_token: str = Header(None, convert_underscores=False)):
+        denied = self.denied(metrics_token)
+        if denied is not None:
+            return denied
+        return dict(methods=METRICS.snapshot(),
+                    cache=self.cache.stats(),
+                    tokenRefresher=self.token_refresher.metrics(),
+                    admission=self.admission.metrics())
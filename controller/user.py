@@ -1,10 +1,10 @@
 import logging
 
-from fastapi import Header
+from fastapi import Header, Query
 
 from common.controller import get, router, post, put
 from request.user import User, UserLogin, UserUpdate, UserForget, UserJoin, SendMessage
-from service.user import UserService
+from service.user import BaseUserService
 
 LOGGER = logging.getLogger(__name__)
 
@@ -12,7 +12,7 @@ LOGGER = logging.getLogger(__name__)
 @router('/users', tags=['user'])
 class UserController:
 
-    def __init__(self, user_service: UserService) -> None:
+    def __init__(self, user_service: BaseUserService) -> None:
         super().__init__()
 
         self.user_service = user_service
@@ -47,21 +47,26 @@ class UserController:
     def user_forget(self, user_forget: UserForget):
         return self.user_service.user_forget(user_forget)
 
+    @get('/checkin-key')
+    def checkin_key(self, ac_token: str = Header(None, min_length=50, max_length=50, convert_underscores=False)):
+        return self.user_service.checkin_key(ac_token)
+
     @post('/join')
     def join_class(self, data: UserJoin,
                    ac_token: str = Header(None, min_length=50, max_length=50, convert_underscores=False)):
         return self.user_service.user_join_class(data, ac_token)
 
     @post('/conversations/send-message')
-    def send_message(self, message: SendMessage,
+    def send_message(self, message: SendMessage, limit: int = Query(50, ge=1, le=200),
                      ac_token: str = Header(None, min_length=50, max_length=50, convert_underscores=False)):
-        return self.user_service.send_message(message, ac_token)
+        return self.user_service.send_message(message, ac_token, limit)
 
     @get('/conversations')
-    def list_conversation(self, ac_token: str = Header(None, min_length=50, max_length=50, convert_underscores=False)):
-        return self.user_service.list_conversation(ac_token)
+    def list_conversation(self, offset: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=200),
+                          ac_token: str = Header(None, min_length=50, max_length=50, convert_underscores=False)):
+        return self.user_service.list_conversation(ac_token, offset, limit)
 
     @get('/conversations/{id}')
-    def get_conversation(self, id: int,
+    def get_conversation(self, id: int, before: str = None, after: str = None, limit: int = Query(50, ge=1, le=200),
                          ac_token: str = Header(None, min_length=50, max_length=50, convert_underscores=False)):
-        return self.user_service.get_conversation_info(id, ac_token)
+        return self.user_service.get_conversation_info(id, ac_token, before, after, limit)
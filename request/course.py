@@ -1,4 +1,13 @@
-from pydantic import BaseModel
+from typing import List, Optional
+
+from pydantic import BaseModel, validator
+
+
+def positive_radius(radius: Optional[int]) -> Optional[int]:
+    # 0 would silently fall back to CHECKIN_RADIUS and a negative radius rejects every checkin
+    if radius is not None and radius <= 0:
+        raise ValueError('Bán kính phải lớn hơn 0')
+    return radius
 
 
 class Class(BaseModel):
@@ -30,6 +39,9 @@ class RollCall(BaseModel):
     mac: str
     lat: float
     long: float
+    radius: int = None
+
+    _positive_radius = validator('radius', allow_reuse=True)(positive_radius)
 
 
 class UpdateRollCall(BaseModel):
@@ -38,6 +50,9 @@ class UpdateRollCall(BaseModel):
     mac: str = None
     lat: float = None
     long: float = None
+    radius: int = None
+
+    _positive_radius = validator('radius', allow_reuse=True)(positive_radius)
 
 
 class Checkin(BaseModel):
@@ -46,6 +61,19 @@ class Checkin(BaseModel):
     long: float = None
 
 
+class SignedCheckin(BaseModel):
+    userId: int
+    mac: str
+    lat: float
+    long: float
+    checkAt: int
+    signature: str
+
+
+class BulkCheckin(BaseModel):
+    checkins: List[SignedCheckin]
+
+
 class Notification(BaseModel):
     title: str
     body: str
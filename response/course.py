@@ -57,6 +57,7 @@ class RollCallInfo:
     location: dict
     total: int
     count: int
+    radius: int = None
 
     @staticmethod
     def roll_call_info(roll_call: dict):
@@ -67,7 +68,8 @@ class RollCallInfo:
                             mac=roll_call['mac'],
                             location=dict(lat=roll_call['lat'], long=roll_call['long']),
                             total=roll_call['total'],
-                            count=roll_call['count'])
+                            count=roll_call['count'],
+                            radius=roll_call.get('radius'))
 
 
 @dataclass
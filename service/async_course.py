@@ -0,0 +1,269 @@
+import asyncio
+
+from injector import singleton, inject
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import errors, ReturnDocument
+from starlette.config import Config
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from response.course import ClassInfo, CourseList, RollCallInfo, RollCallList, NotificationList, NotificationInfo
+from request.course import Class, UpdateClass, RollCall, UpdateRollCall, Checkin, Notification, BulkCheckin
+from service.async_user import AsyncUserService
+from service.bulk_checkin import summary
+from service.checkin_ingestor import AsyncCheckinIngestor
+from service.checkin_stream import CheckinStream
+from service.roll_call_state import RollCallState
+from service.course import BaseClassService, COURSE_CACHE, BULK_USER_PROJECTION, COURSE_LIST_PROJECTION
+from common.cache import cache, cache_evict, cache_put
+from common.context import request_scoped
+from common.exception import NotFoundException
+from common.id_allocator import AsyncIdAllocator
+from common.metrics import timed_methods
+from common.utils import MongoUtils
+
+
+# Motor implementation of ClassService, selected with ASYNC_BACKEND
+@inject
+@singleton
+@timed_methods
+class AsyncClassService(BaseClassService):
+
+    def __init__(self, mongo: AsyncIOMotorDatabase, config: Config, user: AsyncUserService,
+                 id_allocator: AsyncIdAllocator, ingestor: AsyncCheckinIngestor, state: RollCallState,
+                 stream: CheckinStream) -> None:
+        super().__init__(config, id_allocator, ingestor, state, stream)
+        self.user_service: AsyncUserService = user
+        self.mongo: AsyncIOMotorDatabase = mongo
+
+    @cache(**COURSE_CACHE)
+    async def get_course(self, class_id: int):
+        course = await self.mongo[self.courses].find_one({'id': class_id}, {'_id': 0})
+        if course is None:
+            raise NotFoundException(404, "course not found")
+        return ClassInfo.course_info(course)
+
+    async def _live_roll_call(self, class_id: int, roll_call_id: int, user_id: int = None):
+        return self.live_roll_call(class_id, await self.state.load_async(roll_call_id, user_id))
+
+    @request_scoped
+    async def get_roll_call(self, class_id: int, roll_call_id: int):
+        live = await self._live_roll_call(class_id, roll_call_id)
+        if live is not None:
+            return live[0]
+        roll_call = await self.mongo[self.roll_call].find_one({'classId': class_id, 'id': roll_call_id},
+                                                              {'_id': 0, 'uuid': 0})
+        if roll_call is None:
+            raise NotFoundException(404, "roll call not found")
+        return RollCallInfo.roll_call_info(roll_call)
+
+    async def list_user_course(self, ac_token):
+        user = await self.user_service.get_user(ac_token)
+        courses = await MongoUtils.find_ordered_async(self.mongo[self.courses], 'uuid', user.courses,
+                                                      COURSE_LIST_PROJECTION)
+        return CourseList.course_list(courses)
+
+    async def list_roll_call(self, class_id: int, ac_token: str):
+        roll_calls = await self.mongo[self.roll_call].find({'classId': class_id},
+                                                           {'_id': 0, 'uuid': 0, '__expireAt': 0}).to_list(None)
+        if roll_calls:
+            user = await self.user_service.get_user(ac_token)
+            checked = {item['rollCallId'] for item in
+                       await self.mongo[self.checkin_user].find({'userId': user.id, 'classId': class_id},
+                                                                {'_id': 0, 'rollCallId': 1}).to_list(None)}
+            for item in roll_calls:
+                item['isCheckin'] = item['id'] in checked
+        return RollCallList.roll_call_list(roll_calls)
+
+    async def add_course(self, ac_token, course: Class):
+        user = await self.user_service.get_user(ac_token)
+        if user.accountType != 2:
+            return JSONResponse(status_code=403, content={'message': 'Not Permission'})
+        data = self.new_course(course, await self.id_allocator.next_id(self.courses), user)
+        try:
+            await self.mongo[self.courses].insert_one(data)
+            await MongoUtils.push_unique_async(self.mongo[self.user], {'id': user.id}, 'courses', data['uuid'])
+            await self.user_service.invalidate_user(user.uuid)
+            return ClassInfo.course_info(data)
+        except errors.DuplicateKeyError:
+            return JSONResponse(status_code=400, content={'message': 'Course đã tồn tại'})
+
+    async def add_roll_call(self, class_id: int, roll_call: RollCall, ac_token: str):
+        course = await self.get_course(class_id)
+        user = await self.user_service.get_user(ac_token)
+        if course.lecturerId != user.id:
+            return JSONResponse(status_code=403, content={'message': 'Not Permission'})
+        data = self.new_roll_call(roll_call, await self.id_allocator.next_id(self.roll_call), course)
+        await self.mongo[self.roll_call].insert_one(data)
+        await self.state.publish_async(data)
+        return RollCallInfo.roll_call_info(data)
+
+    @cache_put(**COURSE_CACHE)
+    async def update_course(self, class_id: int, update_course: UpdateClass, ac_token):
+        course = await self.get_course(class_id)
+        user = await self.user_service.get_user(ac_token)
+        if user.id != course.lecturerId:
+            return JSONResponse(status_code=403, content={'message': 'Not Permission'})
+        course = await self.mongo[self.courses].find_one_and_update({'id': class_id},
+                                                                    {'$set': self.course_update(update_course)},
+                                                                    return_document=ReturnDocument.AFTER)
+        return ClassInfo.course_info(course)
+
+    async def update_roll_call(self, class_id: int, roll_call_id: int, update_roll_call: UpdateRollCall,
+                               ac_token: str):
+        course = await self.get_course(class_id)
+        user = await self.user_service.get_user(ac_token)
+        await self.get_roll_call(class_id, roll_call_id)
+        if user.id != course.lecturerId:
+            return JSONResponse(status_code=403, content={'message': 'Not Permission'})
+        response = await self.mongo[self.roll_call].find_one_and_update({'id': roll_call_id},
+                                                                        {'$set': dict(update_roll_call)}, {'_id': 0},
+                                                                        return_document=ReturnDocument.AFTER)
+        checked = [item['userId'] for item in
+                   await self.mongo[self.checkin_user].find({'rollCallId': roll_call_id}, {'_id': 0, 'userId': 1})
+                   .to_list(None)]
+        await self.state.publish_async(response, checked)
+        await self.stream.publish_roll_call_async(response)
+        return RollCallInfo.roll_call_info(response)
+
+    @cache_evict(tags=['course:{class_id}'])
+    async def delete_course(self, class_id: int, ac_token):
+        course = await self.get_course(class_id)
+        user = await self.user_service.get_user(ac_token)
+        if user.id != course.lecturerId:
+            return JSONResponse(status_code=403, content={'message': 'Not Permission'})
+        await self.mongo[self.courses].delete_one({'id': class_id})
+        await self.mongo[self.notification].delete_many({'classId': class_id})
+        roll_call_ids = [roll_call['id'] for roll_call in
+                         await self.mongo[self.roll_call].find({'classId': class_id}, {'_id': 0, 'id': 1})
+                         .to_list(None)]
+        await self.mongo[self.roll_call].delete_many({'classId': class_id})
+        await self.mongo[self.checkin_user].delete_many({'classId': class_id})
+        await self.state.drop_async(roll_call_ids)
+
+    async def checkin(self, class_id: int, roll_call_id: int, checkin: Checkin, ac_token: str):
+        course = await self.get_course(class_id)
+        user = await self.user_service.get_user(ac_token)
+        live = await self._live_roll_call(class_id, roll_call_id, user.id)
+        if live is None:
+            roll_call = await self.get_roll_call(class_id, roll_call_id)
+            checked = (await self.check_checkin(class_id, roll_call_id, ac_token))['check']
+        else:
+            roll_call, checked = live
+        error = self.checkin_error(course, user, roll_call, checked, checkin)
+        if error is not None:
+            return error
+        checkin_user = self.checkin_doc(course, user, roll_call)
+        if live is not None and await self.state.mark_async(roll_call.id, roll_call.expireAt, user.id) is False:
+            return JSONResponse(status_code=400, content={'message': 'Bạn đã điểm danh rồi'})
+        try:
+            inserted = await self.ingestor.ingest(checkin_user)
+        except Exception:
+            if live is not None:
+                await self.state.unmark_async(roll_call.id, user.id)
+            return self.checkin_failed()
+        if inserted:
+            await self.stream.publish_async(checkin_user)
+        return self.checkin_accepted()
+
+    async def bulk_checkin(self, class_id: int, roll_call_id: int, bulk: BulkCheckin, ac_token: str):
+        error = self.bulk_error(bulk)
+        if error is not None:
+            return error
+        course = await self.get_course(class_id)
+        error = self.submitter_error(course, await self.user_service.get_user(ac_token))
+        if error is not None:
+            return error
+        roll_call = await self.get_roll_call(class_id, roll_call_id)
+        error = self.bulk_expired(roll_call)
+        if error is not None:
+            return error
+        user_ids = list({item.userId for item in bulk.checkins})
+        users = await self.mongo[self.user].find({'id': {'$in': user_ids}}, BULK_USER_PROJECTION).to_list(None)
+        checked = {item['userId'] for item in
+                   await self.mongo[self.checkin_user].find({'rollCallId': roll_call.id, 'userId': {'$in': user_ids}},
+                                                            {'_id': 0, 'userId': 1}).to_list(None)}
+        statuses, docs = self.validate_bulk(course, roll_call, bulk, users, checked)
+        futures = self.ingestor.submit_many([doc for _, doc in docs])
+        done = set()
+        if futures:
+            # Left running when the timeout expires, the ingestor still resolves them
+            done, _ = await asyncio.wait(futures, timeout=self.ingestor.ack_timeout)
+        results = [(future.exception() or future.result()) if future in done else asyncio.TimeoutError()
+                   for future in futures]
+        inserted = self.bulk_inserted(statuses, docs, results)
+        await self.state.mark_many_async(roll_call.id, roll_call.expireAt, [doc['userId'] for doc in inserted])
+        for doc in inserted:
+            await self.stream.publish_async(doc)
+        return summary(bulk.checkins, statuses)
+
+    async def check_checkin(self, class_id: int, roll_call_id: int, ac_token: str):
+        course = await self.get_course(class_id)
+        user = await self.user_service.get_user(ac_token)
+        live = await self._live_roll_call(class_id, roll_call_id, user.id)
+        if live is not None:
+            return {'check': live[1]}
+        roll_call = await self.get_roll_call(class_id, roll_call_id)
+        query = dict(userId=user.id,
+                     classId=course.id,
+                     rollCallId=roll_call.id)
+        return {'check': await self.mongo[self.checkin_user].find_one(query, {'_id': 1}) is not None}
+
+    async def list_checkin(self, class_id: int, roll_call_id: int):
+        course = await self.get_course(class_id)
+        roll_call = await self.get_roll_call(class_id, roll_call_id)
+        query = dict(classId=course.id,
+                     rollCallId=roll_call.id)
+        members = await self.mongo[self.checkin_user].find(query, {'_id': 0, 'name': 1, 'checkAt': 1}).to_list(None)
+        return self.checkin_list(members, roll_call)
+
+    async def stream_checkin(self, class_id: int, roll_call_id: int, request: Request, ac_token: str):
+        course = await self.get_course(class_id)
+        user = await self.user_service.get_user(ac_token)
+        if user.id != course.lecturerId:
+            return JSONResponse(status_code=403, content={'message': 'Not Permission'})
+        roll_call = await self.get_roll_call(class_id, roll_call_id)
+        return self.stream.response(roll_call.id, roll_call.expireAt,
+                                    lambda: self._checkin_snapshot(class_id, roll_call_id), request)
+
+    async def _checkin_snapshot(self, class_id: int, roll_call_id: int):
+        roll_call = await self.get_roll_call(class_id, roll_call_id)
+        members = await self.mongo[self.checkin_user].find(dict(classId=class_id, rollCallId=roll_call_id),
+                                                           {'_id': 0, 'userId': 1, 'name': 1, 'checkAt': 1}) \
+            .to_list(None)
+        return self.checkin_snapshot(members, roll_call)
+
+    async def add_notification(self, class_id: int, request: Notification, ac_token: str):
+        user_info = await self.user_service.get_user(ac_token)
+        await self.get_course(class_id)
+        if user_info.accountType != 2:
+            return JSONResponse(status_code=403, content={'message': 'Not Permission'})
+        notification = self.new_notification(request, await self.id_allocator.next_id(self.notification), class_id)
+        try:
+            await self.mongo[self.notification].insert_one(notification)
+        except errors.DuplicateKeyError:
+            pass
+        return NotificationInfo.notification(notification)
+
+    async def list_notification(self, class_id: int, ac_token: str):
+        user_info = await self.user_service.get_user(ac_token)
+        error = self.member_error(await self.get_course(class_id), user_info)
+        if error is not None:
+            return error
+        notifications = await self.mongo[self.notification].find({'classId': class_id}, {'_id': 0, 'body': 0}) \
+            .to_list(None)
+        return NotificationList.list_notification(self.mark_seen(notifications, user_info))
+
+    async def get_notification(self, notification_id: int, ac_token: str):
+        user_info = await self.user_service.get_user(ac_token)
+        notification_info = await self.mongo[self.notification].find_one({'id': notification_id}, {'_id': 0})
+        if notification_info is None:
+            raise NotFoundException(404, 'Notification Not Found')
+        error = self.member_error(await self.get_course(notification_info['classId']), user_info)
+        if error is not None:
+            return error
+        if self.unseen(notification_info, user_info):
+            seen = await MongoUtils.push_unique_async(self.mongo[self.notification], {'id': notification_id},
+                                                      'listSeen', dict(userId=user_info.id, name=user_info.name),
+                                                      key='userId', counter='totalSeen', projection={'_id': 0})
+            notification_info = seen or notification_info
+        return NotificationInfo.notification(notification_info)
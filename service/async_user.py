@@ -0,0 +1,262 @@
+from dataclasses import replace
+from injector import singleton, inject
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import errors
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from starlette.config import Config
+from starlette.responses import JSONResponse
+from response.user import InfoUser
+from request.user import User, UserUpdate, UserLogin, UserForget, UserJoin, SendMessage
+from datetime import datetime
+from common.cache import CacheInterceptor
+from common.context import request_scoped
+from common.exception import NotFoundException
+from common.id_allocator import AsyncIdAllocator
+from common.metrics import timed_methods
+from common.tiered_cache import InvalidationBus
+from common.utils import MongoUtils
+from service.token_refresher import TokenRefresher
+from service.user import BaseUserService
+
+
+# Motor implementation of UserService, selected with ASYNC_BACKEND
+@inject
+@singleton
+@timed_methods
+class AsyncUserService(BaseUserService):
+
+    def __init__(self, mongo: AsyncIOMotorDatabase, config: Config, redis: Redis, async_redis: AsyncRedis,
+                 bus: InvalidationBus, token_refresher: TokenRefresher, id_allocator: AsyncIdAllocator,
+                 cache: CacheInterceptor) -> None:
+        super().__init__(config, redis, async_redis, bus, token_refresher, id_allocator, cache)
+        self.mongo: AsyncIOMotorDatabase = mongo
+
+    async def invalidate_token(self, ac_token: str):
+        await self.token_cache.ainvalidate(keys=[ac_token])
+
+    async def invalidate_user(self, user_uuid: str):
+        await self.token_cache.ainvalidate(tags=[self.user_tag(user_uuid)])
+
+    async def get_token(self, ac_token):
+        token = await self.mongo[self.token].find_one({'key': ac_token}, {'_id': 0})
+        if token is None:
+            return None
+        if self.check_day(token['__expiredAt'], datetime.now()):
+            token['__expiredAt'] = self.token_refresher.touch(ac_token)
+        return token
+
+    async def check_ac_token(self, ac_token):
+        token = await self.get_token(ac_token)
+        if token is None:
+            return None
+        return token['userUuid']
+
+    async def check_rf_token(self, rf_token):
+        user = await self.mongo[self.rf_token].find_one({'key': rf_token}, {'_id': 0})
+        if user is None:
+            return None
+        return user['userUuid']
+
+    async def get_ac_token(self, user_name, password):
+        user = await self.mongo[self.user].find_one({'userName': user_name, 'password': password}, {'_id': 0})
+        if user is None:
+            return False
+        token = await self.mongo[self.token].find_one({'userUuid': user['uuid']}, {'_id': 0})
+        if token is None:
+            return dict(userUuid=user['uuid'], key=None)
+        return dict(userUuid=user['uuid'], key=token['key'])
+
+    @request_scoped
+    async def get_user(self, ac_token):
+        if ac_token is None:
+            raise NotFoundException(404, "Token not found")
+        user = self.cached_user(await self.token_cache.aget(ac_token))
+        if user is not None:
+            return user
+        fill = await self.token_cache.abegin_fill()
+        token = await self.get_token(ac_token)
+        if token is None:
+            await self.invalidate_token(ac_token)
+            raise NotFoundException(404, "User not found")
+        user = await self.mongo[self.user].find_one({'uuid': token['userUuid']}, {'_id': 0})
+        user = InfoUser.info_user(user)
+        await self.token_cache.aset(ac_token, (user, token['__expiredAt']), fill,
+                                    tags=[self.user_tag(user.uuid)])
+        return replace(user, courses=list(user.courses))
+
+    async def update_user(self, ac_token, user: UserUpdate):
+        if ac_token is None:
+            return JSONResponse(status_code=400, content={'message': 'token is missed'})
+        user_uuid = await self.check_ac_token(ac_token)
+        if user_uuid is None:
+            return JSONResponse(status_code=401, content={'message': 'Invalid Token'})
+        error = self.missing_field(dict(user))
+        if error is not None:
+            return error
+        await self.mongo[self.user].update_one({'uuid': user_uuid}, {'$set': self.user_update(user)})
+        await self.invalidate_user(user_uuid)
+        return JSONResponse(status_code=400, content={'message': 'Cập nhật thành công'})
+
+    async def user_login(self, user_login: UserLogin):
+        data = await self.get_ac_token(user_login.userName, self.digest(user_login.password))
+        if not data:
+            return JSONResponse(status_code=401, content={'message': 'Sai tên đăng nhập hoặc mật khẩu'})
+        if data['key'] is not None:
+            return self.login_response(data['key'])
+        token = self.new_token(data['userUuid'])
+        await self.mongo[self.token].insert_one(token)
+        return self.login_response(token['key'])
+
+    async def add_user(self, user: User):
+        error = self.missing_field(dict(user))
+        if error is not None:
+            return error
+        try:
+            await self.mongo[self.user].insert_one(self.new_user(user, await self.id_allocator.next_id(self.user)))
+            return JSONResponse(status_code=200, content={'message': 'Đăng ký thành công'})
+        except errors.DuplicateKeyError:
+            return JSONResponse(status_code=400, content={'message': 'Tài khoản đã tồn tại'})
+
+    async def user_logout(self, ac_token):
+        if ac_token is None:
+            return JSONResponse(status_code=400, content={'message': 'token is missed'})
+        token = await self.check_ac_token(ac_token)
+        if token is None:
+            return JSONResponse(status_code=401, content={'message': 'Invalid Token'})
+        await self.mongo[self.token].delete_one({'key': ac_token})
+        await self.invalidate_token(ac_token)
+        return JSONResponse(status_code=200, content={'message': 'Đã log out'})
+
+    async def refresh_user(self, rf_token):
+        if rf_token is None:
+            return JSONResponse(status_code=400, content={'message': 'token is missed'})
+        user_uuid = await self.check_rf_token(rf_token)
+        if user_uuid is None:
+            return JSONResponse(status_code=400)
+        await self.mongo[self.rf_token].delete_many({'key': rf_token})
+        await self.mongo[self.token].delete_many({'userUuid': user_uuid})
+        await self.invalidate_user(user_uuid)
+        return JSONResponse(status_code=200, content={'message': 'Đã đăng xuất khỏi tất các thiết bị'})
+
+    async def user_forget(self, user_forget: UserForget):
+        error = self.missing_field(dict(user_forget))
+        if error is not None:
+            return error
+        user = await self.mongo[self.user].find_one({'userName': user_forget.userName}, {'_id': 0})
+        if user is None:
+            return JSONResponse(status_code=404, content={'message': 'Not Found User'})
+        error = self.recovery_error(user, user_forget)
+        if error is not None:
+            return error
+        await self.mongo[self.user].update_one({'id': user['id']},
+                                               {'$set': {'password': self.digest(user_forget.newPassword)}})
+        await self.mongo[self.rf_token].delete_many({'userUuid': user['uuid']})
+        await self.mongo[self.token].delete_many({'userUuid': user['uuid']})
+        await self.invalidate_user(user['uuid'])
+        return JSONResponse(status_code=200, content={'message': 'Cập nhật thành công !'})
+
+    async def checkin_key(self, ac_token: str):
+        error = self.signing_error()
+        if error is not None:
+            return error
+        return self.signing_key(await self.get_user(ac_token))
+
+    async def user_join_class(self, data: UserJoin, ac_token: str):
+        user = await self.get_user(ac_token)
+        course = await self.mongo[self.courses].find_one(self.join_query(data), {'_id': 0, 'id': 1, 'uuid': 1})
+        if course is None:
+            return JSONResponse(status_code=422, content={'message': "Sai Key hoặc mã lớp"})
+        if course['uuid'] in user.courses:
+            return JSONResponse(status_code=422, content={'message': "Đã tham gia"})
+
+        joined = await MongoUtils.push_unique_async(self.mongo[self.user], {'id': user.id}, 'courses', course['uuid'])
+        await self.invalidate_user(user.uuid)
+        if joined is None:
+            return JSONResponse(status_code=422, content={'message': "Đã tham gia"})
+
+        await MongoUtils.push_unique_async(self.mongo[self.courses], {'id': course['id']}, 'members',
+                                           dict(id=user.id, name=user.name), key='id', counter='quantity')
+        await self.cache.evict_async(keys=['course:' + str(course['id'])])
+
+        return JSONResponse(status_code=200, content={'message': 'Thành công'})
+
+    async def send_message(self, data: SendMessage, ac_token: str, limit: int = 50):
+        user_info = await self.get_user(ac_token)
+        if data.userNameReceive is None and data.userUuidReceive is None:
+            return JSONResponse(status_code=400,
+                                content={'message': 'Just userNameReceive or userUuidReceive need field'})
+        receiver = await self.mongo[self.user].find_one(self.receiver_query(data), {'_id': 0})
+        if receiver is None:
+            raise NotFoundException(404, 'Không tìm thấy người nhận')
+        conversation = await self.mongo[self.conversation].find_one(
+            self.conversation_query(user_info.uuid, receiver['uuid']), {'_id': 0})
+        if conversation is None:
+            conversation = self.new_conversation(await self.id_allocator.next_id(self.conversation), user_info,
+                                                 receiver)
+            await self.mongo[self.conversation].insert_one(conversation)
+        message = self.new_message(conversation['id'], user_info, receiver, data.content)
+        await self.mongo[self.message].insert_one(message)
+        result = await self.mongo[self.conversation].update_one(self.newer_message_query(conversation['id'], message),
+                                                                self.conversation_update(message))
+        if result.matched_count == 0:
+            # A newer message is already the last one, only count this one
+            await self.mongo[self.conversation].update_one({'id': conversation['id']}, self.message_count_update())
+
+        await self.mongo[self.message].find_one_and_update(self.unseen_query(conversation['id'], user_info.uuid),
+                                                           {'$set': {'isSeen': True}})
+        return (await self.message_page(conversation['id'], limit=limit))['messages']
+
+    async def message_page(self, conversation_id: int, before: str = None, after: str = None, limit: int = 50):
+        query, sort = self.page_query(conversation_id, before, after)
+        messages = await self.mongo[self.message].find(query, {'senderUuid': 1, 'content': 1, 'sendAt': 1}) \
+            .sort(sort).limit(limit).to_list(None)
+        return self.page_response(messages, sort, limit, after)
+
+    async def backfill_last_message(self, con: dict):
+        messages = await self.mongo[self.message].find({'conversationId': con['id']}) \
+            .sort([('sendAt', -1), ('_id', -1)]).limit(1).to_list(1)
+        if not messages:
+            return None
+        last_message = self.last_message(messages[0])
+        await self.mongo[self.conversation].update_one({'id': con['id'], 'lastMessage': {'$exists': False}},
+                                                       {'$set': {'lastMessage': last_message}})
+        return last_message
+
+    async def list_conversation(self, ac_token, offset: int = 0, limit: int = 50):
+        user_info = await self.get_user(ac_token)
+        conversations = await self.mongo[self.conversation].find(self.inbox_query(user_info.uuid), {'_id': 0}) \
+            .sort('lastActive', -1).skip(offset).limit(limit).to_list(None)
+        response = dict(total=0,
+                        conversations=list())
+        for con in conversations:
+            last_message = con.get('lastMessage') or await self.backfill_last_message(con)
+            if last_message is None:
+                continue
+            response['conversations'].append(self.conversation_item(user_info.uuid, con, last_message))
+        # Every conversation of the inbox, the page only holds up to limit of them
+        response['total'] = await self.mongo[self.conversation].count_documents(
+            self.inbox_query(user_info.uuid))
+        return response
+
+    async def get_conversation_info(self, conversation_id: int, ac_token, before: str = None, after: str = None,
+                                    limit: int = 50):
+        conversation = await self.mongo[self.conversation].find_one({'id': conversation_id}, {'_id': 0})
+        if conversation is None:
+            raise NotFoundException(404, 'Conversation Not Found')
+
+        user_info = await self.get_user(ac_token)
+        error = self.access_error(conversation, user_info)
+        if error is not None:
+            return error
+
+        await self.mongo[self.message].find_one_and_update(self.unseen_query(conversation_id, user_info.uuid),
+                                                           {'$set': {'isSeen': True}})
+        await self.mongo[self.conversation].update_one({'id': conversation_id,
+                                                        'lastMessage.senderUuid': {'$ne': user_info.uuid}},
+                                                       {'$set': {'lastMessage.isSeen': True}})
+        try:
+            page = await self.message_page(conversation_id, before, after, limit)
+        except ValueError as ex:
+            return JSONResponse(status_code=400, content={'message': str(ex)})
+        return self.conversation_page(user_info, page)
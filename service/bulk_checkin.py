@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Set, Tuple
+
+import pytz
+
+from common.geofence import geofence
+from common.signature import checkin_message, derive_key, verify
+from request.course import SignedCheckin
+from response.course import ClassInfo, RollCallInfo
+
+ACCEPTED = 'accepted'
+
+
+def validate_checkins(course: ClassInfo, roll_call: RollCallInfo, radius: int, checkins: List[SignedCheckin],
+                      users: Dict[int, dict], checked: Set[int], secret: str, now: float,
+                      clock_skew: int) -> Tuple[List[str], List[Tuple[int, dict]]]:
+    """Validate offline checkins against one roll call.
+
+    ``users`` are the students of the batch by id and ``checked`` the ids already checked in. Returns the status
+    of every checkin and the ``checkin_user`` documents of the accepted ones with their index in ``checkins``.
+    """
+    statuses = [ACCEPTED] * len(checkins)
+    seen = set(checked)
+    candidates = []
+    for index, item in enumerate(checkins):
+        user = users.get(item.userId)
+        message = checkin_message(roll_call.id, item.userId, item.mac, item.lat, item.long, item.checkAt)
+        if user is None or not verify(derive_key(secret, user['uuid']), message, item.signature):
+            statuses[index] = 'invalid_signature'
+        elif course.uuid not in user.get('courses', []):
+            statuses[index] = 'not_member'
+        elif item.userId in seen:
+            statuses[index] = 'duplicate'
+        elif item.checkAt < roll_call.startAt:
+            statuses[index] = 'not_started'
+        elif item.checkAt > roll_call.expireAt or item.checkAt > now + clock_skew:
+            statuses[index] = 'expired'
+        elif item.mac != roll_call.mac:
+            statuses[index] = 'mac'
+        else:
+            seen.add(item.userId)
+            candidates.append(index)
+
+    fence = geofence(roll_call.location['lat'], roll_call.location['long'], roll_call.radius or radius)
+    inside = fence.contains_many([checkins[index].lat for index in candidates],
+                                 [checkins[index].long for index in candidates])
+    expire_at = datetime.fromtimestamp(course.expireAt, tz=pytz.timezone("Asia/Ho_Chi_Minh")) + timedelta(30)
+    docs = []
+    for index, located in zip(candidates, inside):
+        if not located:
+            statuses[index] = 'location'
+            continue
+        item = checkins[index]
+        docs.append((index, dict(name=users[item.userId]['name'],
+                                 userId=item.userId,
+                                 classId=course.id,
+                                 rollCallId=roll_call.id,
+                                 checkAt=item.checkAt,
+                                 __expireAt=expire_at)))
+    return statuses, docs
+
+
+def summary(checkins: List[SignedCheckin], statuses: List[str]) -> dict:
+    accepted = sum(1 for status in statuses if status == ACCEPTED)
+    return dict(accepted=accepted,
+                rejected=len(statuses) - accepted,
+                results=[dict(userId=item.userId, status=status) for item, status in zip(checkins, statuses)])
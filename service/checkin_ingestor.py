@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+
+from injector import singleton, inject
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+from starlette.config import Config
+
+from common.lifecycle import on_shutdown
+
+LOGGER = logging.getLogger(__name__)
+
+# Duplicate key, the student is already checked in
+__DUPLICATE_KEY__ = 11000
+
+
+class BaseCheckinIngestor:
+    """Group commit of ``checkin_user`` documents.
+
+    Checkins are queued and written with one unordered ``insert_many`` plus one ``$inc`` of
+    ``count`` per roll call, every ``CHECKIN_BATCH_INTERVAL`` seconds or ``CHECKIN_BATCH_SIZE``
+    checkins. Callers are answered once their batch is written: ``True`` when the checkin was
+    inserted, ``False`` when the student was already checked in.
+    """
+
+    def __init__(self, config: Config) -> None:
+        super().__init__()
+        self.roll_call = config('COL_ROLL_CALL', cast=str, default='roll_call')
+        self.checkin_user = config('CHECKIN_USER', cast=str, default='checkin_user')
+        self.interval = config('CHECKIN_BATCH_INTERVAL', cast=float, default=0.005)
+        self.batch_size = config('CHECKIN_BATCH_SIZE', cast=int, default=200)
+        self.ack_timeout = config('CHECKIN_ACK_TIMEOUT', cast=float, default=10.0)
+        self._metrics = dict(flushes=0, inserted=0, duplicates=0, failures=0, lastFlushSize=0, maxFlushSize=0)
+
+    @staticmethod
+    def _results(docs: List[dict], error: Optional[BulkWriteError]) -> List[Tuple[bool, Optional[Exception]]]:
+        results = [(True, None)] * len(docs)
+        if error is not None:
+            for write_error in error.details.get('writeErrors', []):
+                if write_error['code'] == __DUPLICATE_KEY__:
+                    results[write_error['index']] = (False, None)
+                else:
+                    results[write_error['index']] = (False, OperationFailure(write_error.get('errmsg'),
+                                                                             write_error['code']))
+        return results
+
+    def _increments(self, docs: List[dict], results: List[Tuple[bool, Optional[Exception]]]) -> List[UpdateOne]:
+        counts = Counter(doc['rollCallId'] for doc, (inserted, _) in zip(docs, results) if inserted)
+        return [UpdateOne({'id': roll_call_id}, {'$inc': {'count': count}}) for roll_call_id, count in counts.items()]
+
+    def _record(self, results: List[Tuple[bool, Optional[Exception]]], started: float):
+        inserted = sum(1 for ok, _ in results if ok)
+        failed = sum(1 for _, error in results if error is not None)
+        self._metrics['flushes'] += 1
+        self._metrics['inserted'] += inserted
+        self._metrics['duplicates'] += len(results) - inserted - failed
+        self._metrics['failures'] += failed
+        self._metrics['lastFlushSize'] = len(results)
+        self._metrics['maxFlushSize'] = max(self._metrics['maxFlushSize'], len(results))
+        LOGGER.debug('Ingested %d checkins in %.3fs', len(results), time.monotonic() - started)
+
+    def metrics(self) -> dict:
+        return dict(self._metrics)
+
+
+@inject
+@singleton
+class CheckinIngestor(BaseCheckinIngestor):
+
+    def __init__(self, mongo: MongoClient, config: Config) -> None:
+        super().__init__(config)
+        self.mongo: MongoClient = mongo
+        self._pending: List[Tuple[dict, Future]] = list()
+        self._lock = threading.Lock()
+        self._arrived = threading.Event()
+        self._full = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='checkin-ingestor', daemon=True)
+        self._thread.start()
+        on_shutdown(self.close)
+        LOGGER.debug('CheckinIngestor Initialized')
+
+    def submit(self, doc: dict) -> Future:
+        """Queue ``doc``, the future resolves once its batch is written."""
+        future = Future()
+        with self._lock:
+            self._pending.append((doc, future))
+            self._arrived.set()
+            if len(self._pending) >= self.batch_size:
+                self._full.set()
+        return future
+
+    def submit_many(self, docs: List[dict]) -> List[Future]:
+        """Queue ``docs`` in the same batch and flush it right away."""
+        futures = [Future() for _ in docs]
+        with self._lock:
+            self._pending.extend(zip(docs, futures))
+            self._arrived.set()
+            self._full.set()
+        return futures
+
+    def ingest(self, doc: dict) -> bool:
+        """Queue ``doc`` and wait until its batch is written."""
+        return self.submit(doc).result(self.ack_timeout)
+
+    def flush(self) -> int:
+        with self._lock:
+            batch, self._pending = self._pending, list()
+            self._arrived.clear()
+            self._full.clear()
+        if not batch:
+            return 0
+        started = time.monotonic()
+        docs = [doc for doc, _ in batch]
+        try:
+            self.mongo[self.checkin_user].insert_many(docs, ordered=False)
+            results = self._results(docs, None)
+        except BulkWriteError as ex:
+            results = self._results(docs, ex)
+        except Exception as ex:
+            LOGGER.exception('Can\'t ingest %d checkins', len(batch))
+            for _, future in batch:
+                future.set_exception(ex)
+            with self._lock:
+                self._metrics['failures'] += len(batch)
+            return 0
+        increments = self._increments(docs, results)
+        if increments:
+            try:
+                self.mongo[self.roll_call].bulk_write(increments, ordered=False)
+            except Exception:
+                LOGGER.exception('Can\'t count checkins of %d roll calls', len(increments))
+        for (_, future), (inserted, error) in zip(batch, results):
+            if error is None:
+                future.set_result(inserted)
+            else:
+                future.set_exception(error)
+        with self._lock:
+            self._record(results, started)
+        return len(batch)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return dict(self._metrics, pending=len(self._pending))
+
+    def _run(self):
+        while not self._closed.is_set():
+            self._arrived.wait()
+            # Give the burst a few milliseconds to fill the batch
+            self._full.wait(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                # Checkins of the batch time out on their callers, the thread keeps serving the next ones
+                LOGGER.exception('Checkin ingestor flush failed')
+
+    def close(self):
+        self._closed.set()
+        self._arrived.set()
+        self._full.set()
+        self._thread.join(self.ack_timeout)
+        self.flush()
+
+
+@inject
+@singleton
+class AsyncCheckinIngestor(BaseCheckinIngestor):
+    """Motor implementation of :class:`CheckinIngestor`, batches are written by a task of the event loop."""
+
+    def __init__(self, mongo: AsyncIOMotorDatabase, config: Config) -> None:
+        super().__init__(config)
+        self.mongo: AsyncIOMotorDatabase = mongo
+        self._pending: List[Tuple[dict, asyncio.Future]] = list()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        on_shutdown(self.close)
+
+    def submit(self, doc: dict) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((doc, future))
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        return future
+
+    def submit_many(self, docs: List[dict]) -> List[asyncio.Future]:
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in docs]
+        self._pending.extend(zip(docs, futures))
+        self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        return futures
+
+    async def ingest(self, doc: dict) -> bool:
+        return await asyncio.wait_for(asyncio.shield(self.submit(doc)), self.ack_timeout)
+
+    async def flush(self) -> int:
+        batch, self._pending = self._pending, list()
+        self._full.clear()
+        if not batch:
+            return 0
+        started = time.monotonic()
+        docs = [doc for doc, _ in batch]
+        try:
+            await self.mongo[self.checkin_user].insert_many(docs, ordered=False)
+            results = self._results(docs, None)
+        except BulkWriteError as ex:
+            results = self._results(docs, ex)
+        except Exception as ex:
+            LOGGER.exception('Can\'t ingest %d checkins', len(batch))
+            for _, future in batch:
+                future.set_exception(ex)
+            self._metrics['failures'] += len(batch)
+            return 0
+        increments = self._increments(docs, results)
+        if increments:
+            try:
+                await self.mongo[self.roll_call].bulk_write(increments, ordered=False)
+            except Exception:
+                LOGGER.exception('Can\'t count checkins of %d roll calls', len(increments))
+        for (_, future), (inserted, error) in zip(batch, results):
+            if error is None:
+                future.set_result(inserted)
+            else:
+                future.set_exception(error)
+        self._record(results, started)
+        return len(batch)
+
+    def metrics(self) -> dict:
+        return dict(self._metrics, pending=len(self._pending))
+
+    async def _run(self):
+        # Runs while checkins keep arriving, the next ingest starts a new task
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                LOGGER.exception('Checkin ingestor flush failed')
+
+    async def close(self):
+        """Write the checkins still queued, run on shutdown."""
+        if self._task is not None and not self._task.done():
+            await self._task
+        await self.flush()
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import AsyncIterator, Awaitable, Callable, Dict, Set, Tuple
+
+from injector import singleton, inject
+from starlette.config import Config
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+from common.tiered_cache import InvalidationBus
+
+LOGGER = logging.getLogger(__name__)
+
+__CHANNEL__ = 'checkin:events'
+
+
+def sse(event: str, data: dict) -> str:
+    return 'event: ' + event + '\ndata: ' + json.dumps(data, ensure_ascii=False) + '\n\n'
+
+
+class _Slot:
+    """A stream counted against ``CHECKIN_STREAM_MAX``, released once however the stream ends."""
+
+    def __init__(self, stream: 'CheckinStream') -> None:
+        super().__init__()
+        self.stream = stream
+        self.released = False
+
+    def release(self):
+        with self.stream._lock:
+            if not self.released:
+                self.released = True
+                self.stream._open -= 1
+
+
+class _EventStreamResponse(StreamingResponse):
+    def __init__(self, content: AsyncIterator[str], slot: _Slot, **kwargs) -> None:
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # The client may be gone before the first event or in the middle of the stream: the events
+            # are closed right away rather than when collected, and a stream never started frees its slot
+            await self.body_iterator.aclose()
+            self.slot.release()
+
+
+@inject
+@singleton
+class CheckinStream:
+    """Server-Sent Events of the checkins of a roll call.
+
+    Checkins are broadcast to every worker over the :class:`InvalidationBus` and handed to the
+    streams of the roll call open in this worker. A stream sends a ``snapshot`` of the members first,
+    then one ``checkin`` per new member until the roll call ends, following updates of its ``expireAt``.
+    When the bus had to reconnect a new ``snapshot`` is sent, since checkins may have been missed.
+    A worker serves at most ``CHECKIN_STREAM_MAX`` streams, the next ones get a 503.
+    """
+
+    def __init__(self, bus: InvalidationBus, config: Config) -> None:
+        super().__init__()
+        self.bus = bus
+        self.heartbeat = config('CHECKIN_STREAM_HEARTBEAT', cast=float, default=15.0)
+        self.queue_size = config('CHECKIN_STREAM_QUEUE_SIZE', cast=int, default=1000)
+        self.max_streams = config('CHECKIN_STREAM_MAX', cast=int, default=200)
+        # roll call id -> (loop, queue) of the open streams
+        self._listeners: Dict[int, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = defaultdict(set)
+        self._open = 0
+        self._lock = threading.Lock()
+        bus.subscribe(__CHANNEL__, self.on_message)
+
+    def publish(self, checkin_user: dict):
+        self.bus.publish(__CHANNEL__, self.event(checkin_user))
+
+    async def publish_async(self, checkin_user: dict):
+        await self.bus.apublish(__CHANNEL__, self.event(checkin_user))
+
+    def publish_roll_call(self, roll_call: dict):
+        """Move the end of the open streams of an updated roll call."""
+        self.bus.publish(__CHANNEL__, dict(rollCallId=roll_call['id'], expireAt=roll_call['expireAt']))
+
+    async def publish_roll_call_async(self, roll_call: dict):
+        await self.bus.apublish(__CHANNEL__, dict(rollCallId=roll_call['id'], expireAt=roll_call['expireAt']))
+
+    @staticmethod
+    def event(checkin_user: dict) -> dict:
+        return dict(rollCallId=checkin_user['rollCallId'], userId=checkin_user['userId'],
+                    name=checkin_user['name'], checkAt=checkin_user['checkAt'])
+
+    def on_message(self, message: dict):
+        with self._lock:
+            if message.get('all'):
+                listeners = [listener for streams in self._listeners.values() for listener in streams]
+            else:
+                listeners = list(self._listeners.get(message.get('rollCallId'), ()))
+        for loop, queue in listeners:
+            loop.call_soon_threadsafe(self._offer, queue, message)
+
+    @staticmethod
+    def _offer(queue: asyncio.Queue, message: dict):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # The client is too slow, it gets a fresh snapshot instead
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({'all': True})
+
+    async def events(self, roll_call_id: int, ends_at: float,
+                     snapshot: Callable[[], Awaitable[dict]], request: Request,
+                     slot: _Slot = None) -> AsyncIterator[str]:
+        listener = (asyncio.get_running_loop(), asyncio.Queue(self.queue_size))
+        with self._lock:
+            self._listeners[roll_call_id].add(listener)
+        try:
+            # Subscribed before the snapshot is read, checkins in between are skipped as already seen.
+            # Sent even when the roll call already ended, the stream then only holds the final list.
+            members = await snapshot()
+            seen = {member['userId'] for member in members['members']}
+            yield sse('snapshot', members)
+            while time.time() < ends_at and not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(listener[1].get(),
+                                                     max(0.0, min(self.heartbeat, ends_at - time.time())))
+                except asyncio.TimeoutError:
+                    if time.time() < ends_at:
+                        yield ': ping\n\n'
+                    continue
+                if message.get('all'):
+                    members = await snapshot()
+                    seen = {member['userId'] for member in members['members']}
+                    yield sse('snapshot', members)
+                elif 'userId' not in message:
+                    ends_at = message['expireAt']
+                elif message['userId'] not in seen:
+                    seen.add(message['userId'])
+                    yield sse('checkin', dict(message, count=len(seen)))
+            if time.time() >= ends_at:
+                yield sse('end', dict(rollCallId=roll_call_id, count=len(seen)))
+        finally:
+            with self._lock:
+                self._listeners[roll_call_id].discard(listener)
+                if not self._listeners[roll_call_id]:
+                    del self._listeners[roll_call_id]
+            if slot is not None:
+                slot.release()
+
+    def response(self, roll_call_id: int, ends_at: float, snapshot: Callable[[], Awaitable[dict]],
+                 request: Request) -> Response:
+        # The slot is taken here, concurrent requests can't all pass the check before their stream starts
+        with self._lock:
+            if self._open >= self.max_streams:
+                return JSONResponse(status_code=503, headers={'Retry-After': str(int(self.heartbeat))},
+                                    content={'message': 'Máy chủ đang bận, vui lòng thử lại sau'})
+            self._open += 1
+        slot = _Slot(self)
+        return _EventStreamResponse(self.events(roll_call_id, ends_at, snapshot, request, slot), slot,
+                                    media_type='text/event-stream',
+                                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -1,36 +1,271 @@
+import concurrent.futures
 import uuid
 import hashlib
+from typing import List, Optional, Set, Tuple
+
 import pytz
 
 from injector import singleton, inject
-from pymongo import MongoClient, errors, ReturnDocument
+from pymongo import MongoClient, errors, ReturnDocument, IndexModel, ASCENDING
 from starlette.config import Config
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
 from starlette.responses import JSONResponse
 from response.course import ClassInfo, CourseList, RollCallInfo, RollCallList, NotificationList, NotificationInfo
-from request.course import Class, UpdateClass, RollCall, UpdateRollCall, Checkin, Notification
+from request.course import Class, UpdateClass, RollCall, UpdateRollCall, Checkin, Notification, BulkCheckin
+from service.bulk_checkin import summary, validate_checkins
+from service.checkin_ingestor import CheckinIngestor
+from service.checkin_stream import CheckinStream
+from service.roll_call_state import RollCallState
 from service.user import UserService
+from common.cache import cache, cache_evict, cache_put
+from common.codec import ORJSON
+from common.context import request_scoped
 from common.exception import NotFoundException
+from common.geofence import geofence
+from common.id_allocator import IdAllocator
+from common.indexes import INDEXES
+from common.metrics import timed_methods
+from common.utils import MongoUtils
 from datetime import datetime, timedelta
-from geopy import distance
 
+INDEXES.declare(('COL_COURSES', 'courses'),
+                IndexModel([('id', ASCENDING)], unique=True),
+                IndexModel([('uuid', ASCENDING)], unique=True),
+                IndexModel([('classCode', ASCENDING), ('classKey', ASCENDING)]),
+                IndexModel([('__expireAt', ASCENDING)], expireAfterSeconds=0))
+INDEXES.declare(('COL_ROLL_CALL', 'roll_call'),
+                IndexModel([('id', ASCENDING)], unique=True),
+                IndexModel([('classId', ASCENDING), ('id', ASCENDING)]),
+                IndexModel([('__expireAt', ASCENDING)], expireAfterSeconds=0))
+INDEXES.declare(('CHECKIN_USER', 'checkin_user'),
+                IndexModel([('rollCallId', ASCENDING), ('userId', ASCENDING)], unique=True),
+                IndexModel([('classId', ASCENDING), ('rollCallId', ASCENDING)]),
+                IndexModel([('userId', ASCENDING), ('classId', ASCENDING)]),
+                IndexModel([('__expireAt', ASCENDING)], expireAfterSeconds=0))
+INDEXES.declare(('NOTIFICATION', 'notification'),
+                IndexModel([('id', ASCENDING)], unique=True),
+                IndexModel([('classId', ASCENDING)]))
+INDEXES.declare_query(('COL_COURSES', 'courses'), {'id': 0})
+INDEXES.declare_query(('COL_COURSES', 'courses'), {'uuid': ''})
+INDEXES.declare_query(('COL_COURSES', 'courses'), {'classCode': '', 'classKey': ''})
+INDEXES.declare_query(('COL_ROLL_CALL', 'roll_call'), {'classId': 0})
+INDEXES.declare_query(('COL_ROLL_CALL', 'roll_call'), {'classId': 0, 'id': 0})
+INDEXES.declare_query(('CHECKIN_USER', 'checkin_user'), {'userId': 0, 'classId': 0, 'rollCallId': 0})
+INDEXES.declare_query(('CHECKIN_USER', 'checkin_user'), {'classId': 0, 'rollCallId': 0})
+INDEXES.declare_query(('NOTIFICATION', 'notification'), {'classId': 0})
+INDEXES.declare_query(('NOTIFICATION', 'notification'), {'id': 0})
 
-@inject
-@singleton
-class ClassService:
+# Shared by the reader and the writers of cached courses
+COURSE_CACHE = dict(key='course:{class_id}', tags=['course:{class_id}'], ttl=300, local_ttl=30, codec=ORJSON)
+
+
+# Projection of the courses listed to a user
+COURSE_LIST_PROJECTION = {'_id': 0, 'uuid': 0, 'lecturerId': 0, '__expireAt': 0, 'classKey': 0, '__rawClassKey': 0}
+# Fields of the students of an offline batch
+BULK_USER_PROJECTION = {'_id': 0, 'id': 1, 'uuid': 1, 'name': 1, 'courses': 1}
+
+
+def now() -> float:
+    return datetime.timestamp(datetime.now(pytz.timezone("Asia/Ho_Chi_Minh")))
+
+
+class BaseClassService:
+    """Validation and documents of courses, roll calls, checkins and notifications.
+
+    :class:`ClassService` (pymongo) and ``AsyncClassService`` (motor) only add the reads and writes.
+    """
 
-    def __init__(self, mongo: MongoClient, config: Config, user: UserService) -> None:
+    def __init__(self, config: Config, id_allocator, ingestor, state: RollCallState, stream: CheckinStream) -> None:
         super().__init__()
-        self.user_service: UserService = user
-        self.mongo: MongoClient = mongo
+        self.ingestor = ingestor
+        self.state = state
+        self.stream = stream
+        self.id_allocator = id_allocator
         self.user = config('COL_USER', cast=str, default='user')
         self.courses = config('COL_COURSES', cast=str, default='courses')
         self.roll_call = config('COL_ROLL_CALL', cast=str, default='roll_call')
+        self.radius = config('CHECKIN_RADIUS', cast=int, default=30)
+        self.signing_secret = config('CHECKIN_SIGNING_SECRET', cast=str, default=None)
+        self.bulk_size = config('CHECKIN_BULK_MAX_SIZE', cast=int, default=500)
+        self.bulk_grace = config('CHECKIN_BULK_GRACE', cast=int, default=3600)
+        self.clock_skew = config('CHECKIN_CLOCK_SKEW', cast=int, default=120)
         self.checkin_data = config('COL_CHECKIN_DATA', cast=str, default='checkin_data')
         self.token = config('COL_TOKEN', cast=str, default='token')
         self.rf_token = config('COL_RF_TOKEN', cast=str, default='rf_token')
         self.checkin_user = config('CHECKIN_USER', cast=str, default='checkin_user')
         self.notification = config('NOTIFICATION', cast=str, default='notification')
 
+    @staticmethod
+    def live_roll_call(class_id: int, live):
+        if live is None or live[0]['classId'] != class_id:
+            return None
+        return RollCallInfo.roll_call_info(live[0]), live[1]
+
+    @staticmethod
+    def new_course(course: Class, course_id: int, user) -> dict:
+        data = dict(course)
+        data['__rawClassKey'] = data['classKey']
+        data['classKey'] = hashlib.md5(data['classKey'].encode()).hexdigest()
+        data['uuid'] = uuid.uuid4().__str__()
+        data['id'] = course_id
+        data['lecturer'] = user.name
+        data['lecturerId'] = user.id
+        data['quantity'] = 0
+        data['members'] = list()
+        data['__expireAt'] = datetime.fromtimestamp(course.expireAt) + timedelta(30)
+        return data
+
+    @staticmethod
+    def course_update(update_course: UpdateClass) -> dict:
+        data = dict(update_course)
+        if 'classKey' in data.keys():
+            data['classKey'] = hashlib.md5(data['classKey'].encode()).hexdigest()
+        return data
+
+    def new_roll_call(self, roll_call: RollCall, roll_call_id: int, course: ClassInfo) -> dict:
+        data = dict(roll_call)
+        data['classId'] = course.id
+        data['id'] = roll_call_id
+        data['uuid'] = uuid.uuid4().__str__()
+        data['radius'] = roll_call.radius or self.radius
+        data['total'] = course.classSize
+        data['count'] = 0
+        data['__expireAt'] = datetime.fromtimestamp(course.expireAt) + timedelta(30)
+        return data
+
+    def checkin_error(self, course: ClassInfo, user, roll_call: RollCallInfo, checked: bool,
+                      checkin: Checkin) -> Optional[JSONResponse]:
+        """Reject a checkin that can't be counted, ``None`` when it is accepted."""
+        if checked:
+            return JSONResponse(status_code=400, content={'message': 'Bạn đã điểm danh rồi'})
+        if course.uuid not in user.courses:
+            return JSONResponse(status_code=400, content={'message': 'Bạn chưa tham gia lớp'})
+        if now() > roll_call.expireAt:
+            return JSONResponse(status_code=400, content={'message': 'Buổi điểm danh đã kết thúc'})
+        if now() < roll_call.startAt:
+            return JSONResponse(status_code=400, content={'message': 'Buổi điểm danh chưa bắt đầu'})
+        response = dict(status=False,
+                        mac=False,
+                        location=False)
+        if checkin.mac == roll_call.mac:
+            response['mac'] = True
+            fence = geofence(roll_call.location['lat'], roll_call.location['long'], roll_call.radius or self.radius)
+            if fence.contains(checkin.lat, checkin.long):
+                response['location'] = True
+                response['status'] = True
+        if not response['status']:
+            return JSONResponse(status_code=422, content=response)
+        return None
+
+    @staticmethod
+    def checkin_accepted() -> JSONResponse:
+        return JSONResponse(status_code=200, content=dict(status=True, mac=True, location=True))
+
+    @staticmethod
+    def checkin_failed() -> JSONResponse:
+        return JSONResponse(status_code=503, content={'message': 'Chưa lưu được điểm danh, vui lòng thử lại'},
+                            headers={'Retry-After': '1'})
+
+    @staticmethod
+    def checkin_doc(course: ClassInfo, user, roll_call: RollCallInfo) -> dict:
+        return dict(name=user.name,
+                    userId=user.id,
+                    classId=course.id,
+                    rollCallId=roll_call.id,
+                    checkAt=now(),
+                    __expireAt=datetime.fromtimestamp(course.expireAt,
+                                                      tz=pytz.timezone("Asia/Ho_Chi_Minh")) + timedelta(30))
+
+    def bulk_error(self, bulk: BulkCheckin) -> Optional[JSONResponse]:
+        if self.signing_secret is None:
+            return JSONResponse(status_code=503, content={'message': 'Điểm danh offline chưa được bật'})
+        if len(bulk.checkins) > self.bulk_size:
+            return JSONResponse(status_code=413,
+                                content={'message': 'Tối đa {} lượt điểm danh'.format(self.bulk_size)})
+        return None
+
+    @staticmethod
+    def submitter_error(course: ClassInfo, submitter) -> Optional[JSONResponse]:
+        if course.uuid not in submitter.courses and course.lecturerId != submitter.id:
+            return JSONResponse(status_code=403, content={'message': 'Not Permission'})
+        return None
+
+    def bulk_expired(self, roll_call: RollCallInfo) -> Optional[JSONResponse]:
+        if now() > roll_call.expireAt + self.bulk_grace:
+            return JSONResponse(status_code=400, content={'message': 'Buổi điểm danh đã kết thúc'})
+        return None
+
+    def validate_bulk(self, course: ClassInfo, roll_call: RollCallInfo, bulk: BulkCheckin, users: List[dict],
+                      checked: Set[int]):
+        return validate_checkins(course, roll_call, self.radius, bulk.checkins, {user['id']: user for user in users},
+                                 checked, self.signing_secret, now(), self.clock_skew)
+
+    @staticmethod
+    def bulk_inserted(statuses: List[str], docs: List[Tuple[int, dict]], results: list) -> List[dict]:
+        """Record the outcome of every submitted checkin in ``statuses``, ``results`` hold ``True`` when the checkin
+        was inserted, ``False`` for a duplicate or the exception of a failed write. Returns the inserted documents."""
+        inserted = []
+        for (index, doc), result in zip(docs, results):
+            if isinstance(result, Exception):
+                statuses[index] = 'failed'
+            elif result:
+                inserted.append(doc)
+            else:
+                statuses[index] = 'duplicate'
+        return inserted
+
+    @staticmethod
+    def checkin_list(members: List[dict], roll_call: RollCallInfo) -> dict:
+        return dict(members=members,
+                    total=roll_call.total,
+                    count=roll_call.count)
+
+    @staticmethod
+    def checkin_snapshot(members: List[dict], roll_call: RollCallInfo) -> dict:
+        return dict(members=members, total=roll_call.total, count=len(members))
+
+    def new_notification(self, request: Notification, notification_id: int, class_id: int) -> dict:
+        notification = dict(request)
+        notification['id'] = notification_id
+        notification['classId'] = class_id
+        notification['createdAt'] = int(datetime.now(pytz.timezone('Asia/Ho_Chi_Minh')).timestamp())
+        notification['totalSeen'] = 0
+        notification['listSeen'] = list()
+        return notification
+
+    @staticmethod
+    def member_error(class_info: ClassInfo, user_info) -> Optional[JSONResponse]:
+        if class_info.uuid not in user_info.courses:
+            return JSONResponse(status_code=400, content={'message': 'Bạn phải là thành viên của lớp'})
+        return None
+
+    @staticmethod
+    def mark_seen(notifications: List[dict], user_info) -> List[dict]:
+        # Matched on the id only, the name stored in listSeen is the one the user had when they read it
+        for item in notifications:
+            item['isSeen'] = user_info.accountType == 2 or \
+                any(seen['userId'] == user_info.id for seen in item['listSeen'])
+        return notifications
+
+    @staticmethod
+    def unseen(notification_info: dict, user_info) -> bool:
+        return user_info.accountType == 1 and \
+            all(seen['userId'] != user_info.id for seen in notification_info['listSeen'])
+
+
+@inject
+@singleton
+@timed_methods
+class ClassService(BaseClassService):
+
+    def __init__(self, mongo: MongoClient, config: Config, user: UserService, id_allocator: IdAllocator,
+                 ingestor: CheckinIngestor, state: RollCallState, stream: CheckinStream) -> None:
+        super().__init__(config, id_allocator, ingestor, state, stream)
+        self.user_service: UserService = user
+        self.mongo: MongoClient = mongo
+
+    @cache(**COURSE_CACHE)
     def get_course(self, class_id: int):
         try:
             course = list(self.mongo[self.courses].find({'id': class_id}, {'_id': 0}).limit(1))[0]
@@ -38,7 +273,14 @@ class ClassService:
         except IndexError:
             raise NotFoundException(404, "course not found")
 
+    def _live_roll_call(self, class_id: int, roll_call_id: int, user_id: int = None):
+        return self.live_roll_call(class_id, self.state.load(roll_call_id, user_id))
+
+    @request_scoped
     def get_roll_call(self, class_id: int, roll_call_id: int):
+        live = self._live_roll_call(class_id, roll_call_id)
+        if live is not None:
+            return live[0]
         try:
             roll_call = list(self.mongo[self.roll_call].find({'classId': class_id, 'id': roll_call_id},
                                                              {'_id': 0, 'uuid': 0}).limit(1))[0]
@@ -48,48 +290,30 @@ class ClassService:
 
     def list_user_course(self, ac_token):
         user = self.user_service.get_user(ac_token)
-        courses = list()
-        for item in user.courses:
-            try:
-                course = list(self.mongo[self.courses].find({'uuid': item},
-                                                            {'_id': 0, 'uuid': 0, 'lecturerId': 0,
-                                                             '__expireAt': 0, 'classKey': 0, '__rawClassKey': 0})
-                              .limit(1))[0]
-                courses.append(course)
-            except IndexError:
-                continue
+        courses = MongoUtils.find_ordered(self.mongo[self.courses], 'uuid', user.courses, COURSE_LIST_PROJECTION)
         return CourseList.course_list(courses)
 
     def list_roll_call(self, class_id: int, ac_token: str):
         roll_calls = list(
             self.mongo[self.roll_call].find({'classId': class_id}, {'_id': 0, 'uuid': 0, '__expireAt': 0}))
-        for item in roll_calls:
-            item['isCheckin'] = self.check_checkin(class_id, item['id'], ac_token)['check']
+        if roll_calls:
+            user = self.user_service.get_user(ac_token)
+            checked = {item['rollCallId'] for item in
+                       self.mongo[self.checkin_user].find({'userId': user.id, 'classId': class_id},
+                                                          {'_id': 0, 'rollCallId': 1})}
+            for item in roll_calls:
+                item['isCheckin'] = item['id'] in checked
         return RollCallList.roll_call_list(roll_calls)
 
     def add_course(self, ac_token, course: Class):
         user = self.user_service.get_user(ac_token)
         if user.accountType != 2:
             return JSONResponse(status_code=403, content={'message': 'Not Permission'})
-        try:
-            course_id = list(self.mongo[self.courses].find({}).sort('id', -1).limit(1))[0]['id'] + 1
-        except IndexError:
-            course_id = 1
-        data = dict(course)
-        data['__rawClassKey'] = data['classKey']
-        data['classKey'] = hashlib.md5(data['classKey'].encode()).hexdigest()
-        data['uuid'] = uuid.uuid4().__str__()
-        data['id'] = course_id
-        data['lecturer'] = user.name
-        data['lecturerId'] = user.id
-        data['quantity'] = 0
-        data['members'] = list()
-        data['__expireAt'] = datetime.fromtimestamp(course.expireAt) + timedelta(30)
+        data = self.new_course(course, self.id_allocator.next_id(self.courses), user)
         try:
             self.mongo[self.courses].insert(data)
-            user_courses = user.courses
-            user_courses.append(data['uuid'])
-            self.mongo[self.user].update_one({'id': user.id}, {'$set': {'courses': user_courses}})
+            MongoUtils.push_unique(self.mongo[self.user], {'id': user.id}, 'courses', data['uuid'])
+            self.user_service.invalidate_user(user.uuid)
             return ClassInfo.course_info(data)
         except errors.DuplicateKeyError:
             return JSONResponse(status_code=400, content={'message': 'Course đã tồn tại'})
@@ -99,48 +323,39 @@ class ClassService:
         user = self.user_service.get_user(ac_token)
         if course.lecturerId != user.id:
             return JSONResponse(status_code=403, content={'message': 'Not Permission'})
-        data = dict(roll_call)
-        data['classId'] = course.id
-        try:
-            id = list(self.mongo[self.roll_call].find({}).sort('id', -1).limit(1))[0]['id'] + 1
-        except IndexError:
-            id = 1
-        data['id'] = id
-        data['uuid'] = uuid.uuid4().__str__()
-        data['total'] = course.classSize
-        data['count'] = 0
-        data['__expireAt'] = datetime.fromtimestamp(course.expireAt) + timedelta(30)
-        try:
-            self.mongo[self.roll_call].insert(data)
-            return RollCallInfo.roll_call_info(data)
-        except IndexError:
-            return RollCallInfo.roll_call_info(data)
+        data = self.new_roll_call(roll_call, self.id_allocator.next_id(self.roll_call), course)
+        self.mongo[self.roll_call].insert(data)
+        self.state.publish(data)
+        return RollCallInfo.roll_call_info(data)
 
+    @cache_put(**COURSE_CACHE)
     def update_course(self, class_id: int, update_course: UpdateClass, ac_token):
         course = self.get_course(class_id)
         user = self.user_service.get_user(ac_token)
         if user.id != course.lecturerId:
             return JSONResponse(status_code=403, content={'message': 'Not Permission'})
-        data = dict(update_course)
-        if 'classKey' in data.keys():
-            data['classKey'] = hashlib.md5(data['classKey'].encode()).hexdigest()
-        query = {'id': class_id}
-        course = self.mongo[self.courses].find_one_and_update(query, {'$set': data},
+        course = self.mongo[self.courses].find_one_and_update({'id': class_id},
+                                                              {'$set': self.course_update(update_course)},
                                                               return_document=ReturnDocument.AFTER)
         return ClassInfo.course_info(course)
 
     def update_roll_call(self, class_id: int, roll_call_id: int, update_roll_call: UpdateRollCall, ac_token: str):
         course = self.get_course(class_id)
         user = self.user_service.get_user(ac_token)
-        roll_call = self.get_roll_call(class_id, roll_call_id)
+        self.get_roll_call(class_id, roll_call_id)
         if user.id != course.lecturerId:
             return JSONResponse(status_code=403, content={'message': 'Not Permission'})
-        data = dict(update_roll_call)
-        query = {'id': roll_call_id}
-        response = self.mongo[self.roll_call].find_one_and_update(query, {'$set': data}, {'_id': 0},
+        response = self.mongo[self.roll_call].find_one_and_update({'id': roll_call_id},
+                                                                  {'$set': dict(update_roll_call)}, {'_id': 0},
                                                                   return_document=ReturnDocument.AFTER)
+        # Union with the checkins already in Mongo, the set may be new or behind after an eviction
+        checked = [item['userId'] for item in
+                   self.mongo[self.checkin_user].find({'rollCallId': roll_call_id}, {'_id': 0, 'userId': 1})]
+        self.state.publish(response, checked)
+        self.stream.publish_roll_call(response)
         return RollCallInfo.roll_call_info(response)
 
+    @cache_evict(tags=['course:{class_id}'])
     def delete_course(self, class_id: int, ac_token):
         course = self.get_course(class_id)
         user = self.user_service.get_user(ac_token)
@@ -148,115 +363,122 @@ class ClassService:
             return JSONResponse(status_code=403, content={'message': 'Not Permission'})
         self.mongo[self.courses].delete_one({'id': class_id})
         self.mongo[self.notification].delete_many({'classId': class_id})
+        roll_call_ids = [roll_call['id'] for roll_call in
+                         self.mongo[self.roll_call].find({'classId': class_id}, {'_id': 0, 'id': 1})]
         self.mongo[self.roll_call].delete_many({'classId': class_id})
         self.mongo[self.checkin_user].delete_many({'classId': class_id})
+        self.state.drop(roll_call_ids)
 
     def checkin(self, class_id: int, roll_call_id: int, checkin: Checkin, ac_token: str):
         course = self.get_course(class_id)
-        roll_call = self.get_roll_call(class_id, roll_call_id)
         user = self.user_service.get_user(ac_token)
-        if self.check_checkin(class_id, roll_call_id, ac_token)['check']:
+        live = self._live_roll_call(class_id, roll_call_id, user.id)
+        if live is None:
+            roll_call = self.get_roll_call(class_id, roll_call_id)
+            checked = self.check_checkin(class_id, roll_call_id, ac_token)['check']
+        else:
+            roll_call, checked = live
+        error = self.checkin_error(course, user, roll_call, checked, checkin)
+        if error is not None:
+            return error
+        checkin_user = self.checkin_doc(course, user, roll_call)
+        if live is not None and self.state.mark(roll_call.id, roll_call.expireAt, user.id) is False:
             return JSONResponse(status_code=400, content={'message': 'Bạn đã điểm danh rồi'})
-        has_join = False
-        course_uuid = list(self.mongo[self.courses].find({'id': class_id}, {'_id': 0}).limit(1))[0]['uuid']
-        for item in user.courses:
-            if item == course_uuid:
-                has_join = True
-                break
-        if not has_join:
-            return JSONResponse(status_code=400, content={'message': 'Bạn chưa tham gia lớp'})
-        if datetime.timestamp(datetime.now(pytz.timezone("Asia/Ho_Chi_Minh"))) > roll_call.expireAt:
-            return JSONResponse(status_code=400, content={'message': 'Buổi điểm danh đã kết thúc'})
-        if datetime.timestamp(datetime.now(pytz.timezone("Asia/Ho_Chi_Minh"))) < roll_call.startAt:
-            return JSONResponse(status_code=400, content={'message': 'Buổi điểm danh chưa bắt đầu'})
-        response = dict(status=False,
-                        mac=False,
-                        location=False)
-        if checkin.mac == roll_call.mac:
-            response['mac'] = True
-            org_loc = (roll_call.location['lat'], roll_call.location['long'])
-            check_loc = (checkin.lat, checkin.long)
-            if int(distance.distance(org_loc, check_loc).m) <= 30:
-                response['location'] = True
-                response['status'] = True
-        for key in response.keys():
-            if not response[key]:
-                return JSONResponse(status_code=422, content=response)
-        new_count = roll_call.count + 1
-        self.mongo[self.roll_call].update_one({'id': roll_call.id}, {'$set': {'count': new_count}})
-        checkin_user = dict(name=user.name,
-                            userId=user.id,
-                            classId=course.id,
-                            rollCallId=roll_call.id,
-                            checkAt=datetime.timestamp(datetime.now(pytz.timezone("Asia/Ho_Chi_Minh"))),
-                            __expireAt=datetime.fromtimestamp(course.expireAt,
-                                                              tz=pytz.timezone("Asia/Ho_Chi_Minh")) + timedelta(30))
+        # Inserted and counted with the rest of the burst, a duplicate checkin is not counted twice
         try:
-            self.mongo[self.checkin_user].insert(checkin_user)
-            return JSONResponse(status_code=200, content=response)
-        except errors.DuplicateKeyError:
-            return JSONResponse(status_code=200, content=response)
+            inserted = self.ingestor.ingest(checkin_user)
+        except Exception:
+            # Not written or not acknowledged in time, release the claim so that the student can retry
+            if live is not None:
+                self.state.unmark(roll_call.id, user.id)
+            return self.checkin_failed()
+        if inserted:
+            self.stream.publish(checkin_user)
+        return self.checkin_accepted()
 
-    def check_checkin(self, class_id: int, roll_call_id: int, ac_token: str):
+    def bulk_checkin(self, class_id: int, roll_call_id: int, bulk: BulkCheckin, ac_token: str):
+        error = self.bulk_error(bulk)
+        if error is not None:
+            return error
         course = self.get_course(class_id)
+        error = self.submitter_error(course, self.user_service.get_user(ac_token))
+        if error is not None:
+            return error
         roll_call = self.get_roll_call(class_id, roll_call_id)
+        error = self.bulk_expired(roll_call)
+        if error is not None:
+            return error
+        user_ids = list({item.userId for item in bulk.checkins})
+        users = self.mongo[self.user].find({'id': {'$in': user_ids}}, BULK_USER_PROJECTION)
+        checked = {item['userId'] for item in
+                   self.mongo[self.checkin_user].find({'rollCallId': roll_call.id, 'userId': {'$in': user_ids}},
+                                                      {'_id': 0, 'userId': 1})}
+        statuses, docs = self.validate_bulk(course, roll_call, bulk, users, checked)
+        # One batch, written with a single insert_many, checkins not acknowledged in time are reported failed
+        futures = self.ingestor.submit_many([doc for _, doc in docs])
+        done, _ = concurrent.futures.wait(futures, self.ingestor.ack_timeout)
+        results = [(future.exception() or future.result()) if future in done else concurrent.futures.TimeoutError()
+                   for future in futures]
+        inserted = self.bulk_inserted(statuses, docs, results)
+        self.state.mark_many(roll_call.id, roll_call.expireAt, [doc['userId'] for doc in inserted])
+        for doc in inserted:
+            self.stream.publish(doc)
+        return summary(bulk.checkins, statuses)
+
+    def check_checkin(self, class_id: int, roll_call_id: int, ac_token: str):
+        course = self.get_course(class_id)
         user = self.user_service.get_user(ac_token)
+        live = self._live_roll_call(class_id, roll_call_id, user.id)
+        if live is not None:
+            return {'check': live[1]}
+        roll_call = self.get_roll_call(class_id, roll_call_id)
         query = dict(userId=user.id,
                      classId=course.id,
                      rollCallId=roll_call.id)
-        try:
-            data = list(self.mongo[self.checkin_user].find(query, {'_id': 0}).limit(1))[0]
-            return {'check': True}
-        except IndexError:
-            return {'check': False}
+        return {'check': bool(list(self.mongo[self.checkin_user].find(query, {'_id': 1}).limit(1)))}
 
     def list_checkin(self, class_id: int, roll_call_id: int):
         course = self.get_course(class_id)
         roll_call = self.get_roll_call(class_id, roll_call_id)
         query = dict(classId=course.id,
                      rollCallId=roll_call.id)
-        list_checkin = list(self.mongo[self.checkin_user].find(query, {'_id': 0, 'name': 1, 'checkAt': 1}))
-        return dict(members=list_checkin,
-                    total=roll_call.total,
-                    count=roll_call.count)
+        members = list(self.mongo[self.checkin_user].find(query, {'_id': 0, 'name': 1, 'checkAt': 1}))
+        return self.checkin_list(members, roll_call)
+
+    def stream_checkin(self, class_id: int, roll_call_id: int, request: Request, ac_token: str):
+        course = self.get_course(class_id)
+        user = self.user_service.get_user(ac_token)
+        if user.id != course.lecturerId:
+            return JSONResponse(status_code=403, content={'message': 'Not Permission'})
+        roll_call = self.get_roll_call(class_id, roll_call_id)
+        return self.stream.response(roll_call.id, roll_call.expireAt,
+                                    lambda: run_in_threadpool(self._checkin_snapshot, class_id, roll_call_id), request)
+
+    def _checkin_snapshot(self, class_id: int, roll_call_id: int):
+        roll_call = self.get_roll_call(class_id, roll_call_id)
+        members = list(self.mongo[self.checkin_user].find(dict(classId=class_id, rollCallId=roll_call_id),
+                                                          {'_id': 0, 'userId': 1, 'name': 1, 'checkAt': 1}))
+        return self.checkin_snapshot(members, roll_call)
 
     def add_notification(self, class_id: int, request: Notification, ac_token: str):
         user_info = self.user_service.get_user(ac_token)
         self.get_course(class_id)
         if user_info.accountType != 2:
             return JSONResponse(status_code=403, content={'message': 'Not Permission'})
-        try:
-            not_id = list(self.mongo[self.notification].find({}, {'_id': 0}).sort('id', -1).limit(1))[0]['id'] + 1
-        except IndexError:
-            not_id = 1
-        notification = dict(request)
-        notification['id'] = not_id
-        notification['classId'] = class_id
-        notification['createdAt'] = int(datetime.now(pytz.timezone('Asia/Ho_Chi_Minh')).timestamp())
-        notification['totalSeen'] = 0
-        notification['listSeen'] = list()
+        notification = self.new_notification(request, self.id_allocator.next_id(self.notification), class_id)
         try:
             self.mongo[self.notification].insert(notification)
-            return NotificationInfo.notification(notification)
         except errors.DuplicateKeyError:
-            return NotificationInfo.notification(notification)
+            pass
+        return NotificationInfo.notification(notification)
 
     def list_notification(self, class_id: int, ac_token: str):
         user_info = self.user_service.get_user(ac_token)
-        class_info = self.get_course(class_id)
-        if class_info.uuid not in user_info.courses:
-            return JSONResponse(status_code=400, content={'message': 'Bạn phải là thành viên của lớp'})
+        error = self.member_error(self.get_course(class_id), user_info)
+        if error is not None:
+            return error
         notifications = list(self.mongo[self.notification].find({'classId': class_id}, {'_id': 0, 'body': 0}))
-
-        seen_data = dict(userId=user_info.id, name=user_info.name)
-        for item in notifications:
-            item['isSeen'] = True
-            if user_info.accountType == 2:
-                continue
-            if seen_data not in item['listSeen']:
-                item['isSeen'] = False
-
-        return NotificationList.list_notification(notifications)
+        return NotificationList.list_notification(self.mark_seen(notifications, user_info))
 
     def get_notification(self, notification_id: int, ac_token: str):
         user_info = self.user_service.get_user(ac_token)
@@ -264,17 +486,13 @@ class ClassService:
             notification_info = list(self.mongo[self.notification].find({'id': notification_id}, {'_id': 0}))[0]
         except IndexError:
             raise NotFoundException(404, 'Notification Not Found')
-        class_info = self.get_course(notification_info['classId'])
-        if class_info.uuid not in user_info.courses:
-            return JSONResponse(status_code=400, content={'message': 'Bạn phải là thành viên của lớp'})
-
-        if user_info.accountType == 1:
-            seen_data = dict(userId=user_info.id, name=user_info.name)
-            if seen_data not in notification_info['listSeen']:
-                notification_info['listSeen'].append(seen_data)
-                notification_info['totalSeen'] += 1
-                self.mongo[self.notification].update({'id': notification_id},
-                                                     {'$set': {'listSeen': notification_info['listSeen'],
-                                                               'totalSeen': notification_info['totalSeen']}})
-
+        error = self.member_error(self.get_course(notification_info['classId']), user_info)
+        if error is not None:
+            return error
+        if self.unseen(notification_info, user_info):
+            seen = MongoUtils.push_unique(self.mongo[self.notification], {'id': notification_id}, 'listSeen',
+                                          dict(userId=user_info.id, name=user_info.name), key='userId',
+                                          counter='totalSeen', projection={'_id': 0})
+            notification_info = seen or notification_info
         return NotificationInfo.notification(notification_info)
+
@@ -0,0 +1,183 @@
+import logging
+from typing import Iterable, List, Optional, Tuple
+
+import orjson
+from injector import singleton, inject
+from redis import Redis, RedisError
+from redis.asyncio import Redis as AsyncRedis
+from starlette.config import Config
+
+LOGGER = logging.getLogger(__name__)
+
+# Fields of a roll call needed to validate checkins, the count is the size of the checked-in set
+__FIELDS__ = ('id', 'classId', 'startAt', 'expireAt', 'mac', 'lat', 'long', 'radius', 'total')
+
+
+@inject
+@singleton
+class RollCallState:
+    """Live roll calls kept in Redis for the checkin hot path.
+
+    A roll call is stored as JSON under ``roll_call:<id>`` and the ids of checked-in users in the set
+    ``roll_call:<id>:checkin``, both expiring ``ROLL_CALL_STATE_GRACE`` seconds after the roll call ends.
+    Every method returns ``None`` when Redis is unavailable or the roll call isn't live, callers then read Mongo.
+    """
+
+    def __init__(self, redis: Redis, async_redis: AsyncRedis, config: Config) -> None:
+        super().__init__()
+        self.redis = redis
+        self.async_redis = async_redis
+        self.grace = config('ROLL_CALL_STATE_GRACE', cast=int, default=3600)
+
+    @staticmethod
+    def state_key(roll_call_id: int) -> str:
+        return 'roll_call:' + str(roll_call_id)
+
+    @staticmethod
+    def members_key(roll_call_id: int) -> str:
+        return 'roll_call:' + str(roll_call_id) + ':checkin'
+
+    def expire_at(self, ends_at: float) -> int:
+        return int(ends_at) + self.grace
+
+    def queue_publish(self, pipe, roll_call: dict, user_ids: Iterable[int]):
+        state = {field: roll_call.get(field) for field in __FIELDS__}
+        pipe.set(self.state_key(roll_call['id']), orjson.dumps(state))
+        pipe.expireat(self.state_key(roll_call['id']), self.expire_at(roll_call['expireAt']))
+        user_ids = list(user_ids)
+        if user_ids:
+            pipe.sadd(self.members_key(roll_call['id']), *user_ids)
+            pipe.expireat(self.members_key(roll_call['id']), self.expire_at(roll_call['expireAt']))
+
+    @staticmethod
+    def queue_load(pipe, roll_call_id: int, user_id: Optional[int]):
+        pipe.get(RollCallState.state_key(roll_call_id))
+        pipe.scard(RollCallState.members_key(roll_call_id))
+        if user_id is not None:
+            pipe.sismember(RollCallState.members_key(roll_call_id), user_id)
+
+    @staticmethod
+    def loaded(results: list) -> Optional[Tuple[dict, bool]]:
+        if results[0] is None:
+            return None
+        roll_call = orjson.loads(results[0])
+        roll_call['count'] = results[1]
+        return roll_call, len(results) > 2 and bool(results[2])
+
+    def queue_mark(self, pipe, roll_call_id: int, ends_at: float, *user_ids: int):
+        pipe.sadd(self.members_key(roll_call_id), *user_ids)
+        pipe.expireat(self.members_key(roll_call_id), self.expire_at(ends_at))
+
+    def publish(self, roll_call: dict, user_ids: Iterable[int] = ()):
+        """Make ``roll_call`` live, adding ``user_ids`` to its checked-in users."""
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            self.queue_publish(pipe, roll_call, user_ids)
+            pipe.execute()
+        except RedisError as ex:
+            LOGGER.warning('Can\'t publish roll call %s: %s', roll_call['id'], ex)
+
+    def load(self, roll_call_id: int, user_id: int = None) -> Optional[Tuple[dict, bool]]:
+        """Return the live roll call with its ``count``, and whether ``user_id`` is checked in."""
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            self.queue_load(pipe, roll_call_id, user_id)
+            return self.loaded(pipe.execute())
+        except RedisError as ex:
+            LOGGER.warning('Can\'t load roll call %s: %s', roll_call_id, ex)
+            return None
+
+    def mark(self, roll_call_id: int, ends_at: float, user_id: int) -> Optional[bool]:
+        """Claim the checkin of ``user_id`` in a roll call ending at ``ends_at``, ``False`` when they were already
+        checked in."""
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            self.queue_mark(pipe, roll_call_id, ends_at, user_id)
+            return bool(pipe.execute()[0])
+        except RedisError as ex:
+            LOGGER.warning('Can\'t mark checkin of roll call %s: %s', roll_call_id, ex)
+            return None
+
+    def unmark(self, roll_call_id: int, user_id: int):
+        """Release the checkin claimed by :meth:`mark` when it couldn't be written to Mongo."""
+        try:
+            self.redis.srem(self.members_key(roll_call_id), user_id)
+        except RedisError as ex:
+            LOGGER.warning('Can\'t unmark checkin of roll call %s: %s', roll_call_id, ex)
+
+    def mark_many(self, roll_call_id: int, ends_at: float, user_ids: List[int]):
+        """Add checkins written to Mongo by another path to the checked-in users."""
+        if not user_ids:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            self.queue_mark(pipe, roll_call_id, ends_at, *user_ids)
+            pipe.execute()
+        except RedisError as ex:
+            LOGGER.warning('Can\'t mark checkins of roll call %s: %s', roll_call_id, ex)
+
+    @staticmethod
+    def keys(roll_call_ids: Iterable[int]) -> List[str]:
+        return [key for roll_call_id in roll_call_ids
+                for key in (RollCallState.state_key(roll_call_id), RollCallState.members_key(roll_call_id))]
+
+    def drop(self, roll_call_ids: Iterable[int]):
+        """Forget roll calls deleted from Mongo, their checkins would otherwise be served until they expire."""
+        keys = self.keys(roll_call_ids)
+        if not keys:
+            return
+        try:
+            self.redis.delete(*keys)
+        except RedisError as ex:
+            LOGGER.warning('Can\'t drop roll calls %s: %s', roll_call_ids, ex)
+
+    async def publish_async(self, roll_call: dict, user_ids: Iterable[int] = ()):
+        try:
+            pipe = self.async_redis.pipeline(transaction=False)
+            self.queue_publish(pipe, roll_call, user_ids)
+            await pipe.execute()
+        except RedisError as ex:
+            LOGGER.warning('Can\'t publish roll call %s: %s', roll_call['id'], ex)
+
+    async def load_async(self, roll_call_id: int, user_id: int = None) -> Optional[Tuple[dict, bool]]:
+        try:
+            pipe = self.async_redis.pipeline(transaction=False)
+            self.queue_load(pipe, roll_call_id, user_id)
+            return self.loaded(await pipe.execute())
+        except RedisError as ex:
+            LOGGER.warning('Can\'t load roll call %s: %s', roll_call_id, ex)
+            return None
+
+    async def mark_async(self, roll_call_id: int, ends_at: float, user_id: int) -> Optional[bool]:
+        try:
+            pipe = self.async_redis.pipeline(transaction=False)
+            self.queue_mark(pipe, roll_call_id, ends_at, user_id)
+            return bool((await pipe.execute())[0])
+        except RedisError as ex:
+            LOGGER.warning('Can\'t mark checkin of roll call %s: %s', roll_call_id, ex)
+            return None
+
+    async def unmark_async(self, roll_call_id: int, user_id: int):
+        try:
+            await self.async_redis.srem(self.members_key(roll_call_id), user_id)
+        except RedisError as ex:
+            LOGGER.warning('Can\'t unmark checkin of roll call %s: %s', roll_call_id, ex)
+
+    async def mark_many_async(self, roll_call_id: int, ends_at: float, user_ids: List[int]):
+        if not user_ids:
+            return
+        try:
+            pipe = self.async_redis.pipeline(transaction=False)
+            self.queue_mark(pipe, roll_call_id, ends_at, *user_ids)
+            await pipe.execute()
+        except RedisError as ex:
+            LOGGER.warning('Can\'t mark checkins of roll call %s: %s', roll_call_id, ex)
+
+    async def drop_async(self, roll_call_ids: Iterable[int]):
+        keys = self.keys(roll_call_ids)
+        if not keys:
+            return
+        try:
+            await self.async_redis.delete(*keys)
+        except RedisError as ex:
+            LOGGER.warning('Can\'t drop roll calls %s: %s', roll_call_ids, ex)
@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+import pytz
+from injector import singleton, inject
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import PyMongoError
+from starlette.config import Config
+
+from common.lifecycle import on_shutdown
+
+LOGGER = logging.getLogger(__name__)
+
+
+@inject
+@singleton
+class TokenRefresher:
+    """Write-behind sliding expiry for access tokens.
+
+    Seen tokens are coalesced in memory and pushed to Mongo with one unordered
+    ``bulk_write`` every ``TOKEN_REFRESH_INTERVAL`` seconds or ``TOKEN_REFRESH_BATCH_SIZE`` tokens.
+    """
+
+    def __init__(self, mongo: MongoClient, config: Config) -> None:
+        super().__init__()
+        self.mongo: MongoClient = mongo
+        self.token = config('COL_TOKEN', cast=str, default='token')
+        self.interval = config('TOKEN_REFRESH_INTERVAL', cast=float, default=5.0)
+        self.batch_size = config('TOKEN_REFRESH_BATCH_SIZE', cast=int, default=500)
+        self.expire = timedelta(7)
+        self._pending: Dict[str, datetime] = dict()
+        self._first_seen = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._metrics = dict(flushes=0, flushed=0, failures=0, lastFlushSize=0, maxFlushSize=0,
+                             lastLag=0.0, maxLag=0.0)
+        self._thread = threading.Thread(target=self._run, name='token-refresher', daemon=True)
+        self._thread.start()
+        on_shutdown(self.close)
+        LOGGER.debug('TokenRefresher Initialized')
+
+    def touch(self, ac_token: str) -> datetime:
+        """Record the token as seen now, returns its new expiry."""
+        seen_at = datetime.now(pytz.timezone("Asia/Ho_Chi_Minh"))
+        with self._lock:
+            if self._first_seen is None:
+                self._first_seen = time.monotonic()
+            self._pending[ac_token] = seen_at
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+        return seen_at + self.expire
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, dict()
+            first_seen, self._first_seen = self._first_seen, None
+        if not pending:
+            return 0
+        requests = [UpdateOne({'key': key}, {'$max': {'__expiredAt': seen_at + self.expire}})
+                    for key, seen_at in pending.items()]
+        try:
+            self.mongo[self.token].bulk_write(requests, ordered=False)
+        except PyMongoError:
+            LOGGER.exception('Can\'t refresh %d tokens', len(pending))
+            with self._lock:
+                for key, seen_at in pending.items():
+                    self._pending[key] = max(seen_at, self._pending.get(key, seen_at))
+                if self._first_seen is None or first_seen < self._first_seen:
+                    self._first_seen = first_seen
+                self._metrics['failures'] += 1
+            return 0
+        lag = time.monotonic() - first_seen
+        with self._lock:
+            self._metrics['flushes'] += 1
+            self._metrics['flushed'] += len(pending)
+            self._metrics['lastFlushSize'] = len(pending)
+            self._metrics['maxFlushSize'] = max(self._metrics['maxFlushSize'], len(pending))
+            self._metrics['lastLag'] = lag
+            self._metrics['maxLag'] = max(self._metrics['maxLag'], lag)
+        LOGGER.debug('Refreshed %d tokens, lag %.3fs', len(pending), lag)
+        return len(pending)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return dict(self._metrics, pending=len(self._pending))
+
+    def _run(self):
+        while not self._closed.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        self._closed.set()
+        self._wakeup.set()
+        self._thread.join(self.interval)
+        self.flush()
@@ -1,26 +1,75 @@
 import random
 import string
 import uuid
+from typing import Optional
 
 import hashlib
 import pytz
+from bson import ObjectId
+from bson.errors import InvalidId
+from dataclasses import replace
 from injector import singleton, inject
-from pymongo import MongoClient, errors
+from pymongo import MongoClient, errors, IndexModel, ASCENDING, DESCENDING
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
 from starlette.config import Config
 from starlette.responses import JSONResponse
 from response.user import InfoUser
 from request.user import User, UserUpdate, UserLogin, UserForget, UserJoin, SendMessage
 from datetime import datetime, timedelta
+from common.cache import CacheInterceptor
+from common.context import request_scoped
 from common.exception import NotFoundException
+from common.id_allocator import IdAllocator
+from common.indexes import INDEXES
+from common.metrics import timed_methods
+from common.signature import derive_key
+from common.tiered_cache import InvalidationBus, TieredCache
+from common.utils import MongoUtils
+from service.token_refresher import TokenRefresher
 
+INDEXES.declare(('COL_TOKEN', 'token'),
+                IndexModel([('key', ASCENDING)], unique=True),
+                IndexModel([('userUuid', ASCENDING)]),
+                IndexModel([('__expiredAt', ASCENDING)], expireAfterSeconds=0))
+INDEXES.declare(('COL_RF_TOKEN', 'rf_token'),
+                IndexModel([('key', ASCENDING)]),
+                IndexModel([('userUuid', ASCENDING)]))
+INDEXES.declare(('COL_USER', 'user'),
+                IndexModel([('id', ASCENDING)], unique=True),
+                IndexModel([('uuid', ASCENDING)], unique=True),
+                IndexModel([('userName', ASCENDING)], unique=True))
+INDEXES.declare(('CONVERSATION', 'conversation'),
+                IndexModel([('id', ASCENDING)], unique=True),
+                IndexModel([('senderUuid', ASCENDING), ('lastActive', DESCENDING)]),
+                IndexModel([('receiverUuid', ASCENDING), ('lastActive', DESCENDING)]))
+INDEXES.declare(('MESSAGE', 'message'),
+                IndexModel([('conversationId', ASCENDING), ('sendAt', DESCENDING), ('_id', DESCENDING)]),
+                IndexModel([('conversationId', ASCENDING), ('receiverUuid', ASCENDING), ('isSeen', ASCENDING)]))
+INDEXES.declare_query(('COL_TOKEN', 'token'), {'key': ''})
+INDEXES.declare_query(('COL_TOKEN', 'token'), {'userUuid': ''})
+INDEXES.declare_query(('COL_RF_TOKEN', 'rf_token'), {'key': ''})
+INDEXES.declare_query(('COL_USER', 'user'), {'uuid': ''})
+INDEXES.declare_query(('COL_USER', 'user'), {'userName': '', 'password': ''})
+INDEXES.declare_query(('CONVERSATION', 'conversation'), {'id': 0})
+INDEXES.declare_query(('CONVERSATION', 'conversation'), {'$or': [{'senderUuid': ''}, {'receiverUuid': ''}]},
+                      [('lastActive', -1)])
+INDEXES.declare_query(('MESSAGE', 'message'), {'conversationId': 0}, [('sendAt', -1), ('_id', -1)])
+INDEXES.declare_query(('MESSAGE', 'message'), {'conversationId': 0, 'receiverUuid': '', 'isSeen': False})
 
-@inject
-@singleton
-class UserService:
 
-    def __init__(self, mongo: MongoClient, config: Config) -> None:
+class BaseUserService:
+    """Validation and documents of users, tokens and conversations.
+
+    :class:`UserService` (pymongo) and ``AsyncUserService`` (motor) only add the reads and writes.
+    """
+
+    def __init__(self, config: Config, redis: Redis, async_redis: AsyncRedis, bus: InvalidationBus,
+                 token_refresher: TokenRefresher, id_allocator, cache: CacheInterceptor) -> None:
         super().__init__()
-        self.mongo: MongoClient = mongo
+        self.cache = cache
+        self.id_allocator = id_allocator
+        self.token_refresher = token_refresher
         self.user = config('COL_USER', cast=str, default='user')
         self.courses = config('COL_COURSES', cast=str, default='courses')
         self.roll_call = config('COL_ROLL_CALL', cast=str, default='roll_call')
@@ -30,6 +79,12 @@ class UserService:
         self.key = config('KEY', cast=str, default='')
         self.conversation = config('CONVERSATION', cast=str, default='conversation')
         self.message = config('MESSAGE', cast=str, default='message')
+        self.signing_secret = config('CHECKIN_SIGNING_SECRET', cast=str, default=None)
+        self.token_cache = TieredCache(redis, async_redis, bus, 'token-user',
+                                       maxsize=config('TOKEN_CACHE_SIZE', cast=int, default=1024),
+                                       ttl=config('TOKEN_CACHE_TTL', cast=int, default=60),
+                                       redis_ttl=config('TOKEN_CACHE_REDIS_TTL', cast=int, default=600),
+                                       enabled=config('TOKEN_CACHE_ENABLED', cast=bool, default=True))
 
     @staticmethod
     def check_day(last: datetime, now: datetime):
@@ -39,16 +94,228 @@ class UserService:
                     return True
         return False
 
-    def check_ac_token(self, ac_token):
+    @staticmethod
+    def user_tag(user_uuid: str):
+        return 'user:' + user_uuid
+
+    @staticmethod
+    def digest(value: str):
+        return hashlib.md5(value.encode()).hexdigest()
+
+    @staticmethod
+    def missing_field(value: dict) -> Optional[JSONResponse]:
+        for k, v in value.items():
+            if v is None:
+                return JSONResponse(status_code=400, content={'message': 'Mục {} không được để trống'.format(k)})
+        return None
+
+    @staticmethod
+    def cached_user(cached) -> Optional[InfoUser]:
+        """User of a cached token, ``None`` when the token is due for its refresh."""
+        if cached is None:
+            return None
+        user, expired_at = cached
+        if BaseUserService.check_day(expired_at, datetime.now()):
+            return None
+        return replace(user, courses=list(user.courses))
+
+    def user_update(self, user: UserUpdate) -> dict:
+        value = dict(user)
+        value['answer'] = self.digest(value['answer'])
+        return value
+
+    def new_user(self, user: User, user_id: int) -> dict:
+        value = dict(user)
+        value['id'] = user_id
+        value['uuid'] = uuid.uuid4().__str__()
+        value['courses'] = []
+        value['password'] = self.digest(value['password'])
+        value['answer'] = self.digest(value['answer'])
+        value['conversations'] = list()
+        return value
+
+    @staticmethod
+    def new_token(user_uuid: str) -> dict:
+        letters = string.ascii_letters
+        return {'userUuid': user_uuid, 'key': ''.join(random.choice(letters) for i in range(50)),
+                '__expiredAt': datetime.now(pytz.timezone("Asia/Ho_Chi_Minh")) + timedelta(7)}
+
+    @staticmethod
+    def login_response(ac_token: str) -> JSONResponse:
+        return JSONResponse(status_code=200, content={'message': 'Đăng nhập thành công'}, headers={'token': ac_token})
+
+    def recovery_error(self, user: dict, user_forget: UserForget) -> Optional[JSONResponse]:
+        if user['questionRecovery'] != user_forget.questionRecovery:
+            return JSONResponse(status_code=400, content={'message': 'Sai Câu Hỏi'})
+        if user['answer'] != self.digest(user_forget.answer):
+            return JSONResponse(status_code=400, content={'message': 'Câu trả lời không chính xác !'})
+        return None
+
+    def signing_error(self) -> Optional[JSONResponse]:
+        if self.signing_secret is None:
+            return JSONResponse(status_code=503, content={'message': 'Điểm danh offline chưa được bật'})
+        return None
+
+    def signing_key(self, user: InfoUser) -> dict:
+        return dict(userId=user.id, key=derive_key(self.signing_secret, user.uuid))
+
+    def join_query(self, data: UserJoin) -> dict:
+        return {'classCode': data.classCode, 'classKey': self.digest(data.classKey)}
+
+    @staticmethod
+    def receiver_query(data: SendMessage) -> dict:
+        if data.userUuidReceive is None:
+            return {'userName': data.userNameReceive}
+        return {'uuid': data.userUuidReceive}
+
+    @staticmethod
+    def conversation_query(user_uuid: str, receiver_uuid: str) -> dict:
+        return {'senderUuid': {'$in': [user_uuid, receiver_uuid]},
+                'receiverUuid': {'$in': [user_uuid, receiver_uuid]}}
+
+    @staticmethod
+    def new_conversation(conversation_id: int, user_info: InfoUser, receiver: dict) -> dict:
+        return dict(id=conversation_id,
+                    senderUuid=user_info.uuid,
+                    senderName=user_info.name,
+                    receiverUuid=receiver['uuid'],
+                    receiverName=receiver['name'],
+                    totalMessage=0,
+                    createdAt=int(datetime.now(pytz.timezone('Asia/Ho_Chi_Minh')).timestamp()),
+                    lastActive=int(datetime.now(pytz.timezone('Asia/Ho_Chi_Minh')).timestamp()))
+
+    @staticmethod
+    def new_message(conversation_id: int, user_info: InfoUser, receiver: dict, content: str) -> dict:
+        return dict(conversationId=conversation_id,
+                    senderUuid=user_info.uuid,
+                    receiverUuid=receiver['uuid'],
+                    receiverName=receiver['name'],
+                    content=content,
+                    sendAt=int(datetime.now(pytz.timezone('Asia/Ho_Chi_Minh')).timestamp()),
+                    isSeen=False)
+
+    @staticmethod
+    def conversation_update(message: dict) -> dict:
+        return {'$set': {'lastActive': message['sendAt'], 'lastMessage': BaseUserService.last_message(message)},
+                '$inc': {'totalMessage': 1}}
+
+    # Concurrent sends reach the conversation in any order, lastMessage only moves forward on (sendAt, _id)
+    # like the message pages do, sendAt being whole seconds the _id breaks the ties
+    @staticmethod
+    def newer_message_query(conversation_id: int, message: dict) -> dict:
+        return {'id': conversation_id,
+                '$or': [{'lastMessage': {'$exists': False}},
+                        {'lastMessage.sendAt': {'$lt': message['sendAt']}},
+                        {'lastMessage.sendAt': message['sendAt'],
+                         'lastMessage.messageId': {'$not': {'$gte': message['_id']}}}]}
+
+    @staticmethod
+    def message_count_update() -> dict:
+        return {'$inc': {'totalMessage': 1}}
+
+    @staticmethod
+    def unseen_query(conversation_id: int, user_uuid: str) -> dict:
+        return {'conversationId': conversation_id, 'receiverUuid': user_uuid, 'isSeen': False}
+
+    @staticmethod
+    def access_error(conversation: dict, user_info: InfoUser) -> Optional[JSONResponse]:
+        if conversation['senderUuid'] != user_info.uuid and conversation['receiverUuid'] != user_info.uuid:
+            return JSONResponse(status_code=400, content={'message': 'Không có quyền truy cập'})
+        return None
+
+    # Messages are paged on (sendAt, _id), a cursor is '<sendAt>_<_id>' of a message
+    @staticmethod
+    def message_cursor(message: dict):
+        return '{}_{}'.format(message['sendAt'], message['_id'])
+
+    @staticmethod
+    def page_query(conversation_id: int, before: str = None, after: str = None):
+        query = {'conversationId': conversation_id}
+        cursor, operator, direction = before, '$lt', -1
+        if before is None and after is not None:
+            cursor, operator, direction = after, '$gt', 1
+        if cursor is not None:
+            send_at, _, object_id = cursor.partition('_')
+            try:
+                send_at, object_id = int(send_at), ObjectId(object_id)
+            except (ValueError, InvalidId):
+                raise ValueError('Invalid cursor')
+            query['$or'] = [{'sendAt': {operator: send_at}},
+                            {'sendAt': send_at, '_id': {operator: object_id}}]
+        return query, [('sendAt', direction), ('_id', direction)]
+
+    @staticmethod
+    def page_response(messages: list, sort: list, limit: int, after: str = None):
+        if sort[0][1] == 1:
+            messages.reverse()
+        page = dict(messages=messages,
+                    before=BaseUserService.message_cursor(messages[-1]) if len(messages) == limit else None,
+                    after=BaseUserService.message_cursor(messages[0]) if messages else after)
+        for message in messages:
+            del message['_id']
+        return page
+
+    @staticmethod
+    def conversation_page(user_info: InfoUser, page: dict) -> dict:
+        return dict(userUuid=user_info.uuid,
+                    messages=page['messages'],
+                    before=page['before'],
+                    after=page['after'])
+
+    @staticmethod
+    def last_message(message: dict):
+        return dict(messageId=message.get('_id'),
+                    senderUuid=message['senderUuid'],
+                    content=message['content'],
+                    sendAt=message['sendAt'],
+                    isSeen=message['isSeen'])
+
+    @staticmethod
+    def inbox_query(user_uuid: str):
+        return {'$or': [{'senderUuid': user_uuid}, {'receiverUuid': user_uuid}]}
+
+    @staticmethod
+    def conversation_item(user_uuid: str, con: dict, last_message: dict):
+        return dict(conversationId=con['id'],
+                    partnerUuid=con['senderUuid'] if user_uuid != con['senderUuid'] else con['receiverUuid'],
+                    partnerName=con['senderName'] if user_uuid != con['senderUuid'] else con['receiverName'],
+                    lastActive=last_message['sendAt'],
+                    last_message=last_message['content'],
+                    isSeenLastMessage=last_message['isSeen'] if user_uuid != last_message['senderUuid'] else True)
+
+
+@inject
+@singleton
+@timed_methods
+class UserService(BaseUserService):
+
+    def __init__(self, mongo: MongoClient, config: Config, redis: Redis, async_redis: AsyncRedis,
+                 bus: InvalidationBus, token_refresher: TokenRefresher, id_allocator: IdAllocator,
+                 cache: CacheInterceptor) -> None:
+        super().__init__(config, redis, async_redis, bus, token_refresher, id_allocator, cache)
+        self.mongo: MongoClient = mongo
+
+    def invalidate_token(self, ac_token: str):
+        self.token_cache.invalidate(keys=[ac_token])
+
+    def invalidate_user(self, user_uuid: str):
+        self.token_cache.invalidate(tags=[self.user_tag(user_uuid)])
+
+    def get_token(self, ac_token):
         try:
             token = list(self.mongo[self.token].find({'key': ac_token}, {'_id': 0}).limit(1))[0]
             if self.check_day(token['__expiredAt'], datetime.now()):
-                self.mongo[self.token].update_one({'key': ac_token}, {
-                    '$set': {'__expiredAt': datetime.now(pytz.timezone("Asia/Ho_Chi_Minh")) + timedelta(7)}})
-            return token['userUuid']
+                token['__expiredAt'] = self.token_refresher.touch(ac_token)
+            return token
         except IndexError:
             return None
 
+    def check_ac_token(self, ac_token):
+        token = self.get_token(ac_token)
+        if token is None:
+            return None
+        return token['userUuid']
+
     def check_rf_token(self, rf_token):
         try:
             user = list(self.mongo[self.rf_token].find({'key': rf_token}, {'_id': 0}).limit(1))[0]
@@ -68,14 +335,22 @@ class UserService:
         except IndexError:
             return False
 
+    @request_scoped
     def get_user(self, ac_token):
         if ac_token is None:
             raise NotFoundException(404, "Token not found")
-        user_uuid = self.check_ac_token(ac_token)
-        if user_uuid is None:
+        user = self.cached_user(self.token_cache.get(ac_token))
+        if user is not None:
+            return user
+        fill = self.token_cache.begin_fill()
+        token = self.get_token(ac_token)
+        if token is None:
+            self.invalidate_token(ac_token)
             raise NotFoundException(404, "User not found")
-        user = list(self.mongo[self.user].find({'uuid': user_uuid}, {'_id': 0}).limit(1))[0]
-        return InfoUser.info_user(user)
+        user = list(self.mongo[self.user].find({'uuid': token['userUuid']}, {'_id': 0}).limit(1))[0]
+        user = InfoUser.info_user(user)
+        self.token_cache.set(ac_token, (user, token['__expiredAt']), fill, tags=[self.user_tag(user.uuid)])
+        return replace(user, courses=list(user.courses))
 
     def update_user(self, ac_token, user: UserUpdate):
         if ac_token is None:
@@ -83,17 +358,15 @@ class UserService:
         user_uuid = self.check_ac_token(ac_token)
         if user_uuid is None:
             return JSONResponse(status_code=401, content={'message': 'Invalid Token'})
-        value = dict(user)
-        for k, v in value.items():
-            if value[k] is None:
-                return JSONResponse(status_code=400, content={'message': 'Mục {} không được để trống'.format(k)})
-        value['answer'] = hashlib.md5(value['answer'].encode()).hexdigest()
-        query = {'uuid': user_uuid}
-        self.mongo[self.user].update_one(query, {'$set': value})
+        error = self.missing_field(dict(user))
+        if error is not None:
+            return error
+        self.mongo[self.user].update_one({'uuid': user_uuid}, {'$set': self.user_update(user)})
+        self.invalidate_user(user_uuid)
         return JSONResponse(status_code=400, content={'message': 'Cập nhật thành công'})
 
     def user_login(self, user_login: UserLogin):
-        data = self.get_ac_token(user_login.userName, hashlib.md5(user_login.password.encode()).hexdigest())
+        data = self.get_ac_token(user_login.userName, self.digest(user_login.password))
         if not data:
             return JSONResponse(status_code=401, content={'message': 'Sai tên đăng nhập hoặc mật khẩu'})
         if data['key'] is not None:
@@ -105,33 +378,17 @@ class UserService:
             # return JSONResponse(status_code=201, content={
             #     'message': 'Có một thiết bị khác đang đăng nhập. Bạn có muốn đăng xuất khỏi thiết bị đó ?'},
             #                     headers={'rf_token': rf_token})
-            return JSONResponse(status_code=200, content={'message': 'Đăng nhập thành công'},
-                                headers={'token': data['key']})
-
-        letters = string.ascii_letters
-        ac_token = ''.join(random.choice(letters) for i in range(50))
-        self.mongo[self.token].insert(
-            {'userUuid': data['userUuid'], 'key': ac_token,
-             '__expiredAt': datetime.now(pytz.timezone("Asia/Ho_Chi_Minh")) + timedelta(7)})
-        return JSONResponse(status_code=200, content={'message': 'Đăng nhập thành công'}, headers={'token': ac_token})
+            return self.login_response(data['key'])
+        token = self.new_token(data['userUuid'])
+        self.mongo[self.token].insert(token)
+        return self.login_response(token['key'])
 
     def add_user(self, user: User):
-        value = dict(user)
-        for k, v in value.items():
-            if value[k] is None:
-                return JSONResponse(status_code=400, content={'message': 'Mục {} không được để trống'.format(k)})
+        error = self.missing_field(dict(user))
+        if error is not None:
+            return error
         try:
-            user_id = list(self.mongo[self.user].find({}).sort('id', -1).limit(1))[0]['id'] + 1
-        except IndexError:
-            user_id = 1
-        value['id'] = user_id
-        value['uuid'] = uuid.uuid4().__str__()
-        value['courses'] = []
-        value['password'] = hashlib.md5(value['password'].encode()).hexdigest()
-        value['answer'] = hashlib.md5(value['answer'].encode()).hexdigest()
-        value['conversations'] = list()
-        try:
-            self.mongo[self.user].insert(value)
+            self.mongo[self.user].insert(self.new_user(user, self.id_allocator.next_id(self.user)))
             return JSONResponse(status_code=200, content={'message': 'Đăng ký thành công'})
         except errors.DuplicateKeyError:
             return JSONResponse(status_code=400, content={'message': 'Tài khoản đã tồn tại'})
@@ -143,6 +400,7 @@ class UserService:
         if token is None:
             return JSONResponse(status_code=401, content={'message': 'Invalid Token'})
         self.mongo[self.token].delete_one({'key': ac_token})
+        self.invalidate_token(ac_token)
         return JSONResponse(status_code=200, content={'message': 'Đã log out'})
 
     def refresh_user(self, rf_token):
@@ -153,131 +411,117 @@ class UserService:
             return JSONResponse(status_code=400)
         self.mongo[self.rf_token].delete_many({'key': rf_token})
         self.mongo[self.token].delete_many({'userUuid': user_uuid})
+        self.invalidate_user(user_uuid)
         return JSONResponse(status_code=200, content={'message': 'Đã đăng xuất khỏi tất các thiết bị'})
 
     def user_forget(self, user_forget: UserForget):
-        temp = user_forget
-        value = dict(temp)
-        for k, v in value.items():
-            if value[k] is None:
-                return JSONResponse(status_code=400, content={'message': 'Mục {} không được để trống'.format(k)})
+        error = self.missing_field(dict(user_forget))
+        if error is not None:
+            return error
         try:
             user = list(self.mongo[self.user].find({'userName': user_forget.userName}, {'_id': 0}).limit(1))[0]
-
-            if user['questionRecovery'] != user_forget.questionRecovery:
-                return JSONResponse(status_code=400, content={'message': 'Sai Câu Hỏi'})
-            if user['answer'] != hashlib.md5(user_forget.answer.encode()).hexdigest():
-                return JSONResponse(status_code=400, content={'message': 'Câu trả lời không chính xác !'})
-            self.mongo[self.user].update({'id': user['id']},
-                                         {'$set': {
-                                             'password': hashlib.md5(user_forget.newPassword.encode()).hexdigest()}})
-            self.mongo[self.rf_token].delete_many({'userUuid': user['uuid']})
-            self.mongo[self.token].delete_many({'userUuid': user['uuid']})
-            return JSONResponse(status_code=200, content={'message': 'Cập nhật thành công !'})
         except IndexError:
             return JSONResponse(status_code=404, content={'message': 'Not Found User'})
+        error = self.recovery_error(user, user_forget)
+        if error is not None:
+            return error
+        self.mongo[self.user].update({'id': user['id']}, {'$set': {'password': self.digest(user_forget.newPassword)}})
+        self.mongo[self.rf_token].delete_many({'userUuid': user['uuid']})
+        self.mongo[self.token].delete_many({'userUuid': user['uuid']})
+        self.invalidate_user(user['uuid'])
+        return JSONResponse(status_code=200, content={'message': 'Cập nhật thành công !'})
+
+    def checkin_key(self, ac_token: str):
+        """Key signing the offline checkins of the user, see ``ClassService.bulk_checkin``."""
+        error = self.signing_error()
+        if error is not None:
+            return error
+        return self.signing_key(self.get_user(ac_token))
 
     def user_join_class(self, data: UserJoin, ac_token: str):
         user = self.get_user(ac_token)
         try:
-            course = list(self.mongo[self.courses].find(
-                {'classCode': data.classCode, 'classKey': hashlib.md5(data.classKey.encode()).hexdigest()},
-                {'_id': 0}))[0]
-            user_courses = user.courses
-            if course['uuid'] in user_courses:
-                return JSONResponse(status_code=422, content={'message': "Đã tham gia"})
-
-            user_courses.append(course['uuid'])
-            self.mongo[self.user].update_one({'id': user.id}, {'$set': {'courses': user_courses}})
-
-            members = course['members']
-            member = dict(id=user.id, name=user.name)
-            members.append(member)
-            self.mongo[self.courses].update_one({'id': course['id']}, {'$set': {'members': members,
-                                                                                'quantity': course['quantity'] + 1}})
-
-            return JSONResponse(status_code=200, content={'message': 'Thành công'})
+            course = list(self.mongo[self.courses].find(self.join_query(data), {'_id': 0, 'id': 1, 'uuid': 1})
+                          .limit(1))[0]
         except IndexError:
             return JSONResponse(status_code=422, content={'message': "Sai Key hoặc mã lớp"})
+        if course['uuid'] in user.courses:
+            return JSONResponse(status_code=422, content={'message': "Đã tham gia"})
 
-    def send_message(self, data: SendMessage, ac_token: str):
+        joined = MongoUtils.push_unique(self.mongo[self.user], {'id': user.id}, 'courses', course['uuid'])
+        self.invalidate_user(user.uuid)
+        if joined is None:
+            return JSONResponse(status_code=422, content={'message': "Đã tham gia"})
+
+        MongoUtils.push_unique(self.mongo[self.courses], {'id': course['id']}, 'members',
+                               dict(id=user.id, name=user.name), key='id', counter='quantity')
+        self.cache.evict(keys=['course:' + str(course['id'])])
+
+        return JSONResponse(status_code=200, content={'message': 'Thành công'})
+
+    def send_message(self, data: SendMessage, ac_token: str, limit: int = 50):
         user_info = self.get_user(ac_token)
         if data.userNameReceive is None and data.userUuidReceive is None:
             return JSONResponse(status_code=400,
                                 content={'message': 'Just userNameReceive or userUuidReceive need field'})
         try:
-            if data.userUuidReceive is None:
-                receiver = list(self.mongo[self.user].find({'userName': data.userNameReceive}, {'_id': 0}))[0]
-            else:
-                receiver = list(self.mongo[self.user].find({'uuid': data.userUuidReceive}, {'_id': 0}))[0]
+            receiver = list(self.mongo[self.user].find(self.receiver_query(data), {'_id': 0}).limit(1))[0]
         except IndexError:
             raise NotFoundException(404, 'Không tìm thấy người nhận')
-        query = {'senderUuid': {'$in': [user_info.uuid, receiver['uuid']]},
-                 'receiverUuid': {'$in': [user_info.uuid, receiver['uuid']]}}
         try:
-            conversation = list(self.mongo[self.conversation].find(query, {'_id': 0}).limit(1))[0]
+            conversation = list(self.mongo[self.conversation].find(
+                self.conversation_query(user_info.uuid, receiver['uuid']), {'_id': 0}).limit(1))[0]
         except IndexError:
-            conversation = None
-        if conversation is None:
-            try:
-                con_id = list(self.mongo[self.conversation].find({}).sort('id', -1).limit(1))[0]['id'] + 1
-            except IndexError:
-                con_id = 1
-            conversation = dict(id=con_id,
-                                senderUuid=user_info.uuid,
-                                senderName=user_info.name,
-                                receiverUuid=receiver['uuid'],
-                                receiverName=receiver['name'],
-                                totalMessage=0,
-                                createdAt=int(datetime.now(pytz.timezone('Asia/Ho_Chi_Minh')).timestamp()),
-                                lastActive=int(datetime.now(pytz.timezone('Asia/Ho_Chi_Minh')).timestamp()))
+            conversation = self.new_conversation(self.id_allocator.next_id(self.conversation), user_info, receiver)
             self.mongo[self.conversation].insert(conversation)
-        message = dict(conversationId=conversation['id'],
-                       senderUuid=user_info.uuid,
-                       receiverUuid=receiver['uuid'],
-                       receiverName=receiver['name'],
-                       content=data.content,
-                       sendAt=int(datetime.now(pytz.timezone('Asia/Ho_Chi_Minh')).timestamp()),
-                       isSeen=False)
+        message = self.new_message(conversation['id'], user_info, receiver, data.content)
         self.mongo[self.message].insert(message)
-        self.mongo[self.conversation].update_one({'id': conversation['id']},
-                                                 {'$set': {'lastActive': message['sendAt'],
-                                                           'totalMessage': conversation['totalMessage'] + 1}})
+        result = self.mongo[self.conversation].update_one(self.newer_message_query(conversation['id'], message),
+                                                          self.conversation_update(message))
+        if result.matched_count == 0:
+            # A newer message is already the last one, only count this one
+            self.mongo[self.conversation].update_one({'id': conversation['id']}, self.message_count_update())
 
-        self.mongo[self.message].find_and_modify(query={'conversationId': conversation['id'],
-                                                        'receiverUuid': user_info.uuid, 'isSeen': False},
+        self.mongo[self.message].find_and_modify(query=self.unseen_query(conversation['id'], user_info.uuid),
                                                  update={'$set': {'isSeen': True}})
-        response = list(self.mongo[self.message].find({'conversationId': conversation['id']},
-                                                      {'_id': 0, 'senderUuid': 1, 'content': 1, 'sendAt': 1})
-                        .sort('sendAt', -1))
-        return response
+        return self.message_page(conversation['id'], limit=limit)['messages']
 
-    def list_conversation(self, ac_token):
+    def message_page(self, conversation_id: int, before: str = None, after: str = None, limit: int = 50):
+        query, sort = self.page_query(conversation_id, before, after)
+        messages = list(self.mongo[self.message].find(query, {'senderUuid': 1, 'content': 1, 'sendAt': 1})
+                        .sort(sort).limit(limit))
+        return self.page_response(messages, sort, limit, after)
+
+    # Conversations written before lastMessage was denormalized
+    def backfill_last_message(self, con: dict):
+        try:
+            message = list(self.mongo[self.message].find({'conversationId': con['id']})
+                           .sort([('sendAt', -1), ('_id', -1)]).limit(1))[0]
+        except IndexError:
+            return None
+        last_message = self.last_message(message)
+        self.mongo[self.conversation].update_one({'id': con['id'], 'lastMessage': {'$exists': False}},
+                                                 {'$set': {'lastMessage': last_message}})
+        return last_message
+
+    def list_conversation(self, ac_token, offset: int = 0, limit: int = 50):
         user_info = self.get_user(ac_token)
-        query_1 = {'senderUuid': user_info.uuid}
-        query_2 = {'receiverUuid': user_info.uuid}
-        list_1 = list(self.mongo[self.conversation].find(query_1, {'_id': 0}).sort('lastActive', -1))
-        list_2 = list(self.mongo[self.conversation].find(query_2, {'_id': 0}).sort('lastActive', -1))
-        conversations = list_1 + list_2
-        conversations.sort(key=lambda x: x['lastActive'], reverse=True)
+        conversations = self.mongo[self.conversation].find(self.inbox_query(user_info.uuid), {'_id': 0}) \
+            .sort('lastActive', -1).skip(offset).limit(limit)
         response = dict(total=0,
                         conversations=list())
         for con in conversations:
-            last_message = list(self.mongo[self.message].find({'conversationId': con['id']}, {'_id': 0})
-                                .sort('sendAt', -1).limit(1))[0]
-            response['conversations'].append(dict(conversationId=con['id'],
-                                                  partnerUuid=con['senderUuid']
-                                                  if user_info.uuid != con['senderUuid'] else con['receiverUuid'],
-                                                  partnerName=con['senderName']
-                                                  if user_info.uuid != con['senderUuid'] else con['receiverName'],
-                                                  lastActive=last_message['sendAt'],
-                                                  last_message=last_message['content'],
-                                                  isSeenLastMessage=last_message['isSeen']
-                                                  if user_info.uuid != last_message['senderUuid'] else True))
-        response['total'] = len(response['conversations'])
+            last_message = con.get('lastMessage') or self.backfill_last_message(con)
+            if last_message is None:
+                continue
+            response['conversations'].append(self.conversation_item(user_info.uuid, con, last_message))
+        # Every conversation of the inbox, the page only holds up to limit of them
+        response['total'] = self.mongo[self.conversation].count_documents(
+            self.inbox_query(user_info.uuid))
         return response
 
-    def get_conversation_info(self, conversation_id: int, ac_token):
+    def get_conversation_info(self, conversation_id: int, ac_token, before: str = None, after: str = None,
+                              limit: int = 50):
         try:
             conversation = list(self.mongo[self.conversation].find({'id': conversation_id}, {'_id': 0})
                                 .limit(1))[0]
@@ -285,16 +529,17 @@ class UserService:
             raise NotFoundException(404, 'Conversation Not Found')
 
         user_info = self.get_user(ac_token)
-        if conversation['senderUuid'] != user_info.uuid and conversation['receiverUuid'] != user_info.uuid:
-            return JSONResponse(status_code=400, content={'message': 'Không có quyền truy cập'})
+        error = self.access_error(conversation, user_info)
+        if error is not None:
+            return error
 
-        self.mongo[self.message].find_and_modify(query={'conversationId': conversation_id,
-                                                        'receiverUuid': user_info.uuid, 'isSeen': False},
+        self.mongo[self.message].find_and_modify(query=self.unseen_query(conversation_id, user_info.uuid),
                                                  update={'$set': {'isSeen': True}})
-        response = dict(userUuid=user_info.uuid,
-                        messages=list())
-        response['messages'] = list(self.mongo[self.message].find({'conversationId': conversation_id},
-                                                                  {'_id': 0, 'senderUuid': 1, 'content': 1,
-                                                                   'sendAt': 1})
-                                    .sort('sendAt', -1))
-        return response
+        self.mongo[self.conversation].update_one({'id': conversation_id,
+                                                  'lastMessage.senderUuid': {'$ne': user_info.uuid}},
+                                                 {'$set': {'lastMessage.isSeen': True}})
+        try:
+            page = self.message_page(conversation_id, before, after, limit)
+        except ValueError as ex:
+            return JSONResponse(status_code=400, content={'message': str(ex)})
+        return self.conversation_page(user_info, page)
@@ -0,0 +1,130 @@
+import asyncio
+
+import fakeredis
+import pytest
+from starlette.config import Config
+
+from common.admission import AdmissionController, admission
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def limiter(server, enabled: bool = True, **rule):
+    controller = AdmissionController(fakeredis.FakeAsyncRedis(server=server),
+                                     Config(environ={'ADMISSION_ENABLED': str(enabled).lower()}))
+
+    @admission(**rule)
+    def route():
+        pass
+
+    return controller.limiter('/route', route)
+
+
+def enter(route_limiter, times: int, ac_token: str = None):
+    async def run():
+        return [await route_limiter.enter_async(ac_token) for _ in range(times)]
+
+    return asyncio.run(run())
+
+
+def statuses(responses):
+    return [None if response is None else response.status_code for response in responses]
+
+
+def test_burst_is_admitted_then_throttled(server):
+    route_limiter = limiter(server, rate=2, burst=3)
+    responses = enter(route_limiter, 4)
+    assert statuses(responses) == [None, None, None, 429]
+    assert responses[-1].headers['Retry-After'] == '1'
+    assert route_limiter.controller.metrics()['throttled'] == 1
+
+
+def test_bucket_refills_at_rate(server):
+    route_limiter = limiter(server, rate=2, burst=5)
+    assert statuses(enter(route_limiter, 6)) == [None] * 5 + [429]
+    # One second later two tokens are back
+    redis = fakeredis.FakeRedis(server=server)
+    redis.hset('admission:/route', 'ts', int(redis.hget('admission:/route', 'ts')) - 1000)
+    assert statuses(enter(route_limiter, 3)) == [None, None, 429]
+
+
+def test_refill_is_capped_by_burst(server):
+    route_limiter = limiter(server, rate=2, burst=2)
+    enter(route_limiter, 2)
+    redis = fakeredis.FakeRedis(server=server)
+    redis.hset('admission:/route', 'ts', int(redis.hget('admission:/route', 'ts')) - 60000)
+    assert statuses(enter(route_limiter, 3)) == [None, None, 429]
+
+
+def test_user_buckets_are_separate(server):
+    route_limiter = limiter(server, rate=100, user_rate=1)
+    assert statuses(enter(route_limiter, 2, 'a' * 50)) == [None, 429]
+    assert statuses(enter(route_limiter, 1, 'b' * 50)) == [None]
+
+
+def test_rejected_request_takes_no_token(server):
+    route_limiter = limiter(server, rate=100, burst=10, user_rate=1)
+    enter(route_limiter, 3, 'a' * 50)
+    tokens = float(fakeredis.FakeRedis(server=server).hget('admission:/route', 'tokens'))
+    # Only the admitted request took a route token, refill adds at most a few
+    assert 9 <= tokens < 10
+
+
+def test_concurrency_limit(server):
+    route_limiter = limiter(server, concurrency=1)
+    first, second = enter(route_limiter, 2)
+    assert first is None
+    assert second.status_code == 503
+    route_limiter.exit()
+    assert enter(route_limiter, 1) == [None]
+
+
+def test_throttled_request_releases_its_slot(server):
+    route_limiter = limiter(server, rate=1, concurrency=2)
+    enter(route_limiter, 2)
+    assert route_limiter.in_flight == 1
+
+
+def test_failed_admission_releases_its_slot(server):
+    route_limiter = limiter(server, rate=1, concurrency=1)
+
+    async def fail(**kwargs):
+        raise ValueError('not a redis error')
+
+    route_limiter.controller.take_async = fail
+    with pytest.raises(ValueError):
+        enter(route_limiter, 1)
+    assert route_limiter.in_flight == 0
+
+
+def test_cancelled_admission_releases_its_slot(server):
+    route_limiter = limiter(server, rate=1, concurrency=1)
+    started = asyncio.Event()
+
+    async def hang(**kwargs):
+        started.set()
+        await asyncio.sleep(60)
+
+    async def run():
+        route_limiter.controller.take_async = hang
+        task = asyncio.ensure_future(route_limiter.enter_async())
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert route_limiter.in_flight == 0
+
+
+def test_redis_error_admits(server):
+    route_limiter = limiter(server, rate=1)
+    server.connected = False
+    assert enter(route_limiter, 3) == [None, None, None]
+
+
+def test_disabled(server):
+    assert limiter(server, enabled=False, rate=1) is None
@@ -0,0 +1,114 @@
+import pytest
+from geopy import distance
+
+from common.signature import checkin_message, derive_key, sign, verify
+from request.course import SignedCheckin
+from response.course import ClassInfo, RollCallInfo
+from service.bulk_checkin import ACCEPTED, summary, validate_checkins
+
+SECRET = 'secret'
+NOW = 1700000600
+LAT, LONG = 21.0285, 105.8542
+
+COURSE = ClassInfo(id=1, uuid='course', classCode='C1', classKey='key', courseName='Math', lecturer='Lecturer',
+                   lecturerId=9, classSize=40, faculty='F', quantity=3, members=[], startAt=1690000000,
+                   expireAt=1710000000, type='t')
+ROLL_CALL = RollCallInfo(id=5, classId=1, startAt=1700000000, expireAt=1700000900, mac='aa:bb',
+                         location=dict(lat=LAT, long=LONG), total=40, count=0, radius=30)
+USERS = {user_id: dict(id=user_id, uuid='user-' + str(user_id), name='Student ' + str(user_id), courses=['course'])
+         for user_id in (1, 2, 3)}
+USERS[4] = dict(id=4, uuid='user-4', name='Outsider', courses=['other'])
+
+
+def checkin(user_id: int, meters: float = 0, mac: str = 'aa:bb', check_at: int = 1700000100, **changes):
+    destination = distance.distance(meters=meters).destination((LAT, LONG), 90)
+    fields = dict(userId=user_id, mac=mac, lat=destination.latitude, long=destination.longitude, checkAt=check_at)
+    message = checkin_message(ROLL_CALL.id, user_id, mac, fields['lat'], fields['long'], check_at)
+    fields['signature'] = sign(derive_key(SECRET, 'user-' + str(user_id)), message)
+    fields.update(changes)
+    return SignedCheckin(**fields)
+
+
+def validate(checkins, checked=(), roll_call=ROLL_CALL, radius=30):
+    return validate_checkins(COURSE, roll_call, radius, checkins, USERS, set(checked), SECRET, NOW, 60)
+
+
+def test_valid_checkin_is_accepted():
+    statuses, docs = validate([checkin(1, meters=10)])
+    assert statuses == [ACCEPTED]
+    index, doc = docs[0]
+    assert index == 0
+    assert (doc['userId'], doc['name'], doc['classId'], doc['rollCallId'], doc['checkAt']) == \
+           (1, 'Student 1', 1, 5, 1700000100)
+
+
+@pytest.mark.parametrize('item', [
+    checkin(1, signature='0' * 64),
+    checkin(1, signature=''),
+    # Signed for another position
+    checkin(1, lat=LAT + 0.001),
+    # Signed with the key of another student
+    checkin(2, userId=1),
+    # Not a student of the batch
+    checkin(8),
+])
+def test_bad_signature_is_rejected(item):
+    assert validate([item])[0] == ['invalid_signature']
+
+
+@pytest.mark.parametrize('item, status', [
+    (checkin(4), 'not_member'),
+    (checkin(1, check_at=1699999999), 'not_started'),
+    (checkin(1, check_at=1700000901), 'expired'),
+    (checkin(1, mac='cc:dd'), 'mac'),
+    (checkin(1, meters=40), 'location'),
+])
+def test_rejection(item, status):
+    statuses, docs = validate([item])
+    assert statuses == [status]
+    assert docs == []
+
+
+def test_checkin_after_now_plus_the_clock_skew_is_expired():
+    roll_call = RollCallInfo(**dict(vars(ROLL_CALL), expireAt=NOW + 3600))
+    assert validate([checkin(1, check_at=NOW + 60)], roll_call=roll_call)[0] == [ACCEPTED]
+    assert validate([checkin(1, check_at=NOW + 61)], roll_call=roll_call)[0] == ['expired']
+
+
+def test_duplicates_in_the_batch_and_already_checked_in():
+    statuses, docs = validate([checkin(1), checkin(1, meters=5), checkin(2)], checked=[2])
+    assert statuses == [ACCEPTED, 'duplicate', 'duplicate']
+    assert [index for index, _ in docs] == [0]
+
+
+def test_default_radius_applies_without_a_roll_call_radius():
+    roll_call = RollCallInfo(**dict(vars(ROLL_CALL), radius=None))
+    assert validate([checkin(1, meters=40)], roll_call=roll_call, radius=50)[0] == [ACCEPTED]
+    assert validate([checkin(1, meters=40)], roll_call=roll_call, radius=30)[0] == ['location']
+
+
+def test_summary():
+    checkins = [checkin(1), checkin(4), checkin(2, meters=40)]
+    statuses, _ = validate(checkins)
+    assert summary(checkins, statuses) == dict(accepted=1, rejected=2,
+                                               results=[dict(userId=1, status=ACCEPTED),
+                                                        dict(userId=4, status='not_member'),
+                                                        dict(userId=2, status='location')])
+
+
+def test_keys_are_derived_per_user():
+    assert derive_key(SECRET, 'user-1') != derive_key(SECRET, 'user-2')
+    assert derive_key(SECRET, 'user-1') != derive_key('other', 'user-1')
+
+
+def test_message_rounds_coordinates_and_the_time():
+    assert checkin_message(5, 1, 'aa:bb', 21.02850001, 105.8542, 1700000100.9) == \
+           b'5:1:aa:bb:21.028500:105.854200:1700000100'
+
+
+def test_verify():
+    key = derive_key(SECRET, 'user-1')
+    message = checkin_message(5, 1, 'aa:bb', LAT, LONG, 1700000100)
+    assert verify(key, message, sign(key, message))
+    assert not verify(key, message + b'0', sign(key, message))
+    assert not verify(key, message, None)
@@ -0,0 +1,166 @@
+import asyncio
+import inspect
+
+import fakeredis
+import pytest
+from starlette.config import Config
+from starlette.responses import JSONResponse
+
+from common.cache import CacheEvictInterceptor, CacheInterceptor, CachePutInterceptor, cache, cache_evict, \
+    cache_put
+from common.tiered_cache import InvalidationBus
+from common.utils import InjectorUtils
+
+COURSE = dict(key='course:{class_id}', tags=['course:{class_id}', 'lecturer:{lecturer_id}'], ttl=60)
+
+
+class Courses:
+    def __init__(self) -> None:
+        super().__init__()
+        self.names = {1: 'math', 2: 'physics', 3: 'history'}
+        self.loads = 0
+        self.on_load = None
+
+    @cache(**COURSE)
+    def get_course(self, class_id: int, lecturer_id: int):
+        self.loads += 1
+        name = self.names[class_id]
+        if self.on_load is not None:
+            self.on_load()
+        return name
+
+    @cache_put(**COURSE)
+    def rename(self, class_id: int, lecturer_id: int, name: str):
+        self.names[class_id] = name
+        return name
+
+    @cache_evict(keys=['course:{class_id}'])
+    def update_course(self, class_id: int, name: str):
+        self.names[class_id] = name
+        return dict(id=class_id)
+
+    @cache_evict(tags=['lecturer:{lecturer_id}'])
+    def update_lecturer(self, lecturer_id: int, fail: bool = False):
+        if fail:
+            return JSONResponse(status_code=403, content={'message': 'Forbidden'})
+        for class_id in self.names:
+            self.names[class_id] += '*'
+        return dict(id=lecturer_id)
+
+
+class AsyncCourses:
+    def __init__(self) -> None:
+        super().__init__()
+        self.names = {1: 'math'}
+        self.loads = 0
+
+    @cache(**COURSE)
+    async def get_course(self, class_id: int, lecturer_id: int):
+        self.loads += 1
+        return self.names[class_id]
+
+    @cache_evict(tags=['lecturer:{lecturer_id}'])
+    async def update_lecturer(self, lecturer_id: int):
+        self.names[1] += '*'
+        return dict(id=lecturer_id)
+
+
+@pytest.fixture
+def redis():
+    server = fakeredis.FakeServer()
+    return fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server)
+
+
+@pytest.fixture
+def interceptor(redis):
+    bus = InvalidationBus(*redis)
+    return CacheInterceptor(*redis, bus, Config(environ={}))
+
+
+def intercepted(service, interceptor: CacheInterceptor):
+    # Same composition as the injector, in the order of InterceptorProvider
+    interceptors = [interceptor, CacheEvictInterceptor(interceptor), CachePutInterceptor(interceptor)]
+    for name, fn in inspect.getmembers(type(service), lambda member: hasattr(member, '__pointcuts__')):
+        matched = [item for item in interceptors if item.pointcut in fn.__pointcuts__ and item.intercepts(fn)]
+        setattr(service, name, InjectorUtils.create_method_proxy(getattr(service, name), matched))
+    return service
+
+
+@pytest.fixture
+def courses(interceptor):
+    return intercepted(Courses(), interceptor)
+
+
+def test_hit_skips_the_call(courses, redis):
+    assert courses.get_course(1, 7) == 'math'
+    assert courses.get_course(1, 7) == 'math'
+    assert courses.loads == 1
+    assert redis[0].sismember('cache:tag:lecturer:7', 'cache:course:1')
+
+
+def test_evict_by_key(courses):
+    courses.get_course(1, 7)
+    courses.get_course(2, 7)
+    courses.update_course(1, 'algebra')
+    assert courses.get_course(1, 7) == 'algebra'
+    assert courses.get_course(2, 7) == 'physics'
+    assert courses.loads == 3
+
+
+def test_evict_by_tag_drops_every_tagged_entry(courses, redis):
+    courses.get_course(1, 7)
+    courses.get_course(2, 7)
+    courses.get_course(3, 8)
+    courses.update_lecturer(7)
+    assert redis[0].exists('cache:course:1', 'cache:course:2', 'cache:tag:lecturer:7') == 0
+    assert courses.get_course(1, 7) == 'math*'
+    assert courses.get_course(2, 7) == 'physics*'
+    # Not tagged with lecturer 7, still cached
+    assert courses.get_course(3, 8) == 'history'
+    assert courses.loads == 5
+
+
+def test_error_response_doesnt_evict(courses):
+    courses.get_course(1, 7)
+    courses.update_lecturer(7, fail=True)
+    assert courses.get_course(1, 7) == 'math'
+    assert courses.loads == 1
+
+
+def test_put_overwrites_the_entry(courses):
+    courses.get_course(1, 7)
+    assert courses.rename(1, 7, 'algebra') == 'algebra'
+    assert courses.get_course(1, 7) == 'algebra'
+    assert courses.loads == 1
+
+
+def test_put_entry_is_tagged(courses):
+    courses.rename(1, 7, 'algebra')
+    courses.update_lecturer(7)
+    assert courses.get_course(1, 7) == 'algebra*'
+
+
+def test_miss_evicted_while_loading_isnt_stored(courses, redis):
+    def evicted():
+        courses.on_load = None
+        courses.update_lecturer(7)
+
+    courses.on_load = evicted
+    # Read before the eviction, returned to the caller but not cached
+    assert courses.get_course(1, 7) == 'math'
+    assert redis[0].get('cache:course:1') is None
+    assert courses.get_course(1, 7) == 'math*'
+    assert redis[0].get('cache:course:1') is not None
+
+
+def test_async_evict_by_tag(interceptor):
+    courses = intercepted(AsyncCourses(), interceptor)
+
+    async def run():
+        assert await courses.get_course(1, 7) == 'math'
+        assert await courses.get_course(1, 7) == 'math'
+        await courses.update_lecturer(7)
+        assert await courses.get_course(1, 7) == 'math*'
+
+    asyncio.run(run())
+    assert courses.loads == 2
@@ -0,0 +1,58 @@
+import concurrent.futures
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+from starlette.config import Config
+
+from service.checkin_ingestor import BaseCheckinIngestor
+from service.course import BaseClassService
+
+DOCS = [dict(userId=user_id, rollCallId=roll_call_id) for user_id, roll_call_id in [(1, 10), (2, 10), (3, 11), (4, 11)]]
+
+
+def bulk_write_error(*write_errors):
+    return BulkWriteError(dict(writeErrors=[dict(index=index, code=code, errmsg='error ' + str(code))
+                                            for index, code in write_errors]))
+
+
+def test_every_checkin_is_inserted_without_error():
+    assert BaseCheckinIngestor._results(DOCS, None) == [(True, None)] * 4
+
+
+def test_duplicates_are_not_errors():
+    results = BaseCheckinIngestor._results(DOCS, bulk_write_error((1, 11000), (3, 11000)))
+    assert results == [(True, None), (False, None), (True, None), (False, None)]
+
+
+def test_other_write_errors_are_reported():
+    results = BaseCheckinIngestor._results(DOCS, bulk_write_error((0, 11000), (2, 121)))
+    assert results[0] == (False, None)
+    assert results[1] == (True, None)
+    inserted, error = results[2]
+    assert not inserted
+    assert isinstance(error, OperationFailure)
+    assert error.code == 121
+
+
+def test_increments_count_inserted_checkins_per_roll_call():
+    ingestor = BaseCheckinIngestor(Config(environ={}))
+    results = BaseCheckinIngestor._results(DOCS, bulk_write_error((1, 11000), (2, 121)))
+    assert ingestor._increments(DOCS, results) == [UpdateOne({'id': 10}, {'$inc': {'count': 1}}),
+                                                   UpdateOne({'id': 11}, {'$inc': {'count': 1}})]
+
+
+def test_metrics_split_inserted_duplicates_and_failures():
+    ingestor = BaseCheckinIngestor(Config(environ={}))
+    ingestor._record(BaseCheckinIngestor._results(DOCS, bulk_write_error((1, 11000), (2, 121))), 0)
+    metrics = ingestor.metrics()
+    assert (metrics['inserted'], metrics['duplicates'], metrics['failures']) == (2, 1, 1)
+
+
+def test_bulk_statuses_of_inserted_duplicate_and_failed_checkins():
+    statuses = ['accepted'] * 5
+    statuses[1] = 'invalid_signature'
+    docs = [(0, DOCS[0]), (2, DOCS[1]), (3, DOCS[2]), (4, DOCS[3])]
+    results = [True, False, concurrent.futures.TimeoutError(), OperationFailure('error', 121)]
+    inserted = BaseClassService.bulk_inserted(statuses, docs, results)
+    assert inserted == [DOCS[0]]
+    assert statuses == ['accepted', 'invalid_signature', 'duplicate', 'failed', 'failed']
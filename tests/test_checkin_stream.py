@@ -0,0 +1,201 @@
+import asyncio
+import json
+import time
+
+import fakeredis
+import pytest
+from starlette.config import Config
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from common.tiered_cache import InvalidationBus
+from service.checkin_stream import CheckinStream
+
+
+@pytest.fixture
+def stream():
+    server = fakeredis.FakeServer()
+    bus = InvalidationBus(fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server))
+    return CheckinStream(bus, Config(environ={'CHECKIN_STREAM_MAX': '1', 'CHECKIN_STREAM_HEARTBEAT': '0.05'}))
+
+
+async def connected():
+    await asyncio.Event().wait()
+
+
+def request() -> Request:
+    return Request({'type': 'http'}, connected)
+
+
+async def snapshot():
+    return dict(rollCallId=1, members=[])
+
+
+async def serve(response, send):
+    await response({'type': 'http'}, connected, send)
+
+
+def checkin(user_id: int, roll_call_id: int = 1) -> dict:
+    return dict(rollCallId=roll_call_id, userId=user_id, name='user ' + str(user_id), checkAt=1)
+
+
+def parse(chunk: str):
+    if chunk.startswith(':'):
+        return 'ping', None
+    event, data = chunk.strip().split('\n')
+    return event[len('event: '):], json.loads(data[len('data: '):])
+
+
+async def following(events):
+    return parse(await asyncio.wait_for(events.__anext__(), 5))
+
+
+async def rest(events):
+    return [parse(chunk) async for chunk in events]
+
+
+def test_slot_is_taken_before_the_stream_starts(stream):
+    first = stream.response(1, time.time() + 60, snapshot, request())
+    second = stream.response(1, time.time() + 60, snapshot, request())
+    assert not isinstance(first, JSONResponse)
+    assert isinstance(second, JSONResponse) and second.status_code == 503
+
+
+def test_stream_never_started_releases_its_slot(stream):
+    response = stream.response(1, time.time() + 60, snapshot, request())
+
+    async def gone(message):
+        raise OSError('client gone')
+
+    with pytest.raises(OSError):
+        asyncio.run(serve(response, gone))
+    assert stream._open == 0
+    assert stream.response(1, time.time() + 60, snapshot, request()).status_code == 200
+
+
+def test_stream_left_in_the_middle_releases_its_slot(stream):
+    response = stream.response(1, time.time() + 60, snapshot, request())
+    sent = []
+
+    async def send(message):
+        if message.get('body', b'').startswith(b': ping'):
+            raise OSError('client gone')
+        sent.append(message)
+
+    with pytest.raises(OSError):
+        asyncio.run(serve(response, send))
+    assert sent[1]['body'].startswith(b'event: snapshot')
+    assert stream._open == 0
+    assert not stream._listeners
+
+
+def test_checkins_fan_out_to_the_streams_of_the_roll_call(stream):
+    async def members():
+        return dict(rollCallId=1, members=[dict(userId=5)])
+
+    async def run():
+        ends_at = time.time() + 60
+        first, second = stream.events(1, ends_at, members, request()), stream.events(1, ends_at, members, request())
+        other = stream.events(2, ends_at, snapshot, request())
+        for events in (first, second, other):
+            assert (await following(events))[0] == 'snapshot'
+        for message in (checkin(5), checkin(7), checkin(7), checkin(8)):
+            stream.on_message(message)
+        received = [[await following(events) for _ in range(2)] for events in (first, second)]
+        idle = await following(other)
+        for events in (first, second, other):
+            await events.aclose()
+        return received, idle
+
+    received, idle = asyncio.run(run())
+    # Already in the snapshot or already sent checkins are skipped
+    expected = [('checkin', dict(checkin(7), count=2)), ('checkin', dict(checkin(8), count=3))]
+    assert received == [expected, expected]
+    assert idle == ('ping', None)
+    assert not stream._listeners
+
+
+def test_stream_ends_with_the_roll_call(stream):
+    async def run():
+        events = stream.events(1, time.time() + 0.2, snapshot, request())
+        assert (await following(events))[0] == 'snapshot'
+        stream.on_message(checkin(7))
+        return await rest(events)
+
+    received = asyncio.run(run())
+    assert received[0] == ('checkin', dict(checkin(7), count=1))
+    assert received[-1] == ('end', dict(rollCallId=1, count=1))
+    assert set(event for event, _ in received[1:-1]) <= {'ping'}
+
+
+def test_updated_roll_call_moves_the_end(stream):
+    async def run():
+        events = stream.events(1, time.time() + 60, snapshot, request())
+        await following(events)
+        stream.on_message(dict(rollCallId=1, expireAt=time.time() + 0.1))
+        return await asyncio.wait_for(rest(events), 5)
+
+    assert asyncio.run(run())[-1] == ('end', dict(rollCallId=1, count=0))
+
+
+def test_ended_roll_call_only_sends_the_final_list(stream):
+    async def members():
+        return dict(rollCallId=1, members=[dict(userId=5), dict(userId=6)])
+
+    received = asyncio.run(rest(stream.events(1, time.time() - 1, members, request())))
+    assert received == [('snapshot', dict(rollCallId=1, members=[dict(userId=5), dict(userId=6)])),
+                        ('end', dict(rollCallId=1, count=2))]
+
+
+def test_missed_checkins_get_a_new_snapshot(stream):
+    loaded = []
+
+    async def members():
+        loaded.append(len(loaded))
+        return dict(rollCallId=1, members=[dict(userId=user_id) for user_id in range(len(loaded))])
+
+    async def run():
+        events = stream.events(1, time.time() + 60, members, request())
+        await following(events)
+        stream.on_message({'all': True})
+        snapshot_event = await following(events)
+        # The members of the new snapshot count as seen
+        stream.on_message(checkin(1))
+        stream.on_message(checkin(2))
+        checkin_event = await following(events)
+        await events.aclose()
+        return snapshot_event, checkin_event
+
+    snapshot_event, checkin_event = asyncio.run(run())
+    assert snapshot_event == ('snapshot', dict(rollCallId=1, members=[dict(userId=0), dict(userId=1)]))
+    assert checkin_event == ('checkin', dict(checkin(2), count=3))
+
+
+def test_checkins_published_on_the_bus_reach_the_streams(stream):
+    async def run():
+        events = stream.events(1, time.time() + 60, snapshot, request())
+        await following(events)
+        # The bus subscribes in the background, republishing is harmless since checkins are sent once
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            await stream.publish_async(checkin(7))
+            event = await following(events)
+            if event[0] == 'checkin':
+                await events.aclose()
+                return event
+        await events.aclose()
+
+    assert asyncio.run(run()) == ('checkin', dict(checkin(7), count=1))
+
+
+def test_finished_stream_releases_its_slot(stream):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(serve(stream.response(1, time.time() - 1, snapshot, request()), send))
+    assert sent[0]['status'] == 200
+    body = b''.join(message.get('body', b'') for message in sent)
+    assert body.endswith(b'event: end\ndata: {"rollCallId": 1, "count": 0}\n\n')
+    assert stream._open == 0
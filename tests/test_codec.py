@@ -0,0 +1,90 @@
+import dataclasses
+import sys
+
+import pytest
+
+from common import codec as codecs
+from common.codec import CodecError, MsgpackCodec, ORJSON, PICKLE, decode, encode
+from response.course import CourseList, RollCallInfo
+
+# msgpack is optional
+TAGGED_CODECS = [ORJSON] + ([MsgpackCodec()] if codecs.msgpack is not None else [])
+CODECS = [PICKLE] + TAGGED_CODECS
+
+
+@dataclasses.dataclass
+class Point:
+    lat: float
+    long: float
+
+
+@dataclasses.dataclass
+class MovedPoint:
+    lat: float
+    long: float
+
+
+ROLL_CALL = RollCallInfo(id=1, classId=2, startAt=10, expireAt=20, mac='aa:bb', location=dict(lat=1.5, long=2.5),
+                         total=30, count=3)
+
+
+@pytest.mark.parametrize('codec', CODECS)
+@pytest.mark.parametrize('fresh_until', [None, 1700000000.5])
+@pytest.mark.parametrize('compress_threshold', [None, 0])
+def test_round_trip(codec, fresh_until, compress_threshold):
+    value = dict(roll_call=ROLL_CALL, courses=CourseList(count=1, courses=[dict(id=1, name='n' * 2000)]))
+    raw = encode(value, codec, fresh_until, version=3, compress_threshold=compress_threshold)
+    assert decode(raw, codec, version=3) == (fresh_until, value)
+
+
+def test_payload_above_the_threshold_is_compressed():
+    value = ['x' * 4096]
+    assert len(encode(value, ORJSON, compress_threshold=1024)) < len(encode(value, ORJSON, compress_threshold=None))
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_other_schema_version_is_rejected(codec):
+    raw = encode(ROLL_CALL, codec, version=1)
+    with pytest.raises(CodecError):
+        decode(raw, codec, version=2)
+
+
+def test_other_codec_is_rejected():
+    raw = encode(ROLL_CALL, PICKLE)
+    with pytest.raises(CodecError):
+        decode(raw, ORJSON)
+
+
+@pytest.mark.parametrize('raw', [b'', b'CC', b'not an envelope at all'])
+def test_garbage_is_rejected(raw):
+    with pytest.raises(CodecError):
+        decode(raw, ORJSON)
+
+
+def test_corrupted_compressed_payload_is_rejected():
+    raw = encode(['x' * 4096], ORJSON, compress_threshold=0)
+    with pytest.raises(CodecError):
+        decode(raw[:-8], ORJSON)
+
+
+@pytest.mark.parametrize('codec', TAGGED_CODECS)
+def test_changed_dataclass_is_rejected(codec, monkeypatch):
+    raw = encode([Point(1.0, 2.0)], codec)
+
+    @dataclasses.dataclass
+    class Point3:
+        lat: float
+        long: float
+        alt: float
+
+    monkeypatch.setattr(sys.modules[__name__], 'Point', Point3)
+    with pytest.raises(CodecError, match='has changed'):
+        decode(raw, codec)
+
+
+@pytest.mark.parametrize('codec', TAGGED_CODECS)
+def test_removed_dataclass_is_rejected(codec, monkeypatch):
+    raw = encode(MovedPoint(1.0, 2.0), codec)
+    monkeypatch.delattr(sys.modules[__name__], 'MovedPoint')
+    with pytest.raises(CodecError, match='Unknown class'):
+        decode(raw, codec)
@@ -0,0 +1,85 @@
+import pytest
+from geopy import distance
+from pydantic import ValidationError
+
+from common.geofence import Geofence, geofence
+from request.course import RollCall, UpdateRollCall
+
+CENTER = (21.0285, 105.8542)
+
+
+def point(meters: float, bearing: float = 0, center=CENTER):
+    destination = distance.distance(meters=meters).destination(center, bearing)
+    return destination.latitude, destination.longitude
+
+
+@pytest.mark.parametrize('bearing', [0, 45, 90, 200])
+def test_truncated_distance_equal_to_the_radius_is_inside(bearing):
+    fence = Geofence(*CENTER, 30)
+    assert fence.contains(*point(30.0, bearing))
+    assert fence.contains(*point(30.9, bearing))
+    assert not fence.contains(*point(31.05, bearing))
+
+
+def test_fractional_radius_is_truncated():
+    fence = Geofence(*CENTER, 30.7)
+    assert fence.contains(*point(30.9))
+    assert not fence.contains(*point(31.05))
+
+
+def test_points_in_the_margin_are_checked_with_the_geodesic(monkeypatch):
+    fence = Geofence(*CENTER, 30)
+    calls = []
+    geodesic = fence.geodesic
+
+    def counted(lat, long):
+        calls.append((lat, long))
+        return geodesic(lat, long)
+
+    monkeypatch.setattr(fence, 'geodesic', counted)
+    assert fence.contains(*point(5))
+    assert not fence.contains(*point(100))
+    assert calls == []
+    assert fence.contains(*point(30.5))
+    assert not fence.contains(*point(31.5))
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize('lat', [-60.0, 0.0, 21.0285, 60.0])
+@pytest.mark.parametrize('radius', [10, 30, 100, 500])
+def test_estimate_stays_within_the_margin(lat, radius):
+    center = (lat, 105.8542)
+    fence = Geofence(*center, radius)
+    margin = fence.outer - fence.limit
+    for bearing in range(0, 360, 30):
+        lat_, long_ = point(fence.limit, bearing, center)
+        assert abs(fence.estimate(lat_, long_) - fence.geodesic(lat_, long_)) <= margin
+
+
+def test_contains_many_matches_contains():
+    fence = Geofence(*CENTER, 30)
+    points = [point(meters, bearing) for meters in (0, 10, 29.5, 30.5, 30.95, 31.05, 31.5, 40, 1000)
+              for bearing in (0, 135, 270)]
+    inside = fence.contains_many([lat for lat, _ in points], [long for _, long in points])
+    assert list(inside) == [fence.contains(lat, long) for lat, long in points]
+
+
+def test_contains_many_without_points():
+    assert len(Geofence(*CENTER, 30).contains_many([], [])) == 0
+
+
+def test_geofence_is_shared():
+    assert geofence(*CENTER, 30) is geofence(*CENTER, 30)
+
+
+@pytest.mark.parametrize('radius', [0, -5])
+def test_roll_call_radius_must_be_positive(radius):
+    with pytest.raises(ValidationError):
+        RollCall(startAt=1, expireAt=2, mac='aa:bb', lat=1, long=2, radius=radius)
+    with pytest.raises(ValidationError):
+        UpdateRollCall(radius=radius)
+
+
+def test_roll_call_radius_is_optional():
+    assert RollCall(startAt=1, expireAt=2, mac='aa:bb', lat=1, long=2).radius is None
+    assert UpdateRollCall(radius=50).radius == 50
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+
+import mongomock
+import pytest
+from starlette.config import Config
+
+from common.id_allocator import AsyncIdAllocator, IdAllocator
+
+CONFIG = Config(environ={'ID_BLOCK_SIZE': '5'})
+
+
+class AsyncCursor:
+    def __init__(self, cursor) -> None:
+        self.cursor = cursor
+
+    def sort(self, *args):
+        return AsyncCursor(self.cursor.sort(*args))
+
+    def limit(self, limit: int):
+        return AsyncCursor(self.cursor.limit(limit))
+
+    async def to_list(self, length):
+        await asyncio.sleep(0)
+        return list(self.cursor)
+
+
+class AsyncCollection:
+    """The calls of AsyncIdAllocator on a mongomock collection, yielding to the loop like motor does."""
+
+    def __init__(self, collection) -> None:
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(0)
+            return method(*args, **kwargs)
+
+        return call
+
+
+class AsyncDatabase:
+    def __init__(self, db) -> None:
+        self.db = db
+
+    def __getitem__(self, name):
+        return AsyncCollection(self.db[name])
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+def test_ids_of_a_new_collection_start_at_one(db):
+    allocator = IdAllocator(db, CONFIG)
+    assert [allocator.next_id('course') for _ in range(7)] == [1, 2, 3, 4, 5, 6, 7]
+    assert db.counters.find_one({'_id': 'course'})['seq'] == 10
+
+
+def test_counter_of_an_existing_collection_is_seeded_after_its_highest_id(db):
+    db.course.insert_many([dict(id=3), dict(id=57), dict(id=12)])
+    assert IdAllocator(db, CONFIG).next_id('course') == 58
+
+
+def test_existing_counter_is_not_seeded_again(db):
+    db.counters.insert_one({'_id': 'course', 'seq': 100})
+    db.course.insert_one(dict(id=500))
+    assert IdAllocator(db, CONFIG).next_id('course') == 101
+
+
+def test_workers_get_separate_blocks(db):
+    first, second = IdAllocator(db, CONFIG), IdAllocator(db, CONFIG)
+    assert [first.next_id('course'), second.next_id('course'), first.next_id('course')] == [1, 6, 2]
+    # Collections have their own counters
+    assert second.next_id('user') == 1
+
+
+def test_concurrent_ids_are_unique(db):
+    allocator, ids = IdAllocator(db, CONFIG), []
+
+    def allocate():
+        for _ in range(50):
+            ids.append(allocator.next_id('course'))
+
+    threads = [threading.Thread(target=allocate) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # A single worker hands out its blocks without gaps
+    assert sorted(ids) == list(range(1, 401))
+
+
+def test_async_seeding_and_concurrent_ids(db):
+    db.course.insert_one(dict(id=40))
+    first, second = AsyncIdAllocator(AsyncDatabase(db), CONFIG), AsyncIdAllocator(AsyncDatabase(db), CONFIG)
+
+    async def run():
+        return await asyncio.gather(*[allocator.next_id('course') for allocator in (first, second)
+                                      for _ in range(30)])
+
+    ids = asyncio.run(run())
+    assert len(set(ids)) == 60
+    assert min(ids) == 41
+    assert db.counters.find_one({'_id': 'course'})['seq'] == 100
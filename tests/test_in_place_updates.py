@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+import mongomock
+import pytest
+
+from common.utils import MongoUtils
+from service.course import BaseClassService
+
+
+@pytest.fixture
+def courses():
+    collection = mongomock.MongoClient().db.courses
+    collection.insert_one(dict(id=1, members=[dict(id=2, name='An')], quantity=1))
+    return collection
+
+
+# mongomock re-applies the filter after the update and returns None even when the value was pushed,
+# so these tests check the stored document
+def test_new_value_is_pushed_and_counted(courses):
+    MongoUtils.push_unique(courses, {'id': 1}, 'members', dict(id=3, name='Binh'), key='id', counter='quantity')
+    course = courses.find_one({'id': 1})
+    assert course['members'] == [dict(id=2, name='An'), dict(id=3, name='Binh')]
+    assert course['quantity'] == 2
+
+
+def test_existing_key_is_not_pushed_again(courses):
+    result = MongoUtils.push_unique(courses, {'id': 1}, 'members', dict(id=2, name='An Nguyen'), key='id',
+                                    counter='quantity')
+    assert result is None
+    course = courses.find_one({'id': 1})
+    assert course['members'] == [dict(id=2, name='An')]
+    assert course['quantity'] == 1
+
+
+def test_equal_value_is_not_pushed_again(courses):
+    courses.insert_one(dict(id=5, courses=['a']))
+    assert MongoUtils.push_unique(courses, {'id': 5}, 'courses', 'a') is None
+    MongoUtils.push_unique(courses, {'id': 5}, 'courses', 'b')
+    assert courses.find_one({'id': 5})['courses'] == ['a', 'b']
+
+
+def test_missing_document_is_not_created(courses):
+    assert MongoUtils.push_unique(courses, {'id': 9}, 'members', dict(id=3), key='id', counter='quantity') is None
+    assert courses.count_documents({}) == 1
+
+
+def user(user_id: int, name: str, account_type: int = 1):
+    return SimpleNamespace(id=user_id, name=name, accountType=account_type)
+
+
+def test_seen_is_matched_on_the_user_id():
+    notifications = [dict(id=1, listSeen=[dict(userId=2, name='An')]), dict(id=2, listSeen=[])]
+    # Renamed since reading the first notification
+    seen = BaseClassService.mark_seen(notifications, user(2, 'An Nguyen'))
+    assert [item['isSeen'] for item in seen] == [True, False]
+
+
+def test_lecturer_has_seen_every_notification():
+    seen = BaseClassService.mark_seen([dict(id=1, listSeen=[])], user(7, 'Lecturer', account_type=2))
+    assert seen[0]['isSeen']
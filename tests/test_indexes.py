@@ -0,0 +1,93 @@
+import logging
+
+import mongomock
+import pytest
+from pymongo import IndexModel
+from pymongo.errors import ServerSelectionTimeoutError
+from starlette.config import Config
+
+from common.indexes import IndexRegistry
+
+COLLECTION = ('COL_ITEMS', 'items')
+
+PLAN = {'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': 'id_1'}}}}
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+@pytest.fixture
+def registry():
+    registry = IndexRegistry()
+    registry.declare(COLLECTION, IndexModel([('id', 1)], unique=True, name='id_1'),
+                     IndexModel([('classId', 1), ('createdAt', -1)], name='classId_1_createdAt_-1'))
+    registry.declare_query(COLLECTION, {'id': 0})
+    return registry
+
+
+def config(mode: str, **environ) -> Config:
+    return Config(environ=dict(environ, MONGO_INDEXES=mode))
+
+
+def names(db, name: str = 'items'):
+    return set(db[name].index_information()) - {'_id_'}
+
+
+def test_ensure_creates_the_declared_indexes(db, registry):
+    registry.bootstrap(db, config('ensure'))
+    assert names(db) == {'id_1', 'classId_1_createdAt_-1'}
+    assert registry.missing(db, config('ensure'), COLLECTION) == []
+
+
+def test_collection_names_come_from_the_config(db, registry):
+    registry.bootstrap(db, config('ensure', COL_ITEMS='renamed'))
+    assert names(db, 'renamed') == {'id_1', 'classId_1_createdAt_-1'}
+    assert names(db) == set()
+
+
+def test_ensure_goes_on_after_an_index_fails(db, registry, caplog):
+    db.items.insert_many([dict(id=1), dict(id=1)])
+    with caplog.at_level(logging.ERROR, logger='common.indexes'):
+        registry.bootstrap(db, config('ensure'))
+    assert names(db) == {'classId_1_createdAt_-1'}
+    assert 'Can\'t create index id_1 on items' in caplog.text
+
+
+def test_index_with_other_options_is_missing(db, registry):
+    db.items.create_indexes([IndexModel([('id', 1)], name='id_1')])
+    missing = registry.missing(db, config('dry-run'), COLLECTION)
+    assert [index.document['name'] for index in missing] == ['id_1', 'classId_1_createdAt_-1']
+
+
+def test_dry_run_only_logs(db, registry, caplog, monkeypatch):
+    db.items.create_indexes([IndexModel([('id', 1)], unique=True, name='id_1')])
+    # mongomock has no explain()
+    monkeypatch.setattr(mongomock.collection.Cursor, 'explain', lambda cursor: PLAN, raising=False)
+    with caplog.at_level(logging.INFO, logger='common.indexes'):
+        registry.bootstrap(db, config('dry-run'))
+    assert names(db) == {'id_1'}
+    assert '[dry-run] missing index on items' in caplog.text and 'classId_1_createdAt_-1' in caplog.text
+    assert "[dry-run] items {'id': 0} sort=None -> FETCH <- IXSCAN(id_1)" in caplog.text
+
+
+def test_off_skips(db, registry):
+    registry.bootstrap(db, config('off'))
+    assert db.list_collection_names() == []
+
+
+def test_unreachable_mongo_is_skipped(db, registry, monkeypatch, caplog):
+    def unreachable(*args, **kwargs):
+        raise ServerSelectionTimeoutError('no servers')
+
+    monkeypatch.setattr(mongomock.collection.Collection, 'create_indexes', unreachable)
+    with caplog.at_level(logging.ERROR, logger='common.indexes'):
+        registry.bootstrap(db, config('ensure'))
+    assert 'mongo is unreachable' in caplog.text
+
+
+def test_describe_plan_follows_the_first_input():
+    plan = {'stage': 'SORT', 'inputStage': {'stage': 'OR', 'inputStages': [{'stage': 'IXSCAN', 'indexName': 'a_1'},
+                                                                           {'stage': 'IXSCAN', 'indexName': 'b_1'}]}}
+    assert IndexRegistry.describe_plan(plan) == 'SORT <- OR <- IXSCAN(a_1)'
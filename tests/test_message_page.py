@@ -0,0 +1,99 @@
+from bson import ObjectId
+import mongomock
+import pytest
+
+from service.user import BaseUserService
+
+
+@pytest.fixture
+def messages():
+    collection = mongomock.MongoClient().db.message
+    # Several messages share a second, the _id breaks the tie
+    for index, send_at in enumerate([1, 2, 2, 2, 3, 4, 4]):
+        collection.insert_one(dict(conversationId=1, content=str(index), sendAt=send_at))
+    collection.insert_one(dict(conversationId=2, content='other', sendAt=2))
+    return collection
+
+
+def page(collection, before=None, after=None, limit=3):
+    query, sort = BaseUserService.page_query(1, before, after)
+    found = list(collection.find(query, {'content': 1, 'sendAt': 1}).sort(sort).limit(limit))
+    return BaseUserService.page_response(found, sort, limit, after)
+
+
+def test_before_cursors_walk_every_message_once(messages):
+    contents, before = [], None
+    while True:
+        current = page(messages, before=before)
+        contents += [message['content'] for message in current['messages']]
+        before = current['before']
+        if before is None:
+            break
+    assert contents == ['6', '5', '4', '3', '2', '1', '0']
+
+
+def test_pages_are_newest_first_without_ids(messages):
+    current = page(messages)
+    assert [message['content'] for message in current['messages']] == ['6', '5', '4']
+    assert all('_id' not in message for message in current['messages'])
+
+
+def test_after_cursor_returns_newer_messages(messages):
+    oldest = page(messages, before=page(messages, before=page(messages)['before'])['before'])
+    assert [message['content'] for message in oldest['messages']] == ['0']
+    newer = page(messages, after=oldest['after'])
+    assert [message['content'] for message in newer['messages']] == ['3', '2', '1']
+
+
+def test_after_cursor_of_the_newest_page_is_kept_when_nothing_is_new(messages):
+    newest = page(messages)
+    current = page(messages, after=newest['after'])
+    assert current['messages'] == []
+    assert current['after'] == newest['after']
+
+
+def test_last_page_has_no_before_cursor(messages):
+    assert page(messages, limit=10)['before'] is None
+
+
+@pytest.mark.parametrize('cursor', ['abc', '12_notanobjectid', '_'])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        BaseUserService.page_query(1, before=cursor)
+
+
+def deliver(conversations, message):
+    result = conversations.update_one(BaseUserService.newer_message_query(1, message),
+                                      BaseUserService.conversation_update(message))
+    if result.matched_count == 0:
+        conversations.update_one({'id': 1}, BaseUserService.message_count_update())
+
+
+def test_last_message_only_moves_forward():
+    collection = mongomock.MongoClient().db.message
+    conversations = mongomock.MongoClient().db.conversation
+    conversations.insert_one(dict(id=1, totalMessage=0, lastActive=2))
+    sent = []
+    for content, send_at in [('a', 2), ('b', 3), ('c', 3)]:
+        message = dict(conversationId=1, senderUuid='u', content=content, sendAt=send_at, isSeen=False)
+        collection.insert_one(message)
+        sent.append(message)
+
+    # The updates land newest first, the older ones only count
+    for message in reversed(sent):
+        deliver(conversations, message)
+
+    conversation = conversations.find_one({'id': 1})
+    assert conversation['totalMessage'] == 3
+    assert conversation['lastActive'] == 3
+    assert conversation['lastMessage']['content'] == 'c'
+    assert conversation['lastMessage']['messageId'] == sent[-1]['_id']
+
+
+def test_last_message_written_before_message_ids_is_replaced_on_the_same_second():
+    conversations = mongomock.MongoClient().db.conversation
+    conversations.insert_one(dict(id=1, totalMessage=1, lastActive=3,
+                                  lastMessage=dict(senderUuid='u', content='old', sendAt=3, isSeen=False)))
+    message = dict(_id=ObjectId(), conversationId=1, senderUuid='u', content='new', sendAt=3, isSeen=False)
+    deliver(conversations, message)
+    assert conversations.find_one({'id': 1})['lastMessage']['content'] == 'new'
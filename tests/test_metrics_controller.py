@@ -0,0 +1,23 @@
+from starlette.config import Config
+
+from common.admission import ADMISSION_KEY
+from controller.metrics import MetricsController
+
+
+def controller(token: str = None) -> MetricsController:
+    environ = {} if token is None else {'METRICS_TOKEN': token}
+    return MetricsController(None, None, None, Config(environ=environ))
+
+
+def test_metrics_are_off_without_a_token():
+    assert controller().get_metrics(metrics_token='').status_code == 404
+    assert controller('').get_metrics(metrics_token='').status_code == 404
+
+
+def test_metrics_need_the_token():
+    assert controller('sekret').get_metrics(metrics_token=None).status_code == 403
+    assert controller('sekret').get_metrics(metrics_token='wrong').status_code == 403
+
+
+def test_metrics_route_is_rate_limited():
+    assert getattr(MetricsController.get_metrics, ADMISSION_KEY)['rate'] > 0
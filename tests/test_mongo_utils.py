@@ -0,0 +1,35 @@
+import mongomock
+import pytest
+
+from common.utils import MongoUtils
+
+
+@pytest.fixture
+def courses():
+    collection = mongomock.MongoClient().db.courses
+    collection.insert_many([dict(uuid=uuid, name='course ' + uuid, lecturerId=1) for uuid in 'abcd'])
+    return collection
+
+
+def test_find_ordered_follows_the_values(courses):
+    docs = MongoUtils.find_ordered(courses, 'uuid', ['c', 'a', 'd'], {'_id': 0})
+    assert [doc['uuid'] for doc in docs] == ['c', 'a', 'd']
+
+
+def test_find_ordered_skips_missing_values(courses):
+    docs = MongoUtils.find_ordered(courses, 'uuid', ['x', 'b', 'y'], {'_id': 0})
+    assert [doc['uuid'] for doc in docs] == ['b']
+
+
+def test_find_ordered_without_values_returns_nothing(courses):
+    assert MongoUtils.find_ordered(courses, 'uuid', [], {'_id': 0}) == []
+
+
+def test_find_ordered_strips_an_excluded_lookup_field(courses):
+    docs = MongoUtils.find_ordered(courses, 'uuid', ['d', 'b'], {'_id': 0, 'uuid': 0})
+    assert docs == [dict(name='course d', lecturerId=1), dict(name='course b', lecturerId=1)]
+
+
+def test_find_ordered_strips_a_lookup_field_left_out_of_an_inclusion(courses):
+    docs = MongoUtils.find_ordered(courses, 'uuid', ['b', 'a'], {'_id': 0, 'name': 1})
+    assert docs == [dict(name='course b'), dict(name='course a')]
@@ -0,0 +1,122 @@
+import asyncio
+import time
+
+import fakeredis
+import pytest
+from starlette.config import Config
+
+from service.roll_call_state import RollCallState
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def state(server):
+    return RollCallState(fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server),
+                         Config(environ={'ROLL_CALL_STATE_GRACE': '60'}))
+
+
+def roll_call(roll_call_id: int, ends_in: float = 600) -> dict:
+    now = time.time()
+    return dict(id=roll_call_id, classId=1, startAt=now - 10, expireAt=now + ends_in, mac='m', lat=10.0,
+                long=106.0, radius=50, total=0)
+
+
+def test_published_roll_call_is_loaded_with_its_count(state):
+    state.publish(roll_call(1), [7, 8])
+    loaded, checked = state.load(1, 7)
+    assert checked is True
+    assert loaded['id'] == 1 and loaded['radius'] == 50 and loaded['count'] == 2
+    assert state.load(1, 9)[1] is False
+    assert state.load(1)[1] is False
+    assert state.load(2) is None
+
+
+def test_mark_claims_a_checkin_once(state):
+    ends_at = roll_call(1)['expireAt']
+    state.publish(roll_call(1))
+    assert state.mark(1, ends_at, 7) is True
+    assert state.mark(1, ends_at, 7) is False
+    assert state.load(1, 7) == (state.load(1)[0], True)
+    assert state.load(1)[0]['count'] == 1
+
+
+def test_unmark_releases_the_claim(state):
+    ends_at = roll_call(1)['expireAt']
+    state.publish(roll_call(1))
+    state.mark(1, ends_at, 7)
+    state.unmark(1, 7)
+    assert state.load(1, 7)[1] is False
+    assert state.mark(1, ends_at, 7) is True
+
+
+def test_mark_many(state):
+    state.publish(roll_call(1), [7])
+    state.mark_many(1, roll_call(1)['expireAt'], [7, 8, 9])
+    assert state.load(1)[0]['count'] == 3
+    state.mark_many(1, roll_call(1)['expireAt'], [])
+
+
+def test_keys_expire_a_grace_period_after_the_roll_call(state):
+    published = roll_call(1, ends_in=600)
+    state.publish(published, [7])
+    state.mark(1, published['expireAt'], 8)
+    for key in (state.state_key(1), state.members_key(1)):
+        assert state.redis.expiretime(key) == int(published['expireAt']) + 60
+
+
+def test_update_moves_the_expiry(state):
+    state.publish(roll_call(1, ends_in=600), [7])
+    updated = roll_call(1, ends_in=1200)
+    state.publish(updated, [7])
+    assert state.redis.expiretime(state.members_key(1)) == int(updated['expireAt']) + 60
+
+
+def test_ended_roll_call_is_gone_after_the_grace(server):
+    state = RollCallState(fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server),
+                          Config(environ={'ROLL_CALL_STATE_GRACE': '0'}))
+    state.publish(roll_call(1, ends_in=-5), [7])
+    assert state.load(1, 7) is None
+    assert state.mark(1, time.time() - 5, 8) is True
+    assert state.redis.exists(state.members_key(1)) == 0
+
+
+def test_redis_errors_fall_back_to_mongo(server, state):
+    state.publish(roll_call(1), [7])
+    server.connected = False
+    assert state.load(1, 7) is None
+    assert state.mark(1, roll_call(1)['expireAt'], 8) is None
+    state.unmark(1, 7)
+    state.drop([1])
+
+
+def test_async_variants(state):
+    async def run():
+        await state.publish_async(roll_call(1), [7])
+        ends_at = roll_call(1)['expireAt']
+        assert await state.mark_async(1, ends_at, 8) is True
+        assert await state.mark_async(1, ends_at, 8) is False
+        await state.unmark_async(1, 8)
+        await state.mark_many_async(1, ends_at, [9, 10])
+        return await state.load_async(1, 8), await state.load_async(1, 9)
+
+    (loaded, unmarked), (_, marked) = asyncio.run(run())
+    assert loaded['count'] == 3 and unmarked is False and marked is True
+
+
+def test_drop_forgets_the_roll_calls(state):
+    state.publish(roll_call(1), [7])
+    state.publish(roll_call(2), [8])
+    state.drop([1])
+    assert state.load(1, 7) is None
+    assert state.redis.exists(state.members_key(1)) == 0
+    assert state.load(2, 8)[1] is True
+
+
+def test_drop_async(state):
+    state.publish(roll_call(1), [7])
+    asyncio.run(state.drop_async([1]))
+    assert state.redis.keys('roll_call:*') == []
@@ -0,0 +1,166 @@
+import asyncio
+import time
+
+import fakeredis
+import pytest
+
+from common.tiered_cache import InvalidationBus, TieredCache
+
+TOKEN = 't' * 50
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def worker(server, **options):
+    """Cache of one worker process, with its own clients and invalidation bus."""
+    redis, async_redis = fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server)
+    return TieredCache(redis, async_redis, InvalidationBus(redis, async_redis), 'token-user', **options)
+
+
+def eventually(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+def local(cache: TieredCache, key: str):
+    return cache.local.get(cache._digest(key))
+
+
+def fill(cache: TieredCache, key: str, value, tags=()):
+    cache.set(key, value, cache.begin_fill(), tags=tags)
+
+
+def test_value_is_shared_through_redis(server):
+    first, second = worker(server), worker(server)
+    fill(first, TOKEN, 'user 1', tags=['user:1'])
+    assert second.get(TOKEN) == 'user 1'
+    assert local(second, TOKEN) == 'user 1'
+
+
+def test_access_token_never_reaches_redis_or_the_bus(server):
+    cache = worker(server)
+    redis = fakeredis.FakeRedis(server=server)
+    pubsub = redis.pubsub()
+    pubsub.subscribe(cache.channel)
+    fill(cache, TOKEN, 'user 1', tags=['user:1'])
+    cache.invalidate(keys=[TOKEN])
+    messages = [pubsub.get_message(timeout=1.0) for _ in range(2)]
+    assert all(TOKEN.encode() not in key for key in redis.keys('*'))
+    assert all(TOKEN.encode() not in message['data'] for message in messages if message['type'] == 'message')
+
+
+def test_invalidated_key_is_dropped_by_every_worker(server):
+    first, second = worker(server), worker(server)
+    fill(first, TOKEN, 'user 1', tags=['user:1'])
+    second.get(TOKEN)
+    first.invalidate(keys=[TOKEN])
+    assert eventually(lambda: local(second, TOKEN) is None)
+    assert second.get(TOKEN) is None
+
+
+def test_invalidated_tag_drops_every_tagged_key(server):
+    first, second = worker(server), worker(server)
+    fill(first, 'a' * 50, 'user 1', tags=['user:1'])
+    fill(first, 'b' * 50, 'user 1', tags=['user:1'])
+    fill(first, 'c' * 50, 'user 2', tags=['user:2'])
+    for key in ('a' * 50, 'b' * 50, 'c' * 50):
+        second.get(key)
+    first.invalidate(tags=['user:1'])
+    assert eventually(lambda: local(second, 'a' * 50) is None and local(second, 'b' * 50) is None)
+    assert second.get('a' * 50) is None
+    assert second.get('b' * 50) is None
+    assert second.get('c' * 50) == 'user 2'
+
+
+def test_local_tier_expires(server):
+    cache = worker(server, ttl=0.2)
+    fill(cache, TOKEN, 'user 1')
+    time.sleep(0.3)
+    assert local(cache, TOKEN) is None
+    # Still in redis
+    assert cache.get(TOKEN) == 'user 1'
+
+
+def test_logout_during_fill_isnt_stored(server):
+    first, second = worker(server), worker(server)
+    started = first.begin_fill()
+    # Another worker logs the user out while the first one reads Mongo
+    second.invalidate(keys=[TOKEN])
+    first.set(TOKEN, 'user 1', started, tags=['user:1'])
+    assert first.get(TOKEN) is None
+    assert second.get(TOKEN) is None
+
+
+def test_tag_invalidated_during_fill_isnt_stored(server):
+    first, second = worker(server), worker(server)
+    started = first.begin_fill()
+    second.invalidate(tags=['user:1'])
+    first.set(TOKEN, 'user 1', started, tags=['user:1'])
+    assert first.get(TOKEN) is None
+
+
+def test_local_invalidation_during_fill_isnt_stored(server):
+    cache = worker(server)
+    server.connected = False
+    started = cache.begin_fill()
+    cache.invalidate(keys=[TOKEN])
+    cache.set(TOKEN, 'user 1', started)
+    assert local(cache, TOKEN) is None
+
+
+def test_fill_started_after_the_invalidation_is_stored(server):
+    first, second = worker(server), worker(server)
+    second.invalidate(tags=['user:1'])
+    time.sleep(0.01)
+    fill(first, TOKEN, 'user 1', tags=['user:1'])
+    assert second.get(TOKEN) == 'user 1'
+
+
+def test_redis_errors_degrade_to_the_local_tier(server):
+    cache = worker(server)
+    server.connected = False
+    fill(cache, TOKEN, 'user 1')
+    assert cache.get(TOKEN) == 'user 1'
+    cache.invalidate(keys=[TOKEN])
+    assert cache.get(TOKEN) is None
+
+
+def test_reconnected_bus_flushes_the_local_tier(server):
+    first, second = worker(server), worker(server)
+    fill(first, TOKEN, 'user 1')
+    second.get(TOKEN)
+    # Invalidations published while the bus is down are lost, every local entry is dropped once it is back
+    server.connected = False
+    time.sleep(1.2)
+    server.connected = True
+    assert eventually(lambda: local(second, TOKEN) is None)
+
+
+def test_disabled(server):
+    cache = worker(server, enabled=False)
+    assert cache.begin_fill() is None
+    fill(cache, TOKEN, 'user 1')
+    assert cache.get(TOKEN) is None
+
+
+def test_coroutine_variants(server):
+    first, second = worker(server), worker(server)
+
+    async def run():
+        await first.aset(TOKEN, 'user 1', await first.abegin_fill(), tags=['user:1'])
+        assert await second.aget(TOKEN) == 'user 1'
+        started = await first.abegin_fill()
+        await second.ainvalidate(tags=['user:1'])
+        await first.aset(TOKEN, 'user 1', started, tags=['user:1'])
+        assert await second.aget(TOKEN) is None
+
+    asyncio.run(run())
+    # The local tier of the other worker drops the value once the bus delivers the invalidation
+    assert eventually(lambda: local(first, TOKEN) is None)
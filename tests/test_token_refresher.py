@@ -0,0 +1,99 @@
+import time
+from datetime import timedelta
+
+import pytest
+from pymongo import UpdateOne
+from pymongo.errors import AutoReconnect
+from starlette.config import Config
+
+from common import lifecycle
+from service.token_refresher import TokenRefresher
+
+
+class Tokens:
+    """Token collection recording the bulk writes, mongomock's bulk_write doesn't take pymongo 4 operations."""
+
+    def __init__(self) -> None:
+        self.writes = []
+        self.failures = 0
+
+    def bulk_write(self, requests, ordered=True):
+        assert ordered is False
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect('connection lost')
+        self.writes.append(list(requests))
+
+
+@pytest.fixture
+def tokens():
+    return Tokens()
+
+
+@pytest.fixture
+def refresher(tokens):
+    hooks = list(lifecycle.__SHUTDOWN_HOOKS__)
+    refresher = TokenRefresher({'token': tokens}, Config(environ={'TOKEN_REFRESH_INTERVAL': '60',
+                                                                  'TOKEN_REFRESH_BATCH_SIZE': '3'}))
+    yield refresher
+    refresher.close()
+    lifecycle.__SHUTDOWN_HOOKS__[:] = hooks
+
+
+def refreshed(key, expired_at):
+    return UpdateOne({'key': key}, {'$max': {'__expiredAt': expired_at}})
+
+
+def eventually(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_touches_are_coalesced_into_one_write(refresher, tokens):
+    refresher.touch('a')
+    latest = refresher.touch('a')
+    refresher.touch('b')
+    assert tokens.writes == []
+    assert refresher.flush() == 2
+    assert len(tokens.writes) == 1
+    assert refreshed('a', latest) in tokens.writes[0]
+    assert refresher.flush() == 0
+    assert refresher.metrics()['flushes'] == 1 and refresher.metrics()['flushed'] == 2
+
+
+def test_touch_slides_the_expiry_by_seven_days(refresher):
+    before = time.time()
+    expired_at = refresher.touch('a')
+    assert before + timedelta(7).total_seconds() <= expired_at.timestamp() <= time.time() + timedelta(7).total_seconds()
+
+
+def test_full_batch_wakes_the_flusher(refresher, tokens):
+    for key in 'abc':
+        refresher.touch(key)
+    assert eventually(lambda: sum(len(write) for write in tokens.writes) == 3)
+    assert refresher.metrics()['pending'] == 0
+
+
+def test_failed_flush_keeps_the_tokens(refresher, tokens):
+    refresher.touch('a')
+    tokens.failures = 1
+    assert refresher.flush() == 0
+    assert refresher.metrics()['failures'] == 1 and refresher.metrics()['pending'] == 1
+    latest = refresher.touch('a')
+    assert refresher.flush() == 1
+    assert tokens.writes == [[refreshed('a', latest)]]
+
+
+def test_close_flushes_and_stops(refresher, tokens):
+    refresher.touch('a')
+    refresher.close()
+    assert not refresher._thread.is_alive()
+    assert [len(write) for write in tokens.writes] == [1]
+
+
+def test_close_is_a_shutdown_hook(refresher):
+    assert refresher.close in lifecycle.__SHUTDOWN_HOOKS__